@@ -0,0 +1,196 @@
+# aioserver.py
+import asyncio
+import json
+import threading
+import time
+
+from canbus import bus_manager
+from protocol import MSG_JSON, FrameDecoder, pack_json
+from pubsub import CoalescingQueue, Subscription
+from server import RPIServer, filter_nodes
+
+
+class AsyncClientSession:
+    """Клиент asyncio-сервера: тот же интерфейс, что у ClientSession"""
+
+    # Максимум неотправленных ответов на команды до отключения клиента
+    MAX_REPLIES = 256
+
+    def __init__(self, reader, writer, encode, loop, stats=None):
+        self.reader = reader
+        self.writer = writer
+        self.encode = encode
+        self.stats = stats
+        peer = writer.get_extra_info('peername')
+        self.name = '%s:%d' % peer[:2] if peer else '?'
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.subscription = Subscription()
+        self.subscribed = False
+        self.closed = False
+        self.replies = []
+        self.event = asyncio.Event()
+        self.updates = CoalescingQueue(notify=self.wakeup)
+
+    def wakeup(self):
+        # Из потока цикла - напрямую, из пула потоков команд - через цикл
+        if threading.get_ident() == self.loop_thread:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def offer(self, node_id, state):
+        if self.subscribed:
+            nodes = self.subscription.nodes
+            if nodes is None or node_id in nodes:
+                self.updates.put(node_id, state)
+
+    def subscribe(self, subscription, rate, max_hz, snapshot):
+        self.updates.configure(rate, max_hz, subscription.deadband)
+        self.subscription = subscription
+        self.subscribed = True
+        self.updates.put_many(filter_nodes(snapshot, subscription.nodes))
+
+    def unsubscribe(self):
+        self.subscribed = False
+        self.updates.clear()
+
+    def reply(self, response):
+        if len(self.replies) >= self.MAX_REPLIES:
+            print("Клиент не читает ответы, отключение")
+            if self.stats is not None:
+                self.stats.count('slow_clients')
+            self.close()
+            return
+        self.replies.append(pack_json(response))
+        self.wakeup()
+
+    def close(self):
+        self.closed = True
+        self.wakeup()
+
+    async def writer_task(self):
+        """Отправка с учетом заполнения буфера сокета (drain)"""
+        try:
+            while not self.closed:
+                delay = self.updates.delay()
+                if not self.replies and delay != 0:
+                    self.event.clear()
+                    try:
+                        await asyncio.wait_for(self.event.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                frames, self.replies = self.replies, []
+                batch = self.updates.take()
+                if batch:
+                    started = time.monotonic()
+                    frames.append(self.encode(batch, self.subscription))
+                    if self.stats is not None:
+                        self.stats.serialized(batch, started)
+                if frames:
+                    started = time.monotonic()
+                    self.writer.write(b''.join(frames))
+                    # Медленный клиент ждет здесь, не задерживая остальных
+                    await self.writer.drain()
+                    if batch and self.stats is not None:
+                        self.stats.sent(batch, started)
+        except (ConnectionError, OSError) as e:
+            print(f"Ошибка отправки клиенту: {e}")
+        finally:
+            self.closed = True
+            self.writer.close()
+
+
+class AsyncRPIServer(RPIServer):
+    """
+    Однопоточный asyncio-вариант RPIServer
+
+    Прием CAN - через can.Notifier общей шины в цикле событий, по задаче
+    отправки на клиента. Блокирующие команды (ожидание ответов двигателя,
+    смена ID) выполняются в пуле потоков и не останавливают цикл.
+    """
+
+    def __init__(self,
+                 host='0.0.0.0',
+                 port=5000,
+                 backlog=100,
+                 record_path=None,
+                 channel='can0',
+                 interface='socketcan',
+                 history_depth=10000,
+                 metrics_port=None):
+        super().__init__(host, port, record_path, channel, interface,
+                         history_depth, metrics_port)
+        self.backlog = backlog
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        # Прием общих шин каналов в цикле событий: для socketcan -
+        # add_reader на сокете, без потока; обработчики TPDO вызываются в
+        # этом цикле
+        for worker in self.channels:
+            worker.monitor.bus.start(loop=loop)
+        self.start_recorder()
+        # HTTP-метрики - в своем потоке, цикл событий не затрагивают
+        self.start_metrics()
+        self.start_channels()
+
+        self.server = await asyncio.start_server(self.handle_connection,
+                                                 self.host,
+                                                 self.port,
+                                                 backlog=self.backlog)
+        print(f"Сервер (asyncio) запущен на {self.host}:{self.port}")
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            self.stop_channels()
+            self.executor.shutdown(wait=False)
+            if self.recorder is not None:
+                self.recorder.stop()
+            if self.metrics_server is not None:
+                self.metrics_server.shutdown()
+            bus_manager.shutdown_all()
+
+    async def handle_connection(self, reader, writer):
+        print(f"Подключение от {writer.get_extra_info('peername')}")
+        loop = asyncio.get_running_loop()
+        session = AsyncClientSession(reader, writer, self.encode_encoder_data,
+                                     loop, self.stats)
+        self.add_session(session)
+        sender = asyncio.create_task(session.writer_task())
+        decoder = FrameDecoder()
+
+        def deliver(response):
+            # Ответы команд с request_id из пула потоков - через цикл событий
+            loop.call_soon_threadsafe(session.reply, response)
+
+        try:
+            while not session.closed:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for msg_type, payload in decoder.feed(data):
+                    if msg_type != MSG_JSON:
+                        continue
+                    command = json.loads(payload.decode('utf-8'))
+                    if 'request_id' in command:
+                        self.submit(command, session, deliver)
+                        continue
+                    response = await loop.run_in_executor(
+                        None, self.process_command, command, session)
+                    session.reply(response)
+        except Exception as e:
+            print(f"Client error: {e}")
+        finally:
+            self.remove_session(session)
+            session.close()
+            await sender
+
+
+if __name__ == "__main__":
+    AsyncRPIServer().run()
@@ -0,0 +1,203 @@
+import concurrent.futures
+
+import can
+
+from canbus import get_bus
+from dc_motor import DC_COMMANDS, DC_SEND_ERRORS, motor_message
+from metrics import registry
+from step_motor import (STEP_ACK_TIMEOUTS, STEP_COMMANDS, STEP_SEND_ERRORS,
+                        MoveStepMotor)
+
+# Порядок выполнения пакета
+ORDER_PARALLEL = 'parallel'  # разные узлы одновременно, один узел - по порядку
+ORDER_SEQUENTIAL = 'sequential'  # строго по списку, по одной команде
+ORDERS = (ORDER_PARALLEL, ORDER_SEQUENTIAL)
+
+BATCH_COMMANDS = registry.counter('batch_commands_total',
+                                  'Команды в пакетах batch')
+
+
+def result(status, message, **extra):
+    return {"status": status, "message": message, **extra}
+
+
+class CommandBatch:
+    """
+    Пакет команд двигателей за один запрос
+
+    Команды dc_motor и step_motor разбираются и проверяются заранее, кадры
+    отправляются по общей шине канала. В режиме parallel команды разным
+    узлам идут волнами: кадры волны - подряд, подтверждения шаговых
+    двигателей ожидаются одновременно с общим таймаутом. Команды одного
+    узла сохраняют порядок (каждая - в следующей волне). Прочие команды
+    (change_id, sdo_read и т.д.) выполняются через process_command и
+    разделяют пакет: команды до них завершаются раньше, после - позже.
+
+    Шаговые двигатели подтверждают с общим ID 0x101: подтверждения волны
+    сопоставляются командам по порядку прихода, поэтому результат узла
+    означает "волна получила столько подтверждений", а не ответ конкретного
+    узла.
+    """
+
+    def __init__(self, channel, process_command, timeout=1.0):
+        """
+        :param channel: CAN-интерфейс двигателей
+        :param process_command: обработчик прочих команд (command) -> ответ
+        :param timeout: ожидание подтверждений шаговых двигателей, с
+        """
+        self.channel = channel
+        # Одна общая шина канала на все команды пакета
+        self.bus = get_bus(channel)
+        self.process_command = process_command
+        self.timeout = timeout
+        self.steppers = {}
+
+    def stepper(self, node_id):
+        motor = self.steppers.get(node_id)
+        if motor is None:
+            motor = self.steppers[node_id] = MoveStepMotor(
+                channel=self.channel, node_id=node_id)
+        return motor
+
+    def prepare(self, command):
+        """
+        Разбор команды: (узел, can.Message) для двигателей, None - прочие
+
+        :raises ValueError, KeyError, TypeError: недопустимые параметры
+        """
+        cmd_type = command.get('type')
+        args = command.get('args', {})
+        if cmd_type == 'dc_motor':
+            message = motor_message(args['motor_id'], args['power_state'],
+                                    args['direction'])
+            return ('dc', message.arbitration_id), message
+        if cmd_type == 'step_motor':
+            motor = self.stepper(args.get('node_id', 0x101))
+            data = motor.pack_command(args['power'], args['direction'],
+                                      args['steps'])
+            message = can.Message(arbitration_id=motor.node_id,
+                                  data=data,
+                                  is_extended_id=False)
+            return ('step', motor.node_id), message
+        if cmd_type in (None, 'batch'):
+            raise ValueError(f"Недопустимая команда в пакете: {cmd_type}")
+        return None
+
+    def run(self, commands, order=ORDER_PARALLEL, validate=False,
+            stop_on_error=False):
+        """
+        Выполнение пакета
+
+        :param commands: [{type, args}]
+        :param order: ORDER_PARALLEL или ORDER_SEQUENTIAL
+        :param validate: проверить все команды до отправки; при ошибке не
+                         отправляется ничего
+        :param stop_on_error: после первой неудачи остальные не выполняются
+                              (в parallel - после волны с неудачей;
+                              недопустимая команда - ничего не выполняется)
+        :return: результаты в порядке команд
+        """
+        if order not in ORDERS:
+            raise ValueError(f"Неизвестный порядок: {order}")
+        results = [None] * len(commands)
+        plans = [None] * len(commands)
+        for index, command in enumerate(commands):
+            try:
+                plans[index] = self.prepare(command)
+            except KeyError as e:
+                results[index] = result("error", f"Нет параметра {e}")
+            except (ValueError, TypeError) as e:
+                results[index] = result("error", f"Недопустимая команда: {e}")
+        if validate and any(results):
+            return [
+                item or result("skipped", "Пакет не выполнен: ошибки проверки")
+                for item in results
+            ]
+
+        # Этапы: волны команд двигателей и отдельные прочие команды
+        stages = []
+        waves = []
+        depth = {}
+        for index, plan in enumerate(plans):
+            if results[index] is not None and order == ORDER_PARALLEL:
+                continue
+            if plan is None or order == ORDER_SEQUENTIAL:
+                if waves:
+                    stages.extend(waves)
+                    waves, depth = [], {}
+                stages.append([index])
+                continue
+            node = plan[0]
+            wave = depth.get(node, 0)
+            depth[node] = wave + 1
+            if wave == len(waves):
+                waves.append([])
+            waves[wave].append(index)
+        stages.extend(waves)
+
+        # В parallel недопустимая команда - неудача до первой волны
+        failed = order == ORDER_PARALLEL and any(results)
+        for stage in stages:
+            if failed and stop_on_error:
+                for index in stage:
+                    results[index] = result("skipped",
+                                            "Пропущено после ошибки")
+                continue
+            self.run_stage(stage, commands, plans, results)
+            failed = any(results[index]['status'] != 'success'
+                         for index in stage)
+        BATCH_COMMANDS.add(len(commands))
+        return results
+
+    def run_stage(self, stage, commands, plans, results):
+        index = stage[0]
+        if results[index] is not None:
+            # Недопустимая команда (sequential): результат уже есть
+            return
+        if plans[index] is None:
+            try:
+                results[index] = self.process_command(commands[index])
+            except Exception as e:
+                results[index] = result("error", f"Ошибка выполнения: {e}")
+            return
+
+        # Кадры волны подряд, затем общее ожидание подтверждений
+        pending = {}
+        for index in stage:
+            (kind, node_id), message = plans[index]
+            future = None
+            if kind == 'step':
+                future = self.bus.expect(MoveStepMotor.RESPONSE_ID,
+                                         MoveStepMotor.is_ack)
+            try:
+                self.bus.send(message)
+            except can.CanError as e:
+                if future is not None:
+                    self.bus.discard(MoveStepMotor.RESPONSE_ID, future)
+                    STEP_SEND_ERRORS.inc()
+                else:
+                    DC_SEND_ERRORS.inc()
+                results[index] = result("error", f"Ошибка отправки: {e}")
+                continue
+            if future is not None:
+                STEP_COMMANDS.inc()
+                pending[index] = (self.steppers[node_id], future)
+            else:
+                DC_COMMANDS.inc(node_id)
+                results[index] = result("success",
+                                        f"DC {node_id:X}: отправлено")
+        if not pending:
+            return
+        concurrent.futures.wait([future for _, future in pending.values()],
+                                timeout=self.timeout)
+        for index, (motor, future) in pending.items():
+            if future.done():
+                motor.release()
+                results[index] = result(
+                    "success", f"Шаговый {motor.node_id:X}: подтверждено")
+            else:
+                self.bus.discard(MoveStepMotor.RESPONSE_ID, future)
+                STEP_ACK_TIMEOUTS.inc()
+                results[index] = result(
+                    "error", f"Шаговый {motor.node_id:X}: нет подтверждения "
+                    f"за {self.timeout} с")
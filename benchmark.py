@@ -0,0 +1,264 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import can
+import numpy as np
+
+from canbus import bus_manager, get_bus
+from dc_motor import send_motor_command as dc_send_command
+from encoders import MultiEncoderMonitor
+from motion import MotionEstimator
+from step_motor import MoveStepMotor
+
+# Нижняя граница скорости приема: полная шина 1 Мбит/с - около 9000
+# TPDO-кадров в секунду
+MIN_INGEST_RATE = 9000.0
+
+
+def bench_ingest(frames=100000,
+                 nodes=40,
+                 channel='bench_ingest',
+                 min_rate=MIN_INGEST_RATE):
+    """
+    Пропускная способность фонового приема энкодеров на интерфейсе virtual
+
+    :param frames: количество отправляемых TPDO-кадров
+    :param nodes: количество энкодеров (node_id 1..nodes)
+    :param channel: имя виртуального канала
+    :param min_rate: минимальная скорость приема, кадр/с
+    :return: (принято кадров, кадров в секунду, тест пройден)
+    """
+    node_ids = list(range(1, nodes + 1))
+    config_file = os.path.join(tempfile.mkdtemp(), 'encoder_config.json')
+    monitor = MultiEncoderMonitor(channel=channel,
+                                  node_ids=node_ids,
+                                  interface='virtual',
+                                  config_file=config_file)
+    sender = can.Bus(interface='virtual', channel=channel)
+    try:
+        monitor.start_ingest()
+        start = time.perf_counter()
+        for i in range(frames):
+            node_id = node_ids[i % nodes]
+            raw = (i * 7) & 0x3FF
+            sender.send(
+                can.Message(arbitration_id=0x180 + node_id,
+                            data=[raw & 0xFF, raw >> 8, 0, 0],
+                            is_extended_id=False))
+        deadline = time.perf_counter() + 10.0
+        while (monitor.frames_received < frames
+               and time.perf_counter() < deadline):
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        received = monitor.frames_received
+    finally:
+        monitor.stop_ingest()
+        sender.shutdown()
+        bus_manager.shutdown(channel)
+
+    rate = received / elapsed if elapsed > 0 else 0.0
+    print(f"Прием: {received}/{frames} кадров, {nodes} энкодеров, "
+          f"{rate:,.0f} кадр/с ({elapsed:.2f} с)")
+    passed = True
+    if received != frames:
+        print(f"!!! Потеряно кадров: {frames - received}")
+        passed = False
+    if rate < min_rate:
+        print(f"!!! Скорость приема ниже {min_rate:,.0f} кадр/с")
+        passed = False
+    return received, rate, passed
+
+
+def bench_commands(commands=2000, channel='bench_commands'):
+    """
+    Команд в секунду: новая шина на команду (как раньше) и общая шина
+
+    :param commands: количество команд DC-двигателя в каждом прогоне
+    :param channel: имя виртуального канала
+    :return: (команд/с до, команд/с после, циклов шагового/с)
+    """
+    message = can.Message(arbitration_id=0x201,
+                          data=[1, 1],
+                          is_extended_id=False)
+    # Эмулятор шагового двигателя: подтверждает 0xAA каждую команду с питанием
+    motor = can.Bus(interface='virtual', channel=channel)
+    running = True
+
+    def motor_loop():
+        while running:
+            msg = motor.recv(0.1)
+            if msg is not None and msg.arbitration_id == 0x101 and msg.data[0]:
+                motor.send(
+                    can.Message(arbitration_id=0x101,
+                                data=[0xAA],
+                                is_extended_id=False))
+
+    responder = threading.Thread(target=motor_loop, daemon=True)
+    responder.start()
+    try:
+        # До: шина открывается и закрывается на каждую команду
+        start = time.perf_counter()
+        for _ in range(commands):
+            with can.Bus(interface='virtual', channel=channel) as bus:
+                bus.send(message)
+        before = commands / (time.perf_counter() - start)
+
+        # После: одна общая шина канала
+        get_bus(channel, 'virtual')
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for _ in range(commands):
+                dc_send_command(channel, 201, 1, 1)
+            after = commands / (time.perf_counter() - start)
+
+            # Шаговый двигатель: команда + ожидание 0xAA на общей шине
+            cycles = max(commands // 10, 1)
+            motor_cmd = MoveStepMotor(channel=channel, interface='virtual')
+            start = time.perf_counter()
+            for _ in range(cycles):
+                motor_cmd.send_motor_command(1, 1, 100)
+            step_rate = cycles / (time.perf_counter() - start)
+    finally:
+        running = False
+        responder.join()
+        motor.shutdown()
+        bus_manager.shutdown(channel)
+
+    print(f"DC-команды: {before:,.0f} ком/с (шина на команду) -> "
+          f"{after:,.0f} ком/с (общая шина), x{after / before:.1f}")
+    print(f"Шаговый двигатель (команда + 0xAA): {step_rate:,.0f} циклов/с")
+    return before, after, step_rate
+
+
+def trajectory(kind, t):
+    """
+    Синтетическая траектория: (угол, скорость, ускорение) в моменты t
+
+    sine - синус 90° с периодом 2 с, ramp - постоянные 180 °/с,
+    trapezoid - разгон 1 с, 360 °/с, торможение 1 с (цикл 4 с).
+    """
+    if kind == 'sine':
+        w = np.pi
+        return (90 * np.sin(w * t), 90 * w * np.cos(w * t),
+                -90 * w * w * np.sin(w * t))
+    if kind == 'ramp':
+        return 180.0 * t, np.full_like(t, 180.0), np.zeros_like(t)
+    # Трапеция: a = 360 °/с² на [0, 1), 0 на [1, 3), -360 на [3, 4)
+    phase = t % 4.0
+    cycles = t // 4.0
+    acceleration = np.select([phase < 1, phase < 3], [360.0, 0.0], -360.0)
+    velocity = np.select([phase < 1, phase < 3],
+                         [360 * phase, 360.0], 360 * (4 - phase))
+    position = np.select([phase < 1, phase < 3], [
+        180 * phase**2, 180 + 360 * (phase - 1)
+    ], 1080 - 180 * (4 - phase)**2) + 1080 * cycles
+    return position, velocity, acceleration
+
+
+def bench_motion(rate=1000.0,
+                 seconds=10.0,
+                 jitters=(0.0, 0.0001, 0.001),
+                 resolution=1024,
+                 nodes=30):
+    """
+    Точность и устойчивость к джиттеру меток времени оценки движения
+
+    Энкодеры снимают угол строго с частотой rate, угол квантуется
+    разрешением энкодера, а метка времени кадра смещается на случайный
+    джиттер (нормальный, СКО из jitters) - как time.time() в потоке
+    приема вместо метки ядра.
+
+    :return: {(траектория, джиттер): (СКО скорости, СКО ускорения)}
+    """
+    kinds = ('sine', 'ramp', 'trapezoid')
+    step = 360.0 / resolution
+    rng = np.random.default_rng(0)
+    times = np.arange(0.0, seconds, 1.0 / rate)
+    warmup = times >= 0.5
+    node_ids = np.arange(nodes)
+    node_kinds = [kinds[i % len(kinds)] for i in range(nodes)]
+    truth = [trajectory(kind, times) for kind in node_kinds]
+    measured = np.array([np.round(position / step) * step
+                         for position, _, _ in truth])
+    results = {}
+    for jitter in jitters:
+        estimator = MotionEstimator()
+        velocity = np.zeros((nodes, len(times)))
+        acceleration = np.zeros((nodes, len(times)))
+        stamps = times + rng.normal(0.0, jitter, (nodes, len(times)))
+        slots = [estimator.slot(node_id) for node_id in node_ids]
+        for k in range(len(times)):
+            estimator.update_batch(node_ids, measured[:, k], stamps[:, k])
+            velocity[:, k] = estimator.velocity[slots]
+            acceleration[:, k] = estimator.acceleration[slots]
+        for kind in kinds:
+            rows = [i for i, name in enumerate(node_kinds) if name == kind]
+            v_error = np.concatenate([
+                velocity[i][warmup] - truth[i][1][warmup] for i in rows
+            ])
+            a_error = np.concatenate([
+                acceleration[i][warmup] - truth[i][2][warmup] for i in rows
+            ])
+            results[kind, jitter] = (float(np.sqrt(np.mean(v_error**2))),
+                                     float(np.sqrt(np.mean(a_error**2))))
+            print(f"{kind:10s} джиттер {jitter * 1e3:6.2f} мс: "
+                  f"СКО скорости {results[kind, jitter][0]:8.2f} °/с, "
+                  f"ускорения {results[kind, jitter][1]:10.1f} °/с²")
+
+    # Пропускная способность: пачки по 4096 кадров всех узлов
+    estimator = MotionEstimator()
+    batch = 4096
+    ids = np.tile(node_ids, batch // nodes + 1)[:batch]
+    positions = rng.normal(0.0, 1.0, batch).cumsum()
+    total = 0
+    start = time.perf_counter()
+    for k in range(50):
+        stamps = k + np.arange(batch) / batch
+        estimator.update_batch(ids, positions, stamps)
+        total += batch
+    elapsed = time.perf_counter() - start
+    print(f"Оценка движения: {total / elapsed:,.0f} кадр/с "
+          f"({nodes} энкодеров, пачки по {batch})")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Нагрузочные тесты на виртуальной CAN-шине')
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+
+    ingest = subparsers.add_parser('ingest', help='Фоновый прием энкодеров')
+    ingest.add_argument('--frames', type=int, default=100000)
+    ingest.add_argument('--nodes', type=int, default=40)
+    ingest.add_argument('--min-rate',
+                        type=float,
+                        default=MIN_INGEST_RATE,
+                        help='Минимальная скорость приема, кадр/с')
+
+    commands = subparsers.add_parser('commands',
+                                     help='Команды двигателей: до/после')
+    commands.add_argument('--commands', type=int, default=2000)
+
+    motion = subparsers.add_parser(
+        'motion', help='Оценка скорости/ускорения: точность и джиттер')
+    motion.add_argument('--rate', type=float, default=1000.0)
+    motion.add_argument('--seconds', type=float, default=10.0)
+    motion.add_argument('--nodes', type=int, default=30)
+
+    args = parser.parse_args()
+
+    if args.bench == 'ingest':
+        # Потеря кадров или низкая скорость - ненулевой код выхода
+        if not bench_ingest(args.frames, args.nodes,
+                            min_rate=args.min_rate)[2]:
+            sys.exit(1)
+    elif args.bench == 'commands':
+        bench_commands(args.commands)
+    elif args.bench == 'motion':
+        bench_motion(args.rate, args.seconds, nodes=args.nodes)
@@ -0,0 +1,304 @@
+import asyncio
+import concurrent.futures
+import socket
+import threading
+
+import can
+
+from metrics import registry
+
+ERROR_FRAMES = registry.counter('can_error_frames_total',
+                                'Принятые кадры ошибок CAN', 'channel')
+RECEIVE_ERRORS = registry.counter('can_receive_errors_total',
+                                  'Ошибки приема CAN (исключения Notifier)',
+                                  'channel')
+# Счетчики потерь приема из /sys/class/net/<канал>/statistics
+KERNEL_DROP_COUNTERS = ('rx_dropped', 'rx_over_errors')
+
+
+class SharedBus(can.Listener):
+    """
+    Долгоживущий CAN-интерфейс, общий для всех модулей
+
+    Отправка сериализуется блокировкой, прием выполняет один can.Notifier,
+    который раздает кадры по arbitration_id: постоянным обработчикам
+    (потоковые PDO) и одноразовым ожиданиям ответа (SDO, подтверждения
+    двигателей). Аппаратные фильтры сокета строятся из зарегистрированных
+    ID, так что ненужные кадры отбрасывает ядро.
+    """
+
+    # Размер приемного буфера сокета: запас на несколько сотен
+    # миллисекунд трафика 1 Мбит/с при паузах GC
+    RCVBUF = 4 * 1024 * 1024
+
+    def __init__(self, channel='can0', interface='socketcan', bitrate=1000000):
+        self.channel = channel
+        self.interface = interface
+        self.bus = can.interface.Bus(interface=interface,
+                                     channel=channel,
+                                     bitrate=bitrate)
+        sock = getattr(self.bus, 'socket', None)
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                self.RCVBUF)
+            except OSError as e:
+                print(f"Не удалось увеличить буфер приема: {e}")
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        # arbitration_id -> кортеж обработчиков; кортежи заменяются целиком,
+        # поэтому поток приема читает таблицу без блокировок
+        self.handlers = {}
+        # arbitration_id -> список (future, match) ожидающих ответа
+        self.waiters = {}
+        # Обработчики всех кадров (запись трафика); при наличии фильтры
+        # ядра отключаются
+        self.taps = ()
+        # ID ответов, которые уже ожидались (0x101, 0x580+n): остаются в
+        # фильтрах ядра, чтобы запросы не перестраивали фильтры сокета
+        self.reply_ids = frozenset()
+        self.filter_ids = frozenset()
+        self.notifier = None
+        self.frames_received = 0
+        self.frames_sent = 0
+
+    def start(self, loop=None):
+        """
+        Запуск приема (повторный вызов ничего не делает)
+
+        :param loop: цикл asyncio - обработчики вызываются в нем
+        """
+        with self.lock:
+            if self.notifier is None:
+                self.notifier = can.Notifier(self.bus, [self], loop=loop)
+
+    def send(self, msg, timeout=None):
+        with self.send_lock:
+            self.bus.send(msg, timeout)
+            # Под блокировкой: отправляют исполнители, планировщик, TimedSender
+            self.frames_sent += 1
+
+    def subscribe(self, arbitration_id, callback):
+        """Обработчик кадров с заданным ID: callback(msg)"""
+        with self.lock:
+            self.handlers[arbitration_id] = (
+                self.handlers.get(arbitration_id, ()) + (callback, ))
+            self.update_filters()
+        self.start()
+
+    def unsubscribe(self, arbitration_id, callback):
+        with self.lock:
+            callbacks = tuple(cb for cb in self.handlers.get(
+                arbitration_id, ()) if cb != callback)
+            if callbacks:
+                self.handlers[arbitration_id] = callbacks
+            else:
+                self.handlers.pop(arbitration_id, None)
+            self.update_filters()
+
+    def add_tap(self, callback):
+        """Обработчик всех принятых кадров: callback(msg)"""
+        with self.lock:
+            self.taps = self.taps + (callback, )
+            self.update_filters()
+        self.start()
+
+    def remove_tap(self, callback):
+        with self.lock:
+            self.taps = tuple(cb for cb in self.taps if cb != callback)
+            self.update_filters()
+
+    def expect(self, arbitration_id, match=None):
+        """
+        Ожидание одного кадра с заданным ID
+
+        :param match: дополнительная проверка кадра match(msg) -> bool
+        :return: concurrent.futures.Future с принятым сообщением
+        """
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.waiters.setdefault(arbitration_id, []).append((future, match))
+            if arbitration_id not in self.reply_ids:
+                self.reply_ids = self.reply_ids | {arbitration_id}
+                self.update_filters()
+        self.start()
+        return future
+
+    def discard(self, arbitration_id, future):
+        """Снятие ожидания (таймаут или отмена)"""
+        with self.lock:
+            waiters = [w for w in self.waiters.get(arbitration_id, ())
+                       if w[0] is not future]
+            if waiters:
+                self.waiters[arbitration_id] = waiters
+            else:
+                self.waiters.pop(arbitration_id, None)
+
+    def request(self, msg, reply_id, match=None, timeout=1.0):
+        """
+        Отправка запроса и ожидание конкретного ответа
+
+        Потоковые кадры других ID продолжают обрабатываться.
+
+        :return: ответ или None по таймауту
+        """
+        future = self.expect(reply_id, match)
+        try:
+            self.send(msg)
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            return None
+        finally:
+            self.discard(reply_id, future)
+
+    async def request_async(self, msg, reply_id, match=None, timeout=1.0):
+        """asyncio-вариант request: ожидание не блокирует цикл"""
+        future = self.expect(reply_id, match)
+        try:
+            self.send(msg)
+            return await asyncio.wait_for(asyncio.wrap_future(future),
+                                          timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.discard(reply_id, future)
+
+    def update_filters(self):
+        """Аппаратные фильтры по зарегистрированным ID (под self.lock)"""
+        if self.taps:
+            # Нужен весь трафик шины
+            ids = None
+        else:
+            ids = frozenset(self.handlers) | self.reply_ids
+        if ids == self.filter_ids:
+            return
+        self.filter_ids = ids
+        if ids is None:
+            self.bus.set_filters(None)
+            return
+        filters = [{
+            "can_id": arbitration_id,
+            "can_mask": 0x7FF,
+            "extended": False
+        } for arbitration_id in sorted(ids)]
+        # Пустой список фильтров - прием всех кадров
+        self.bus.set_filters(filters or None)
+
+    def on_message_received(self, msg):
+        self.frames_received += 1
+        if msg.is_error_frame:
+            ERROR_FRAMES.inc(self.channel)
+        for callback in self.taps:
+            try:
+                callback(msg)
+            except Exception as e:
+                print(f"Ошибка обработчика CAN: {e}")
+        arbitration_id = msg.arbitration_id
+        for callback in self.handlers.get(arbitration_id, ()):
+            try:
+                callback(msg)
+            except Exception as e:
+                print(f"Ошибка обработчика CAN 0x{arbitration_id:X}: {e}")
+        if arbitration_id in self.waiters:
+            self.resolve(msg)
+
+    def resolve(self, msg):
+        """Передача кадра первому подходящему ожиданию"""
+        with self.lock:
+            waiters = self.waiters.get(msg.arbitration_id, ())
+            for index, (future, match) in enumerate(waiters):
+                if future.done():
+                    continue
+                try:
+                    if match is not None and not match(msg):
+                        continue
+                except Exception as e:
+                    print(f"Ошибка проверки ответа CAN: {e}")
+                    continue
+                future.set_result(msg)
+                del waiters[index]
+                return
+
+    def on_error(self, exc):
+        RECEIVE_ERRORS.inc(self.channel)
+        print(f"Ошибка приема CAN ({self.channel}): {exc}")
+
+    def kernel_drops(self):
+        """
+        Потери приема в ядре по статистике интерфейса (rx_dropped - в том
+        числе переполнения очередей сокетов, rx_over_errors - переполнения
+        контроллера); 0 без sysfs (virtual, не Linux)
+
+        SO_RXQ_OVFL на сокете python-can не включается: capture_message
+        ожидает ровно одно вспомогательное сообщение (метку времени).
+        """
+        drops = {}
+        for name in KERNEL_DROP_COUNTERS:
+            path = f'/sys/class/net/{self.channel}/statistics/{name}'
+            try:
+                with open(path) as f:
+                    drops[name] = int(f.read())
+            except (OSError, ValueError):
+                drops[name] = 0
+        return drops
+
+    def shutdown(self):
+        with self.lock:
+            if self.notifier is not None:
+                self.notifier.stop()
+                self.notifier = None
+        self.bus.shutdown()
+
+
+class BusManager:
+    """Один SharedBus на канал на весь процесс"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buses = {}
+
+    def get(self, channel='can0', interface='socketcan', bitrate=1000000):
+        """Существующая шина канала или новая (interface/bitrate - для новой)"""
+        with self.lock:
+            shared = self.buses.get(channel)
+            if shared is None:
+                shared = SharedBus(channel, interface, bitrate)
+                self.buses[channel] = shared
+            return shared
+
+    def shutdown(self, channel):
+        with self.lock:
+            shared = self.buses.pop(channel, None)
+        if shared is not None:
+            shared.shutdown()
+
+    def shutdown_all(self):
+        with self.lock:
+            buses, self.buses = list(self.buses.values()), {}
+        for shared in buses:
+            shared.shutdown()
+
+
+bus_manager = BusManager()
+
+registry.gauge(
+    'can_frames_received_total', 'Принятые кадры по каналам', lambda: {
+        channel: shared.frames_received
+        for channel, shared in list(bus_manager.buses.items())
+    }, 'channel', 'counter')
+registry.gauge(
+    'can_frames_sent_total', 'Отправленные кадры по каналам', lambda: {
+        channel: shared.frames_sent
+        for channel, shared in list(bus_manager.buses.items())
+    }, 'channel', 'counter')
+registry.gauge(
+    'can_kernel_rx_dropped_total',
+    'Потери приема в ядре по каналам (rx_dropped + rx_over_errors)', lambda: {
+        channel: sum(shared.kernel_drops().values())
+        for channel, shared in list(bus_manager.buses.items())
+    }, 'channel', 'counter')
+
+
+def get_bus(channel='can0', interface='socketcan', bitrate=1000000):
+    """Общая шина канала из менеджера процесса"""
+    return bus_manager.get(channel, interface, bitrate)
@@ -0,0 +1,172 @@
+import threading
+
+from encoders import MultiEncoderMonitor
+from protocol import node_key, split_node_key
+from pubsub import FrameEncoder
+from scheduler import TransmitScheduler
+
+
+def config_file(index, channel):
+    """Конфиг энкодеров канала: у первого - прежний encoder_config.json"""
+    if index == 0:
+        return 'encoder_config.json'
+    return f'encoder_config_{channel}.json'
+
+
+class ChannelStats:
+    """Замеры приема канала в общей PipelineStats под ключами узлов"""
+
+    def __init__(self, stats, index):
+        self.stats = stats
+        self.index = index
+
+    def received(self, node_id, frame_time, started):
+        self.stats.received(node_key(self.index, node_id), frame_time,
+                            started)
+
+    def received_batch(self, node_ids, frame_time, started):
+        self.stats.received_batch(
+            [node_key(self.index, int(node_id)) for node_id in node_ids],
+            frame_time, started)
+
+
+class ChannelWorker:
+    """
+    CAN-канал сервера: общая шина со своим потоком приема, монитор
+    энкодеров, периодические задачи и кадры для клиентов
+
+    Узлы каналов различаются ключами protocol.node_key: у первого канала
+    ключ равен node_id, у следующих - номер канала в старших битах.
+    """
+
+    def __init__(self,
+                 index,
+                 channel,
+                 interface='socketcan',
+                 node_ids=None,
+                 history_depth=10000,
+                 stats=None):
+        """
+        :param index: номер канала в списке каналов сервера
+        :param node_ids: узлы энкодеров (None - из конфига канала)
+        :param history_depth: точек истории на энкодер (0 - без истории)
+        :param stats: общая latency.PipelineStats сервера
+        """
+        self.index = index
+        self.channel = channel
+        self.monitor = MultiEncoderMonitor(channel=channel,
+                                           node_ids=node_ids,
+                                           interface=interface,
+                                           config_file=config_file(
+                                               index, channel))
+        if history_depth:
+            self.monitor.enable_history(history_depth)
+        self.lock = threading.Lock()
+        if stats is not None:
+            self.monitor.stats = (stats if index == 0 else ChannelStats(
+                stats, index))
+        # Сериализация записей узлов - одна на обновление и формат подписки
+        self.frames = FrameEncoder(self.monitor.DEGREES_PER_STEP,
+                                   channel_index=index)
+        # Периодические отправки (SYNC, heartbeat, keep-alive двигателей)
+        self.scheduler = TransmitScheduler(self.monitor.bus)
+
+    def key(self, node_id):
+        return node_key(self.index, node_id)
+
+    def enable_motion(self):
+        """
+        Оценка скорости и ускорения - по первому запросу (подписка с
+        "motion": true, step_position): до этого кадры TPDO канала не
+        проходят через фильтр оценки
+        """
+        with self.lock:
+            if self.monitor.motion is None:
+                self.frames.motion = self.monitor.enable_motion()
+
+    def add_listener(self, callback):
+        """Подписка на обновления канала: callback(ключ узла, состояние)"""
+        if self.index == 0:
+            self.monitor.add_listener(callback)
+            return
+        index = self.index
+        self.monitor.add_listener(
+            lambda node_id, state: callback(node_key(index, node_id), state))
+
+    def current_data(self):
+        """Состояния узлов канала по ключам"""
+        return {
+            self.key(node_id): state
+            for node_id, state in self.monitor.get_current_data().items()
+        }
+
+    def start(self):
+        """Запуск приема канала (поток приема его общей шины)"""
+        self.monitor.start_ingest()
+
+    def stop(self):
+        self.scheduler.cancel_all()
+        self.monitor.stop_ingest()
+
+    def describe(self):
+        return {
+            "channel": self.channel,
+            "index": self.index,
+            "node_ids": list(self.monitor.node_ids),
+            "keys": [self.key(node_id) for node_id in self.monitor.node_ids]
+        }
+
+
+class ChannelSet:
+    """
+    Каналы сервера и разбор адресов узлов в командах
+
+    Энкодер в команде задается ключом узла из потока данных или node_id с
+    "channel" (имя канала) в аргументах; без "channel" - первый канал.
+    """
+
+    def __init__(self, workers):
+        self.workers = list(workers)
+        self.by_name = {worker.channel: worker for worker in self.workers}
+
+    def __iter__(self):
+        return iter(self.workers)
+
+    def __len__(self):
+        return len(self.workers)
+
+    def __getitem__(self, index):
+        return self.workers[index]
+
+    def select(self, args):
+        """Канал команды по args["channel"]"""
+        name = args.get('channel')
+        if name is None:
+            return self.workers[0]
+        worker = self.by_name.get(name)
+        if worker is None:
+            raise ValueError(f"Неизвестный канал: {name}")
+        return worker
+
+    def locate(self, key, args):
+        """(канал, node_id) энкодера по ключу узла"""
+        index, node_id = split_node_key(key)
+        if index == 0:
+            return self.select(args), node_id
+        if index >= len(self.workers):
+            raise ValueError(f"Нет канала для узла {key}")
+        return self.workers[index], node_id
+
+    def group(self, keys, args):
+        """{канал: [node_id]} для списка ключей узлов (порядок сохраняется)"""
+        groups = {}
+        for key in keys:
+            worker, node_id = self.locate(key, args)
+            groups.setdefault(worker, []).append(node_id)
+        return groups
+
+    def current_data(self):
+        data = {}
+        for worker in self.workers:
+            data.update(worker.current_data())
+        return data
@@ -1,9 +1,102 @@
 import tkinter as tk
 from tkinter import messagebox, simpledialog
+import queue
 import socket
-import json
 import threading
 import time
+from protocol import FrameDecoder, decode_message, pack_json
+from stripchart import CHART_HZ, ChartPanel
+
+# Частота перерисовки панели энкодеров, кадров/с
+RENDER_HZ = 20
+
+
+class EncoderModel:
+    """
+    Последние значения энкодеров (модель панели)
+
+    Поток приема только обновляет словарь: dict.update атомарен под GIL,
+    поэтому без блокировок и без вызовов Tk. Отображение читает копию по
+    таймеру; промежуточные значения между кадрами отрисовки не нужны.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def update(self, data):
+        self.values.update(data)
+
+    def snapshot(self):
+        return dict(self.values)
+
+    def remove(self, node_id):
+        # Ключи бинарного протокола - int, JSON - str
+        self.values.pop(node_id, None)
+        self.values.pop(str(node_id), None)
+
+
+class EncoderPanel:
+    """
+    Отображение EncoderModel в tk.Text
+
+    У каждого поля узла - свой тег (n<node>_<поле>); при перерисовке
+    заменяются только поля, текст которых изменился. Новый узел
+    добавляется в конец, остальные строки не трогаются.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        # node_id -> {поле: показанный текст}
+        self.rendered = {}
+
+    @staticmethod
+    def format(values, now):
+        current_norm, full_c, abs_angle, initial_abs, last_time, last_dir = values
+        return {
+            'angle': f"{current_norm:9.2f}",
+            'delta': f"{abs_angle - initial_abs:+9.2f}",
+            'age': f"{now - last_time:.1f}",
+        }
+
+    def add_node(self, node_id, fields):
+        tag = f"n{node_id}_"
+        self.text.insert(tk.END, f"Node {node_id}:\n  Текущий угол: ", (),
+                         fields['angle'], (tag + 'angle', ), "°\n  Δ: ", (),
+                         fields['delta'], (tag + 'delta', ),
+                         "°\n  Последнее обновление: ", (), fields['age'],
+                         (tag + 'age', ), " с. назад\n"
+                         "-------------------------\n")
+
+    def clear(self):
+        self.text.config(state='normal')
+        self.text.delete(1.0, tk.END)
+        self.text.config(state='disabled')
+        self.rendered = {}
+
+    def render(self, values, now):
+        """Перерисовка изменившихся полей (из потока Tk)"""
+        changes = []
+        for node_id, state in values.items():
+            fields = self.format(state, now)
+            shown = self.rendered.get(node_id)
+            if shown is None:
+                changes.append((node_id, None, fields))
+                self.rendered[node_id] = fields
+                continue
+            for name, value in fields.items():
+                if shown[name] != value:
+                    changes.append((node_id, name, value))
+                    shown[name] = value
+        if not changes:
+            return
+        self.text.config(state='normal')
+        for node_id, name, value in changes:
+            if name is None:
+                self.add_node(node_id, value)
+                continue
+            tag = f"n{node_id}_{name}"
+            self.text.replace(f"{tag}.first", f"{tag}.last", value, (tag, ))
+        self.text.config(state='disabled')
 
 
 class MotorControlApp:
@@ -14,7 +107,10 @@ class MotorControlApp:
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.connected = False
         self.monitoring = False
-        self.buffer = []
+        # Поток приема -> поток Tk: энкодеры - через модель, прочие
+        # сообщения и ошибки - через очередь
+        self.model = EncoderModel()
+        self.inbox = queue.SimpleQueue()
 
         # Добавляем элемент для отображения данных энкодера
         self.encoder_frame = tk.LabelFrame(root, text="Данные энкодеров")
@@ -28,6 +124,10 @@ class MotorControlApp:
         self.encoder_scroll.pack(side=tk.RIGHT, fill=tk.Y)
         self.encoder_text.pack(padx=5, pady=5, fill=tk.BOTH, expand=True)
         self.encoder_scroll.config(command=self.encoder_text.yview)
+        self.encoder_panel = EncoderPanel(self.encoder_text)
+        # Графики угла и скорости под текстовой панелью
+        self.chart_panel = ChartPanel(self.encoder_frame)
+        self.chart_panel.frame.pack(side=tk.BOTTOM, fill=tk.X, padx=5)
 
         # Основные элементы интерфейса
         self.ip_frame = tk.Frame(root)
@@ -74,6 +174,8 @@ class MotorControlApp:
 
         # Блокировка элементов до подключения
         self.disable_controls()
+        self.render()
+        self.render_charts()
 
     def disable_controls(self):
         """Блокировка элементов управления"""
@@ -102,7 +204,12 @@ class MotorControlApp:
             # Запуск приема данных
             threading.Thread(target=self.receive_data, daemon=True).start()
             # Запуск мониторинга
-            self.send_command({"type": "show_encoder"})
+            self.send_command({
+                "type": "show_encoder",
+                "args": {
+                    "motion": True
+                }
+            })
             self.monitoring = True
         except Exception as e:
             messagebox.showerror("Ошибка",
@@ -126,55 +233,55 @@ class MotorControlApp:
     def send_command(self, command: dict):
         """Отправка команды на сервер"""
         try:
-            self.socket.send(json.dumps(command).encode('utf-8'))
+            self.socket.sendall(pack_json(command))
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка отправки: {str(e)}")
 
     def receive_data(self):
+        decoder = FrameDecoder()
         while self.connected:
             try:
-                data = self.socket.recv(1024).decode('utf-8')
-                if data:
-                    message = json.loads(data)
+                data = self.socket.recv(65536)
+                if not data:
+                    break
+                for msg_type, payload in decoder.feed(data):
+                    message = decode_message(msg_type, payload)
                     if message.get('type') == 'encoder_data':
-                        self.update_encoder_data(message['data'])
+                        self.model.update(message['data'])
+                        self.chart_panel.feed('angle', message['data'])
+                    elif message.get('type') == 'motion_data':
+                        self.chart_panel.feed('velocity', message['data'])
                     else:
-                        self.update_output(message)
+                        self.inbox.put(message)
             except Exception as e:
                 if self.connected:
-                    messagebox.showerror("Ошибка",
-                                         f"Ошибка приема данных: {str(e)}")
+                    self.inbox.put({
+                        "type": "error",
+                        "message": f"Ошибка приема данных: {str(e)}"
+                    })
                 break
 
-    def update_encoder_data(self, data):
-        """Обновление данных энкодеров в реальном времени"""
-        self.encoder_text.config(state='normal')
-
-        # Сохраняем позицию прокрутки
-        scroll_pos = self.encoder_text.yview()
-
-        # Блокируем обновление интерфейса на время модификации
-        self.encoder_text.config(state='normal')
-        self.encoder_text.delete(1.0, tk.END)
-
-        self.buffer = []
-        for node_id, values in data.items():
-            current_time = time.time()
-            current_norm, full_c, abs_angle, initial_abs, last_time, last_dir = values
-            total_delta = abs_angle - initial_abs
-            self.buffer.append(
-                f"Node {node_id}:\n"
-                f"  Текущий угол: {current_norm:9.2f}°\n"
-                f"  Δ: {total_delta:+9.2f}°\n"
-                f"  Последнее обновление: {current_time - last_time:.2f} с. назад\n"
-                "-------------------------\n")
-
-        # Вставляем все данные за одну операцию
-        self.encoder_text.insert(tk.END, ''.join(self.buffer))
+    def render(self):
+        """Кадр отрисовки (таймер Tk): энкодеры и накопленные сообщения"""
+        self.encoder_panel.render(self.model.snapshot(), time.time())
+        while True:
+            try:
+                message = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            if message.get('type') == 'error':
+                messagebox.showerror("Ошибка", message['message'])
+            else:
+                self.update_output(message)
+        self.root.after(int(1000 / RENDER_HZ), self.render)
 
-        # Восстанавливаем позицию прокрутки
-        self.encoder_text.yview_moveto(scroll_pos[0])
-        self.encoder_text.config(state='disabled')
+    def render_charts(self):
+        """Кадр графиков (таймер Tk, CHART_HZ)"""
+        started = time.monotonic()
+        self.chart_panel.render(started)
+        # Период - от начала кадра: время отрисовки не сдвигает частоту
+        delay = 1.0 / CHART_HZ - (time.monotonic() - started)
+        self.root.after(max(int(delay * 1000), 1), self.render_charts)
 
     def update_output(self, response):
         """Обновление текстового поля вывода"""
@@ -188,7 +295,7 @@ class MotorControlApp:
 
     def show_encoder(self):
         """Запрос данных энкодера"""
-        self.send_command({"type": "show_encoder"})
+        self.send_command({"type": "show_encoder", "args": {"motion": True}})
 
     def change_id(self):
         """Диалог смены ID энкодера"""
@@ -210,7 +317,11 @@ class MotorControlApp:
                     "new_id": new_id
                 }
             })
-            self.buffer.clear()
+            # Старый узел убирается из панели, остальные - при следующем
+            # кадре отрисовки
+            self.model.remove(current_id)
+            self.encoder_panel.clear()
+            self.chart_panel.remove(current_id)
 
     def reset_position(self):
         """Диалог обнуления позиции"""
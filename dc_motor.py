@@ -1,12 +1,19 @@
 import can
 import time
+from canbus import get_bus
+from metrics import registry
+from scheduler import TransmitScheduler
 
+DC_COMMANDS = registry.counter('dc_motor_commands_total',
+                               'Команды DC-двигателей', 'motor_id', fmt=hex)
+DC_SEND_ERRORS = registry.counter('dc_motor_send_errors_total',
+                                  'Ошибки отправки команд DC-двигателей')
 
-def send_motor_command(channel, motor_id, power_state, direction):
+
+def motor_message(motor_id, power_state, direction):
     """
-    Отправляет команду управления мотором по CAN-шине.
-    
-    :param channel: Интерфейс CAN (например, 'can0')
+    CAN-сообщение команды мотора (для отправки и периодических задач)
+
     :param motor_id: ID мотора (например, 201)
     :param power_state: Состояние питания (0 - выкл, 1 - вкл)
     :param direction: Направление вращения (0 - одно, 1 - другое)
@@ -38,21 +45,34 @@ def send_motor_command(channel, motor_id, power_state, direction):
     ]
 
     # Создаем CAN сообщение
-    message = can.Message(arbitration_id=motor_id_hex,
-                          data=data,
-                          is_extended_id=False)
+    return can.Message(arbitration_id=motor_id_hex,
+                       data=data,
+                       is_extended_id=False)
+
+
+def send_motor_command(channel, motor_id, power_state, direction):
+    """
+    Отправляет команду управления мотором по CAN-шине.
+
+    Использует общую шину канала (canbus.SharedBus) без открытия сокета
+    на каждую команду.
+    
+    :param channel: Интерфейс CAN (например, 'can0')
+    :param motor_id: ID мотора (например, 201)
+    :param power_state: Состояние питания (0 - выкл, 1 - вкл)
+    :param direction: Направление вращения (0 - одно, 1 - другое)
+    """
+    message = motor_message(motor_id, power_state, direction)
+    motor_id_hex = message.arbitration_id
+    data = list(message.data)
 
     try:
-        # Создаем шину и отправляем сообщение
-        with can.Bus(channel=channel, interface='socketcan') as bus:
-            bus.send(message)
-            print(
-                f"Отправлено сообщение: ID={hex(motor_id_hex)}, Данные={data}")
+        get_bus(channel).send(message)
+        DC_COMMANDS.inc(motor_id_hex)
+        print(f"Отправлено сообщение: ID={hex(motor_id_hex)}, Данные={data}")
     except can.CanError as e:
+        DC_SEND_ERRORS.inc()
         print(f"Ошибка отправки сообщения: {e}")
-    finally:
-        if bus is not None and bus.state != can.BusState.ERROR:
-            bus.shutdown()
 
 
 # Пример использования
@@ -61,8 +81,15 @@ if __name__ == "__main__":
         motor_id = int(input("Введите ID мотора (2XX/3XX): "))
         power = int(input("Состояние (0/1): "))
         direction = int(input("Направление (0/1): "))
-        send_motor_command('can0', motor_id, power, direction)
+        scheduler = TransmitScheduler(get_bus('can0'))
+        # Команда повторяется каждые 100 мс в течение 2 с (keep-alive):
+        # сроки отправки выдерживает планировщик, а не этот поток
+        scheduler.add('demo',
+                      motor_message(motor_id, power, direction),
+                      0.1,
+                      duration=2.0)
         time.sleep(2)
+        scheduler.cancel_all()
         send_motor_command('can0', motor_id, 0, 0)
     except ValueError as e:
         print(f"Ошибка: {e}")
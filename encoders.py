@@ -1,39 +1,92 @@
-import can
 import signal
 import sys
+import threading
 import time
 import select
-import struct
 import json
+import sdo
+import numpy as np
+from canbus import get_bus
+from frames import (CAN_SFF_MASK, POSITION_BITS, BulkFrameReader,
+                    extract_position, position_from_bytes, standard_ids)
+from history import EncoderHistory
+from latency import PipelineStats
+from metrics import registry
+from motion import MotionEstimator
+from state_store import EncoderStateStore
+
+TPDO_FRAMES = registry.counter('encoder_tpdo_frames_total',
+                               'Принятые кадры TPDO энкодеров',
+                               'cob_id',
+                               fmt=hex)
+SHORT_FRAMES = registry.counter('encoder_short_frames_total',
+                                'Кадры TPDO с коротким полем данных')
 
 
 class MultiEncoderMonitor:
 
-    def __init__(self, channel='can0', node_ids=None):
+    # Параметры энкодера по умолчанию (секция encoder_params конфига).
+    # position_bits/position_signed/position_offset - поле позиции в TPDO:
+    # 16/24/32 бит, знаковое или нет, смещение в байтах
+    DEFAULT_PARAMS = {
+        'resolution': 1024,
+        'full_circle': 360.0,
+        'position_bits': 16,
+        'position_signed': False,
+        'position_offset': 0,
+    }
+
+    def __init__(self,
+                 channel='can0',
+                 node_ids=None,
+                 interface='socketcan',
+                 config_file='encoder_config.json'):
         # Загрузка конфигурации
-        self.config_file = 'encoder_config.json'
+        self.config_file = config_file
         config = self.load_config()
         
         # Инициализация параметров энкодера из конфига
         self.RESOLUTION = config.get('resolution', 1024)
         self.FULL_CIRCLE = config.get('full_circle', 360.0)
         self.DEGREES_PER_STEP = self.FULL_CIRCLE / self.RESOLUTION
+        self.POSITION_BITS = config.get('position_bits', 16)
+        self.POSITION_SIGNED = config.get('position_signed', False)
+        self.POSITION_OFFSET = config.get('position_offset', 0)
+        if self.POSITION_BITS not in POSITION_BITS:
+            raise ValueError(f"position_bits должен быть из {POSITION_BITS}")
         
         # Инициализация node_ids
         self.node_ids = node_ids if node_ids is not None else config.get('node_ids', [1])
         
-        # Остальная инициализация
-        self.bus = can.interface.Bus(interface='socketcan',
-                                     channel=channel,
-                                     bitrate=1000000)
-        self.expected_pdo_ids = []
-        for node_id in self.node_ids:
-            self.expected_pdo_ids.append(0x180 + node_id)
-            self.expected_pdo_ids.append(0x280 + node_id)
-        self.encoder_states = {}
-        signal.signal(signal.SIGINT, self.signal_handler)
+        # Остальная инициализация: общая шина канала (canbus.SharedBus)
+        self.channel = channel
+        self.bus = get_bus(channel, interface)
+        self.ingesting = False
+        self.bulk_reader = None
+        self.bulk_thread = None
+        self.expected_pdo_ids = {}
+        # COB-ID -> node_id массивом для пакетного декодирования (-1 - чужой)
+        self.pdo_lookup = np.full(CAN_SFF_MASK + 1, -1, dtype=np.int32)
+        self.update_pdo_ids()
+        # Состояния в массивах NumPy; доступ по node_id как у словаря
+        self.encoder_states = EncoderStateStore()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.signal_handler)
         self.running = True
         self.output = []
+
+        # Кадры TPDO, принятые в режиме фонового приема, и отброшенные
+        # из-за короткого поля данных
+        self.frames_received = 0
+        self.short_frames = 0
+        # Задержки по этапам (latency.PipelineStats), см. enable_stats
+        self.stats = None
+        # Подписчики на обновления: callback(node_id, state)
+        self.listeners = ()
+        # История абсолютного угла (history.EncoderHistory), см. enable_history
+        self.history = None
+        # Скорость и ускорение (motion.MotionEstimator), см. enable_motion
+        self.motion = None
         
         # Сохраняем конфиг при изменении параметров
         self.save_config()
@@ -44,7 +97,10 @@ class MultiEncoderMonitor:
             'node_ids': self.node_ids,
             'encoder_params': {
                 'resolution': self.RESOLUTION,
-                'full_circle': self.FULL_CIRCLE
+                'full_circle': self.FULL_CIRCLE,
+                'position_bits': self.POSITION_BITS,
+                'position_signed': self.POSITION_SIGNED,
+                'position_offset': self.POSITION_OFFSET
             }
         }
         try:
@@ -55,34 +111,21 @@ class MultiEncoderMonitor:
 
     def load_config(self):
         """Загрузка полной конфигурации из файла"""
+        defaults = dict(self.DEFAULT_PARAMS, node_ids=[1])
         try:
             with open(self.config_file, 'r') as f:
                 config = json.load(f)
                 # Обработка старых конфигов без encoder_params
-                if 'encoder_params' not in config:
-                    return {
-                        'node_ids': config.get('node_ids', [1]),
-                        'resolution': 1024,
-                        'full_circle': 360.0
-                    }
-                return {
-                    'node_ids': config.get('node_ids', [1]),
-                    'resolution': config['encoder_params'].get('resolution', 1024),
-                    'full_circle': config['encoder_params'].get('full_circle', 360.0)
-                }
+                params = config.get('encoder_params', {})
+                result = {'node_ids': config.get('node_ids', [1])}
+                for key, default in self.DEFAULT_PARAMS.items():
+                    result[key] = params.get(key, default)
+                return result
         except FileNotFoundError:
-            return {
-                'node_ids': [1],
-                'resolution': 1024,
-                'full_circle': 360.0
-            }
+            return defaults
         except Exception as e:
             print(f"Ошибка загрузки конфига: {e}")
-            return {
-                'node_ids': [1],
-                'resolution': 1024,
-                'full_circle': 360.0
-            }
+            return defaults
 
     def change_id_process(self, current_id, new_id):
         if current_id != new_id and current_id in self.node_ids:
@@ -90,146 +133,332 @@ class MultiEncoderMonitor:
             self.node_ids.remove(current_id)
             if current_id in self.encoder_states:
                 del self.encoder_states[current_id]  # Удаляем старое состояние
+            if self.history is not None:
+                self.history.remove(current_id)
+            if self.motion is not None:
+                self.motion.reset(current_id)
             # Добавляем новый ID
             self.node_ids.append(new_id)
             # Пересоздаем ожидаемые COB-ID
-            self.expected_pdo_ids = []
-            for node_id in self.node_ids:
-                self.expected_pdo_ids.append(0x180 + node_id)
-                self.expected_pdo_ids.append(0x280 + node_id)
+            self.update_pdo_ids()
             # Очищаем вывод
             self.output = []
 
+    def update_pdo_ids(self):
+        """Построение таблицы COB-ID TPDO1/TPDO2 -> node_id"""
+        pdo_ids = {}
+        for node_id in self.node_ids:
+            pdo_ids[0x180 + node_id] = node_id
+            pdo_ids[0x280 + node_id] = node_id
+        lookup = np.full(CAN_SFF_MASK + 1, -1, dtype=np.int32)
+        for cob_id, node_id in pdo_ids.items():
+            lookup[cob_id] = node_id
+        # Замена целиком: поток приема всегда видит согласованную таблицу
+        old_ids, self.expected_pdo_ids = self.expected_pdo_ids, pdo_ids
+        self.pdo_lookup = lookup
+        if self.bulk_reader is not None:
+            self.bulk_reader.set_filters(pdo_ids)
+        elif self.ingesting:
+            for cob_id in old_ids.keys() - pdo_ids.keys():
+                self.bus.unsubscribe(cob_id, self.on_pdo)
+            for cob_id in pdo_ids.keys() - old_ids.keys():
+                self.bus.subscribe(cob_id, self.on_pdo)
+
+    def enable_history(self, depth=10000):
+        """Включение истории абсолютного угла: depth точек на энкодер"""
+        if self.history is None or self.history.depth != depth:
+            self.history = EncoderHistory(depth)
+        return self.history
+
+    def enable_motion(self, **params):
+        """Включение оценки скорости и ускорения (параметры фильтра)"""
+        self.motion = MotionEstimator(**params)
+        return self.motion
+
+    def enable_stats(self):
+        """Включение замеров задержек приема (этапы kernel и update)"""
+        if self.stats is None:
+            self.stats = PipelineStats()
+        return self.stats
+
+    def add_listener(self, callback):
+        """Подписка на обновления состояния: callback(node_id, state)"""
+        # Кортеж заменяется целиком: поток приема обходит его без блокировок
+        self.listeners = self.listeners + (callback, )
+
+    def remove_listener(self, callback):
+        self.listeners = tuple(cb for cb in self.listeners if cb != callback)
+
+    def publish(self, node_id):
+        """Рассылка текущего состояния узла подписчикам"""
+        state = self.encoder_states.get(node_id)
+        if state is None:
+            return
+        for callback in self.listeners:
+            try:
+                callback(node_id, state)
+            except Exception as e:
+                print(f"Ошибка подписчика: {e}")
+
     def bytes_to_angle(self, data):
         """Конвертация little-endian в нормализованный угол"""
-        if len(data) < 2:
+        raw = position_from_bytes(data, self.POSITION_OFFSET,
+                                  self.POSITION_BITS, self.POSITION_SIGNED)
+        if raw is None:
             return None
-        raw = data[0] | (data[1] << 8)
         return (raw * self.DEGREES_PER_STEP) % 360
 
+    def decode_frames(self, frames):
+        """
+        Пакетное декодирование TPDO из массива frames.CAN_FRAME
+
+        :return: (node_id, нормализованные углы, индексы кадров) для кадров
+                 энкодеров с достаточной длиной данных
+        """
+        cob_ids = standard_ids(frames)
+        node_ids = self.pdo_lookup[cob_ids & CAN_SFF_MASK]
+        node_ids[cob_ids < 0] = -1
+        raw, long_enough = extract_position(frames, self.POSITION_OFFSET,
+                                            self.POSITION_BITS,
+                                            self.POSITION_SIGNED)
+        index = np.flatnonzero((node_ids >= 0) & long_enough)
+        angles = (raw[index] * self.DEGREES_PER_STEP) % 360
+        return node_ids[index], angles, index
+
+    def handle_frames(self, frames, timestamps):
+        """
+        Пакет сырых кадров -> векторное обновление состояний
+
+        :param frames: массив frames.CAN_FRAME
+        :param timestamps: метка времени пачки или массив по кадрам
+        :return: массив node_id обновленных энкодеров
+        """
+        node_ids, angles, index = self.decode_frames(frames)
+        if not len(node_ids):
+            return node_ids
+        timestamps = np.broadcast_to(np.asarray(timestamps, dtype=np.float64),
+                                     (len(frames), ))[index]
+        self.update_states(node_ids, angles, timestamps)
+        updated = np.unique(node_ids)
+        if self.listeners:
+            for node_id in updated:
+                self.publish(int(node_id))
+        return updated
+
     def get_current_data(self):
         """Возвращает актуальные данные энкодеров"""
-        return self.encoder_states.copy()
+        return self.encoder_states.as_dict()
 
-    def calculate_delta(self, node_id, current_normalized):
+    def get_snapshot(self):
+        """Колонки состояний (views массивов NumPy) без копирования"""
+        return self.encoder_states.snapshot()
+
+    def calculate_delta(self, node_id, current_normalized, timestamp=None):
         """Вычисление дельты с учетом полных оборотов и направления"""
-        if node_id not in self.encoder_states:
-            initial_abs = current_normalized
-            self.encoder_states[node_id] = (
-                current_normalized,
-                0,
-                current_normalized,
-                initial_abs,
-                time.time(),
-                0  # last_direction
-            )
-            return 0.0
-
-        prev_norm, full_circles, abs_angle, initial_abs, last_time, last_dir = self.encoder_states[
-            node_id]
-        delta = current_normalized - prev_norm
-
-        # Коррекция циклического перехода
-        if delta > 180:
-            delta -= 360
-        elif delta < -180:
-            delta += 360
-
-        direction = 0
-        if delta != 0 and abs(delta) > 5:
-            direction = 1 if delta > 0 else -1
-
-        direction_changed = (direction != 0 and direction != last_dir)
-
-        if direction != 0:
-            # Обновление оборотов при переходе через 0/360
-            if direction == 1 and current_normalized < prev_norm:
-                full_circles += 1
-            elif direction == -1 and current_normalized > prev_norm:
-                full_circles -= 1
-
-        absolute_angle = full_circles * 360 + current_normalized
-
-        reset_needed = False
-        if delta != 0 and direction_changed:
-            reset_needed = True
-
-        if reset_needed:
-            initial_abs = absolute_angle
-            last_time = time.time()
-            last_dir = direction
-        else:
-            last_time = time.time() if delta != 0 else last_time
-
-        self.encoder_states[node_id] = (current_normalized, full_circles,
-                                        absolute_angle, initial_abs, last_time,
-                                        last_dir)
-        return delta if not reset_needed else 0.0
+        if timestamp is None:
+            timestamp = time.time()
+        delta = self.encoder_states.update(node_id, current_normalized,
+                                           timestamp)
+        if self.history is not None or self.motion is not None:
+            absolute = self.encoder_states.get(node_id)[2]
+            if self.history is not None:
+                self.history.append(node_id, timestamp, absolute)
+            if self.motion is not None:
+                self.motion.update(node_id, absolute, timestamp)
+        return delta
+
+    def update_states(self, node_ids, angles, timestamps):
+        """Векторное обновление состояний, истории и оценки движения"""
+        if self.history is None and self.motion is None:
+            return self.encoder_states.update_batch(node_ids, angles,
+                                                    timestamps)
+        deltas, absolute = self.encoder_states.update_batch(
+            node_ids, angles, timestamps, return_absolute=True)
+        if self.history is not None:
+            self.history.extend(node_ids, timestamps, absolute)
+        if self.motion is not None:
+            self.motion.update_batch(node_ids, absolute, timestamps)
+        return deltas
 
     def signal_handler(self, sig, frame):
         print("\nЗавершение работы...")
         self.running = False
+        self.stop_ingest()
         self.bus.shutdown()
         sys.exit(0)
 
     def reset_encoder_position(self, node_id):
         """Сброс позиции через Preset Value для конкретного энкодера"""
-        index = 0x6003
-        subindex = 0x00
-        value = 0x00000000
-        data = [
-            0x23,
-            index.to_bytes(2, 'little')[0],
-            index.to_bytes(2, 'little')[1], subindex, (value & 0xFF),
-            ((value >> 8) & 0xFF), ((value >> 16) & 0xFF),
-            ((value >> 24) & 0xFF)
-        ]
-        cob_id = 0x600 + node_id
+        return self.reset_positions([node_id]).get(node_id, False)
+
+    def reset_positions(self, node_ids=None):
+        """
+        Сброс позиции нескольких энкодеров за один круг SDO
+
+        :param node_ids: список node_id (по умолчанию все энкодеры)
+        :return: {node_id: True/False}
+        """
+        if node_ids is None:
+            node_ids = list(self.node_ids)
         try:
-            msg = can.Message(arbitration_id=cob_id,
-                              data=data,
-                              is_extended_id=False)
-            self.bus.send(msg)
-            response = self.bus.recv(timeout=0.5)
-            if response and response.arbitration_id == 0x580 + node_id:
-                if response.data[0] == 0x60:
-                    # Сбрасываем внутреннее состояние
-                    self.encoder_states[node_id] = (0.0, 0, 0.0, 0.0,
-                                                    time.time(), 0)
-                    return True
-                else:
-                    print(
-                        f"❌ Ошибка SDO для node {node_id}: код {response.data[0]:02X}"
-                    )
+            results = sdo.batch_download(
+                self.bus, [(node_id, 0x6003, 0x00, 0x00000000)
+                           for node_id in node_ids],
+                timeout=0.5)
         except Exception as e:
-            print(f"❌ Ошибка отправки SDO для node {node_id}: {str(e)}")
-        return False
+            print(f"❌ Ошибка отправки SDO: {str(e)}")
+            return {node_id: False for node_id in node_ids}
 
+        status = {}
+        for result in results:
+            status[result.node_id] = result.success
+            if result.success:
+                # Сбрасываем внутреннее состояние
+                self.encoder_states[result.node_id] = (0.0, 0, 0.0, 0.0,
+                                                       time.time(), 0)
+                if self.motion is not None:
+                    self.motion.reset(result.node_id)
+                self.publish(result.node_id)
+            elif result.abort_code is not None:
+                print(f"❌ Ошибка SDO для node {result.node_id}: "
+                      f"код отмены {result.abort_code:08X}")
+            else:
+                print(f"❌ Нет ответа SDO от node {result.node_id}")
+        return status
+
+    def handle_message(self, msg):
+        """Обработка одного CAN-кадра: TPDO энкодера -> обновление состояния
+
+        :return: node_id обновленного энкодера или None
+        """
+        node_id = self.expected_pdo_ids.get(msg.arbitration_id)
+        if node_id is None:
+            return None
+        current_angle = self.bytes_to_angle(msg.data)
+        if current_angle is None:
+            self.short_frames += 1
+            SHORT_FRAMES.inc()
+            return None
+        # Метка времени приема кадра ядром (socketcan), а не момент обработки
+        self.calculate_delta(node_id, current_angle,
+                             msg.timestamp or time.time())
+        if self.listeners:
+            self.publish(node_id)
+        return node_id
+
+    def handle_batch(self, msgs):
+        """
+        Обработка пачки кадров одним векторным обновлением состояний
+
+        :return: список node_id обновленных энкодеров
+        """
+        node_ids = []
+        angles = []
+        timestamps = []
+        for msg in msgs:
+            node_id = self.expected_pdo_ids.get(msg.arbitration_id)
+            if node_id is None:
+                continue
+            current_angle = self.bytes_to_angle(msg.data)
+            if current_angle is None:
+                continue
+            node_ids.append(node_id)
+            angles.append(current_angle)
+            timestamps.append(msg.timestamp or time.time())
+        if not node_ids:
+            return []
+        self.update_states(np.array(node_ids), angles,
+                           np.array(timestamps, dtype=np.float64))
+        updated = list(dict.fromkeys(node_ids))
+        if self.listeners:
+            for node_id in updated:
+                self.publish(node_id)
+        return updated
+
+    def on_pdo(self, msg):
+        """Обработчик TPDO, вызываемый потоком приема общей шины"""
+        self.frames_received += 1
+        TPDO_FRAMES.inc(msg.arbitration_id)
+        if self.stats is None:
+            self.handle_message(msg)
+            return
+        started = time.monotonic()
+        node_id = self.handle_message(msg)
+        if node_id is not None:
+            self.stats.received(node_id, msg.timestamp or time.time(),
+                                started)
+
+    def start_ingest(self, bulk=False):
+        """
+        Запуск фонового приема кадров энкодеров без консольного вывода
+
+        :param bulk: пакетный режим (только socketcan) - отдельный сырой
+                     сокет, кадры вычитываются пачками и декодируются NumPy
+        """
+        if self.ingesting:
+            return
+        self.ingesting = True
+        if bulk:
+            self.bulk_reader = BulkFrameReader(self.channel)
+            self.bulk_reader.set_filters(self.expected_pdo_ids)
+            self.bulk_thread = threading.Thread(target=self.bulk_ingest_loop,
+                                                name='encoder-bulk-ingest',
+                                                daemon=True)
+            self.bulk_thread.start()
+            return
+        for cob_id in self.expected_pdo_ids:
+            self.bus.subscribe(cob_id, self.on_pdo)
+
+    def stop_ingest(self):
+        """Остановка фонового приема"""
+        if not self.ingesting:
+            return
+        self.ingesting = False
+        if self.bulk_reader is not None:
+            self.bulk_thread.join(1.0)
+            self.bulk_reader.close()
+            self.bulk_reader = None
+            self.bulk_thread = None
+            return
+        for cob_id in self.expected_pdo_ids:
+            self.bus.unsubscribe(cob_id, self.on_pdo)
+
+    def bulk_ingest_loop(self):
+        """Поток пакетного приема: сокет -> массив кадров -> update_batch"""
+        reader = self.bulk_reader
+        while self.ingesting:
+            try:
+                frames, timestamp = reader.read(timeout=0.1)
+            except OSError as e:
+                print(f"Ошибка приема CAN: {e}")
+                continue
+            if len(frames):
+                self.frames_received += len(frames)
+                cob_ids, counts = np.unique(standard_ids(frames),
+                                            return_counts=True)
+                for cob_id, count in zip(cob_ids.tolist(), counts.tolist()):
+                    TPDO_FRAMES.add(cob_id, count)
+                started = time.monotonic()
+                updated = self.handle_frames(frames, timestamp)
+                if self.stats is not None:
+                    self.stats.received_batch(updated, timestamp, started)
 
     def start_monitoring(self):
         print(
             "Мониторинг энкодеров. 's' - сброс всех, 'h' - движение. Ctrl+C для выхода."
         )
         print("-" * 60)
+        # Кадры обрабатывает поток приема общей шины
+        self.start_ingest()
         try:
             while self.running:
-                # Обработка входящих сообщений
-                msg = self.bus.recv(timeout=0.1)
-                if msg and msg.arbitration_id in self.expected_pdo_ids:
-                    node_id = msg.arbitration_id - 0x180  # Определяем node_id по TPDO1
-                    if node_id not in self.node_ids:
-                        node_id = msg.arbitration_id - 0x280  # Проверяем TPDO2
-                    if node_id in self.node_ids:
-                        current_angle = self.bytes_to_angle(msg.data)
-                        if current_angle is not None:
-                            self.calculate_delta(node_id, current_angle)
+                time.sleep(0.1)
 
                 # Обработка ввода с клавиатуры
                 if sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
                     key = sys.stdin.read(1)
                     if key == 's':
-                        for node_id in self.node_ids:
-                            self.reset_encoder_position(node_id)
+                        self.reset_positions()
                     elif key == 'h':
                         for node_id in self.node_ids:
                             self.move(node_id, 0, 1, 100)
@@ -0,0 +1,150 @@
+import select
+import socket
+import struct
+import time
+
+import numpy as np
+
+# struct can_frame из linux/can.h (16 байт)
+CAN_FRAME = np.dtype([
+    ('can_id', '<u4'),
+    ('dlc', 'u1'),
+    ('pad', 'u1'),
+    ('res0', 'u1'),
+    ('len8_dlc', 'u1'),
+    ('data', 'u1', (8, )),
+])
+
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_SFF_MASK = 0x000007FF
+CAN_EFF_MASK = 0x1FFFFFFF
+
+# Допустимая разрядность поля позиции в TPDO
+POSITION_BITS = (16, 24, 32)
+
+
+def frames_from_buffer(buffer, count=-1):
+    """Структурированный массив CAN_FRAME поверх буфера (без копирования)"""
+    return np.frombuffer(buffer, dtype=CAN_FRAME, count=count)
+
+
+def frames_to_buffer(arbitration_ids, data):
+    """
+    Упаковка кадров в формат can_frame (для записи, тестов и повтора)
+
+    :param arbitration_ids: последовательность 11-битных ID
+    :param data: последовательность байтовых строк до 8 байт
+    """
+    frames = np.zeros(len(arbitration_ids), dtype=CAN_FRAME)
+    frames['can_id'] = arbitration_ids
+    for i, payload in enumerate(data):
+        frames['dlc'][i] = len(payload)
+        frames['data'][i, :len(payload)] = np.frombuffer(bytes(payload),
+                                                         dtype=np.uint8)
+    return frames
+
+
+def standard_ids(frames):
+    """
+    11-битные COB-ID кадров; расширенные, RTR и кадры ошибок -> -1
+    """
+    can_id = frames['can_id']
+    flags = can_id & (CAN_EFF_FLAG | CAN_RTR_FLAG | CAN_ERR_FLAG)
+    return np.where(flags == 0, can_id & CAN_SFF_MASK,
+                    -1).astype(np.int32)
+
+
+def extract_position(frames, offset=0, bits=16, signed=False):
+    """
+    Поле позиции little-endian из данных кадров
+
+    :param offset: смещение поля в байтах
+    :param bits: разрядность поля (16, 24, 32)
+    :param signed: знаковое поле (дополнительный код)
+    :return: (значения int64, маска кадров с достаточным DLC)
+    """
+    if bits not in POSITION_BITS:
+        raise ValueError(f"Разрядность позиции: {POSITION_BITS}")
+    width = bits // 8
+    if offset < 0 or offset + width > 8:
+        raise ValueError("Поле позиции выходит за 8 байт данных")
+    data = frames['data']
+    raw = np.zeros(len(frames), dtype=np.int64)
+    for i in range(width):
+        raw |= data[:, offset + i].astype(np.int64) << (8 * i)
+    if signed:
+        sign_bit = np.int64(1) << (bits - 1)
+        raw = (raw ^ sign_bit) - sign_bit
+    return raw, frames['dlc'] >= offset + width
+
+
+def position_from_bytes(data, offset=0, bits=16, signed=False):
+    """То же для одного кадра: поле позиции или None при коротком кадре"""
+    width = bits // 8
+    if len(data) < offset + width:
+        return None
+    return int.from_bytes(bytes(data[offset:offset + width]),
+                          'little',
+                          signed=signed)
+
+
+class BulkFrameReader:
+    """
+    Пакетное чтение сырого сокета SocketCAN в предвыделенный буфер
+
+    Кадры не превращаются в can.Message: за один вызов read() вычитывается
+    все, что накопилось в сокете, и возвращается массивом CAN_FRAME.
+    """
+
+    RCVBUF = 4 * 1024 * 1024
+
+    def __init__(self, channel='can0', max_frames=4096):
+        self.channel = channel
+        self.max_frames = max_frames
+        self.socket = socket.socket(socket.AF_CAN, socket.SOCK_RAW,
+                                    socket.CAN_RAW)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                   self.RCVBUF)
+        except OSError as e:
+            print(f"Не удалось увеличить буфер приема: {e}")
+        self.socket.bind((channel, ))
+        self.buffer = bytearray(max_frames * CAN_FRAME.itemsize)
+        self.view = memoryview(self.buffer)
+
+    def set_filters(self, arbitration_ids):
+        """Фильтр ядра: только стандартные кадры данных с заданными ID"""
+        mask = CAN_EFF_FLAG | CAN_RTR_FLAG | CAN_SFF_MASK
+        filters = b''.join(
+            struct.pack('=II', arbitration_id, mask)
+            for arbitration_id in sorted(arbitration_ids))
+        self.socket.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER,
+                               filters)
+
+    def read(self, timeout=0.1):
+        """
+        Все накопившиеся кадры (до max_frames)
+
+        Возвращаемый массив - представление внутреннего буфера и
+        действителен до следующего вызова read().
+
+        :return: (массив CAN_FRAME, метка времени пачки)
+        """
+        ready, _, _ = select.select([self.socket], [], [], timeout)
+        if not ready:
+            return frames_from_buffer(self.buffer, 0), time.time()
+        size = CAN_FRAME.itemsize
+        count = 0
+        while count < self.max_frames:
+            try:
+                self.socket.recv_into(self.view[count * size:], size,
+                                      socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            count += 1
+        return frames_from_buffer(self.buffer, count), time.time()
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,139 @@
+import threading
+
+import numpy as np
+
+# Способы прореживания окна истории
+DECIMATE_MINMAX = 'minmax'  # минимум и максимум каждого интервала
+DECIMATE_STRIDE = 'stride'  # каждая k-я точка
+DECIMATE_METHODS = (DECIMATE_MINMAX, DECIMATE_STRIDE)
+
+
+class RingBuffer:
+    """Кольцевой буфер (время, значение) фиксированной глубины"""
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.timestamps = np.zeros(depth, dtype=np.float64)
+        self.values = np.zeros(depth, dtype=np.float64)
+        self.head = 0  # индекс следующей записи
+        self.count = 0
+
+    def append(self, timestamp, value):
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.depth
+        self.count = min(self.count + 1, self.depth)
+
+    def extend(self, timestamps, values):
+        """Добавление массива точек (старые вытесняются)"""
+        n = len(timestamps)
+        if n >= self.depth:
+            timestamps = timestamps[-self.depth:]
+            values = values[-self.depth:]
+            n = self.depth
+        first = min(n, self.depth - self.head)
+        self.timestamps[self.head:self.head + first] = timestamps[:first]
+        self.values[self.head:self.head + first] = values[:first]
+        rest = n - first
+        if rest:
+            self.timestamps[:rest] = timestamps[first:]
+            self.values[:rest] = values[first:]
+        self.head = (self.head + n) % self.depth
+        self.count = min(self.count + n, self.depth)
+
+    def ordered(self):
+        """Все точки от старой к новой (копия)"""
+        if self.count < self.depth:
+            return (self.timestamps[:self.count].copy(),
+                    self.values[:self.count].copy())
+        return (np.concatenate(
+            (self.timestamps[self.head:], self.timestamps[:self.head])),
+                np.concatenate(
+                    (self.values[self.head:], self.values[:self.head])))
+
+
+def decimate(timestamps, values, points, method=DECIMATE_MINMAX):
+    """
+    Прореживание до ~points точек
+
+    minmax: окно делится на points/2 интервалов, от каждого остаются
+    минимум и максимум в порядке времени - экстремумы не теряются.
+    """
+    if method not in DECIMATE_METHODS:
+        raise ValueError(f"Неизвестный способ прореживания: {method}")
+    n = len(timestamps)
+    if points <= 0 or n <= points:
+        return timestamps, values
+    if method == DECIMATE_STRIDE:
+        step = int(np.ceil(n / points))
+        return timestamps[::step], values[::step]
+
+    buckets = max(points // 2, 1)
+    bucket = np.minimum(
+        (np.arange(n) * buckets) // n, buckets - 1)
+    # Внутри интервала: первый элемент после сортировки - минимум,
+    # последний - максимум
+    order = np.lexsort((values, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(buckets), 'left')
+    ends = np.searchsorted(bucket[order], np.arange(buckets), 'right') - 1
+    picks = np.unique(np.concatenate((order[starts], order[ends])))
+    return timestamps[picks], values[picks]
+
+
+class EncoderHistory:
+    """История абсолютного угла по энкодерам: буфер на узел"""
+
+    def __init__(self, depth=10000):
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.buffers = {}
+
+    def buffer(self, node_id):
+        ring = self.buffers.get(node_id)
+        if ring is None:
+            ring = self.buffers[node_id] = RingBuffer(self.depth)
+        return ring
+
+    def append(self, node_id, timestamp, value):
+        with self.lock:
+            self.buffer(node_id).append(timestamp, value)
+
+    def extend(self, node_ids, timestamps, values):
+        """Пачка точек разных узлов (порядок внутри узла сохраняется)"""
+        node_ids = np.asarray(node_ids)
+        with self.lock:
+            for node_id in np.unique(node_ids):
+                mask = node_ids == node_id
+                self.buffer(int(node_id)).extend(timestamps[mask],
+                                                 values[mask])
+
+    def remove(self, node_id):
+        with self.lock:
+            self.buffers.pop(node_id, None)
+
+    def window(self,
+               node_id,
+               start=None,
+               end=None,
+               points=None,
+               method=DECIMATE_MINMAX):
+        """
+        Точки узла за интервал времени
+
+        :param start: начало (метка времени), None - с самой старой
+        :param end: конец, None - до последней
+        :param points: прореживание до этого числа точек
+        :return: (метки времени, значения) - массивы NumPy
+        """
+        with self.lock:
+            ring = self.buffers.get(node_id)
+            if ring is None:
+                return np.zeros(0), np.zeros(0)
+            timestamps, values = ring.ordered()
+        lo = 0 if start is None else np.searchsorted(timestamps, start, 'left')
+        hi = (len(timestamps) if end is None else np.searchsorted(
+            timestamps, end, 'right'))
+        timestamps, values = timestamps[lo:hi], values[lo:hi]
+        if points:
+            timestamps, values = decimate(timestamps, values, points, method)
+        return timestamps, values
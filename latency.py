@@ -0,0 +1,183 @@
+import threading
+import time
+
+import numpy as np
+
+# Этапы пути CAN -> клиент
+STAGE_KERNEL = 'kernel'  # метка времени ядра -> поток приема
+STAGE_UPDATE = 'update'  # обработка кадра: декодирование и состояние
+STAGE_QUEUE = 'queue'  # обновление состояния -> начало сериализации
+STAGE_SERIALIZE = 'serialize'  # упаковка пакета для клиента
+STAGE_SEND = 'send'  # запись в сокет
+STAGE_TOTAL = 'total'  # метка времени ядра -> данные отправлены клиенту
+STAGES = (STAGE_KERNEL, STAGE_UPDATE, STAGE_QUEUE, STAGE_SERIALIZE,
+          STAGE_SEND, STAGE_TOTAL)
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек в стиле HDR: логарифмические интервалы, внутри
+    каждого - линейные подынтервалы
+
+    Значения хранятся в микросекундах; относительная погрешность квантиля
+    не больше 1 / 2**(sub_bits - 1). Запись - O(1) без выделения памяти.
+    """
+
+    def __init__(self, sub_bits=7, max_seconds=100.0):
+        """
+        :param sub_bits: разрядность подынтервалов (7 - погрешность 1.6%)
+        :param max_seconds: максимальное значение, большие - в последний
+                            интервал
+        """
+        self.sub_bits = sub_bits
+        self.half = 1 << (sub_bits - 1)
+        self.max_value = int(max_seconds * 1e6)
+        self.counts = np.zeros(self.index(self.max_value) + 1, dtype=np.int64)
+        self.total = 0
+        self.maximum = 0
+
+    def index(self, value):
+        """Номер интервала для значения в микросекундах"""
+        exponent = max(value.bit_length() - self.sub_bits, 0)
+        return exponent * self.half + (value >> exponent)
+
+    def value_at(self, index):
+        """Нижняя граница интервала, мкс"""
+        exponent = np.maximum(index // self.half - 1, 0)
+        return (index - exponent * self.half) << exponent
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), self.max_value)
+        self.counts[self.index(value)] += 1
+        self.total += 1
+        if value > self.maximum:
+            self.maximum = value
+
+    def record_many(self, seconds):
+        """Массив значений (в секундах) за одну операцию"""
+        values = np.clip((np.asarray(seconds) * 1e6).astype(np.int64), 0,
+                         self.max_value)
+        if not len(values):
+            return
+        bits = np.zeros(len(values), dtype=np.int64)
+        nonzero = values > 0
+        bits[nonzero] = np.floor(np.log2(values[nonzero])).astype(
+            np.int64) + 1
+        exponent = np.maximum(bits - self.sub_bits, 0)
+        indexes = exponent * self.half + (values >> exponent)
+        self.counts += np.bincount(indexes, minlength=len(self.counts))
+        self.total += len(values)
+        self.maximum = max(self.maximum, int(values.max()))
+
+    def percentile(self, q):
+        """Квантиль q (0..100), секунды"""
+        if not self.total:
+            return 0.0
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, self.total * q / 100.0))
+        return min(int(self.value_at(index)), self.maximum) / 1e6
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total = 0
+        self.maximum = 0
+
+
+class PipelineStats:
+    """
+    Задержки по этапам и счетчики потерь пути CAN -> клиент
+
+    Контрольные точки узла (метка времени кадра и момент обновления
+    состояния по time.monotonic) запоминаются при приеме и используются
+    при сериализации и отправке - для объединенных обновлений берется
+    последнее.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.counters = {}
+        # node_id -> (метка времени кадра, time.monotonic() обновления)
+        self.checkpoints = {}
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.histograms[stage].record(seconds)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def received(self, node_id, frame_time, started):
+        """
+        Кадр энкодера обработан
+
+        :param frame_time: метка времени кадра (ядро, time.time())
+        :param started: time.monotonic() начала обработки
+        """
+        now = time.monotonic()
+        # Пишут потоки приема всех каналов и потоки отправки клиентам
+        with self.lock:
+            self.histograms[STAGE_UPDATE].record(now - started)
+            self.histograms[STAGE_KERNEL].record(time.time() -
+                                                 (now - started) - frame_time)
+        self.checkpoints[node_id] = (frame_time, now)
+
+    def received_batch(self, node_ids, frame_time, started):
+        """
+        Пачка кадров сырого сокета обработана
+
+        Метка времени пачки - момент чтения, поэтому этап kernel не
+        измеряется; время обработки - на пачку.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.histograms[STAGE_UPDATE].record(now - started)
+        for node_id in node_ids:
+            self.checkpoints[int(node_id)] = (frame_time, now)
+
+    def serialized(self, node_ids, started):
+        """
+        Пакет для клиента упакован
+
+        :param started: time.monotonic() начала сериализации
+        """
+        now = time.monotonic()
+        waits = [started - self.checkpoints[node_id][1]
+                 for node_id in node_ids if node_id in self.checkpoints]
+        with self.lock:
+            self.histograms[STAGE_SERIALIZE].record(now - started)
+            self.histograms[STAGE_QUEUE].record_many(waits)
+
+    def sent(self, node_ids, started):
+        """
+        Пакет отправлен в сокет
+
+        :param started: time.monotonic() начала отправки
+        """
+        elapsed = time.monotonic() - started
+        now = time.time()
+        totals = [now - self.checkpoints[node_id][0]
+                  for node_id in node_ids if node_id in self.checkpoints]
+        with self.lock:
+            self.histograms[STAGE_SEND].record(elapsed)
+            self.histograms[STAGE_TOTAL].record_many(totals)
+
+    def snapshot(self):
+        """{этап: {count, p50_ms, p99_ms, max_ms}}"""
+        with self.lock:
+            return {
+                stage: {
+                    "count": histogram.total,
+                    "p50_ms": round(histogram.percentile(50) * 1e3, 3),
+                    "p99_ms": round(histogram.percentile(99) * 1e3, 3),
+                    "max_ms": round(histogram.maximum / 1e3, 3)
+                }
+                for stage, histogram in self.histograms.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            self.counters = {}
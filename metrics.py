@@ -0,0 +1,192 @@
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def count_value(counter):
+    """Текущее значение itertools.count (из repr: 'count(N)')"""
+    return int(repr(counter)[6:-1])
+
+
+def thread_shard(shards, factory):
+    """
+    Слагаемое текущего потока: в него пишет только этот поток, поэтому
+    пачки add(n) из разных потоков не теряются без общей блокировки
+    """
+    shard = shards.get(threading.get_ident())
+    if shard is None:
+        shard = shards.setdefault(threading.get_ident(), factory())
+    return shard
+
+
+class Counter:
+    """
+    Монотонный счетчик без блокировок
+
+    inc() - это next() у itertools.count: одна операция на C, атомарная
+    под GIL, десятки наносекунд. add(n) - для пачек из любых потоков:
+    каждый поток копит свое слагаемое, сумма - при чтении.
+    """
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.count = itertools.count()
+        self.inc = self.count.__next__
+        # id потока -> [сумма пачек]
+        self.shards = {}
+
+    def add(self, amount):
+        thread_shard(self.shards, lambda: [0])[0] += amount
+
+    @property
+    def value(self):
+        return count_value(self.count) + sum(
+            shard[0] for shard in list(self.shards.values()))
+
+    def samples(self):
+        return [('', self.value)]
+
+
+def format_labels(names, key, fmt=str):
+    """Метки в формате Prometheus: {a="1",b="2"}"""
+    if isinstance(names, str):
+        names, key = (names, ), (key, )
+    pairs = ','.join(f'{name}="{fmt(value)}"'
+                     for name, value in zip(names, key))
+    return f'{{{pairs}}}'
+
+
+class LabeledCounter:
+    """Счетчики с одной меткой (например, COB-ID): отдельный на значение"""
+
+    def __init__(self, name, help_text, label, fmt=str):
+        """
+        :param label: имя метки
+        :param fmt: форматирование значения метки (например, hex)
+        """
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.fmt = fmt
+        self.children = {}
+        # id потока -> {значение метки: сумма пачек}
+        self.shards = {}
+
+    def inc(self, value):
+        counter = self.children.get(value)
+        if counter is None:
+            # setdefault атомарен: параллельный поток получит тот же счетчик
+            counter = self.children.setdefault(value, itertools.count())
+        next(counter)
+
+    def add(self, value, amount):
+        """Пачка (из любого потока - в слагаемое этого потока)"""
+        shard = thread_shard(self.shards, dict)
+        shard[value] = shard.get(value, 0) + amount
+
+    def samples(self):
+        values = {
+            value: count_value(counter)
+            for value, counter in list(self.children.items())
+        }
+        for shard in list(self.shards.values()):
+            for value, amount in list(shard.items()):
+                values[value] = values.get(value, 0) + amount
+        return [(format_labels(self.label, value, self.fmt), total)
+                for value, total in sorted(values.items())]
+
+
+class Gauge:
+    """
+    Значение, вычисляемое при чтении метрик
+
+    callback() возвращает число или {значение метки: число}; для
+    нескольких меток label - кортеж имен, ключи - кортежи значений.
+    """
+
+    def __init__(self, name, help_text, callback, label=None):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.label = label
+
+    def samples(self):
+        value = self.callback()
+        if self.label is None:
+            return [('', value)]
+        return [(format_labels(self.label, key), item)
+                for key, item in sorted(value.items())]
+
+
+class MetricsRegistry:
+    """Набор метрик процесса в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric, kind):
+        # Повторная регистрация (перезапуск сервера) заменяет метрику
+        self.metrics[metric.name] = (metric, kind)
+        return metric
+
+    def counter(self, name, help_text, label=None, fmt=str):
+        if label is not None:
+            return self.register(LabeledCounter(name, help_text, label, fmt),
+                                 'counter')
+        return self.register(Counter(name, help_text), 'counter')
+
+    def gauge(self, name, help_text, callback, label=None, kind='gauge'):
+        """
+        Метрика, вычисляемая при чтении
+
+        :param kind: 'counter' - для счетчиков, которые уже ведет сам объект
+                     (например, SharedBus.frames_received)
+        """
+        return self.register(Gauge(name, help_text, callback, label), kind)
+
+    def render(self):
+        lines = []
+        for metric, kind in list(self.metrics.values()):
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"Ошибка метрики {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{metric.name}{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+# Метрики процесса; модули регистрируют свои счетчики при импорте
+registry = MetricsRegistry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host='0.0.0.0', port=9100):
+    """HTTP-сервер GET /metrics в фоновом потоке"""
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever,
+                     name='metrics',
+                     daemon=True).start()
+    print(f"Метрики: http://{host}:{port}/metrics")
+    return httpd
@@ -0,0 +1,166 @@
+import threading
+import time
+
+import numpy as np
+
+
+class MotionEstimator:
+    """
+    Оценка угловой скорости и ускорения энкодеров (alpha-beta-gamma фильтр)
+
+    Состояние фильтра - позиция, скорость и ускорение узла в массивах NumPy
+    по слотам. Шаг фильтра - O(1) на кадр: прогноз на dt вперед и коррекция
+    по невязке. Коэффициенты - критически демпфированного фильтра с
+    затухающей памятью, theta = exp(-dt / time_constant): полоса фильтра
+    задается во времени и не зависит от частоты кадров, а при малом dt
+    (джиттер меток времени) коэффициенты стремятся к нулю, а не к делению
+    на ноль. Пачка кадров обрабатывается векторно по узлам: за один проход -
+    очередной кадр каждого узла пачки.
+    """
+
+    def __init__(self, time_constant=0.02, max_gap=0.5, capacity=128):
+        """
+        :param time_constant: постоянная времени фильтра, с (меньше - быстрее
+                              реакция, больше - меньше шум)
+        :param max_gap: пауза между кадрами, после которой фильтр
+                        перезапускается, с
+        :param capacity: начальное количество слотов
+        """
+        if not time_constant > 0:
+            raise ValueError("time_constant должна быть больше 0")
+        self.time_constant = time_constant
+        self.max_gap = max_gap
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.count = 0
+        self.node_ids = np.zeros(0, dtype=np.int32)
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        old = self.count
+        for name, dtype in (('node_ids', np.int32), ('valid', np.bool_),
+                            ('position', np.float64),
+                            ('velocity', np.float64),
+                            ('acceleration', np.float64),
+                            ('timestamp', np.float64)):
+            array = np.zeros(capacity, dtype)
+            if old:
+                array[:old] = getattr(self, name)[:old]
+            setattr(self, name, array)
+
+    def slot(self, node_id):
+        slot = self.slots.get(node_id)
+        if slot is None:
+            if self.count == len(self.node_ids):
+                self.allocate(len(self.node_ids) * 2)
+            slot = self.count
+            self.count += 1
+            self.node_ids[slot] = node_id
+            self.slots[node_id] = slot
+        return slot
+
+    def step(self, slots, measured, timestamps):
+        """Один шаг фильтра для массива разных слотов"""
+        dt = timestamps - self.timestamp[slots]
+        restart = ~self.valid[slots] | (dt > self.max_gap)
+        # Кадр с прежней или более ранней меткой времени не сдвигает фильтр
+        dt = np.where(restart, 0.0, np.maximum(dt, 0.0))
+        theta = np.exp(-dt / self.time_constant)
+        alpha = 1 - theta**3
+        beta = 1.5 * (1 - theta)**2 * (1 + theta)
+        gamma = 0.5 * (1 - theta)**3
+        # Деление только там, где dt > 0 (иначе beta = gamma = 0)
+        inv_dt = np.divide(1.0, dt, out=np.zeros_like(dt), where=dt > 0)
+
+        velocity = self.velocity[slots]
+        acceleration = self.acceleration[slots]
+        predicted = (self.position[slots] + velocity * dt +
+                     0.5 * acceleration * dt * dt)
+        residual = measured - predicted
+
+        self.position[slots] = np.where(restart, measured,
+                                        predicted + alpha * residual)
+        self.velocity[slots] = np.where(
+            restart, 0.0,
+            velocity + acceleration * dt + beta * residual * inv_dt)
+        self.acceleration[slots] = np.where(
+            restart, 0.0,
+            acceleration + 2 * gamma * residual * inv_dt * inv_dt)
+        self.timestamp[slots] = np.where(restart | (dt > 0), timestamps,
+                                         self.timestamp[slots])
+        self.valid[slots] = True
+
+    def update(self, node_id, position, timestamp):
+        """Новый абсолютный угол одного узла"""
+        with self.lock:
+            slot = np.array([self.slot(node_id)])
+            self.step(slot, np.array([position], dtype=np.float64),
+                      np.array([timestamp], dtype=np.float64))
+
+    def update_batch(self, node_ids, positions, timestamps):
+        """
+        Пачка кадров разных узлов (порядок внутри узла сохраняется)
+
+        Проходов столько, сколько кадров у самого частого узла пачки.
+        """
+        node_ids = np.asarray(node_ids)
+        n = len(node_ids)
+        if not n:
+            return
+        positions = np.asarray(positions, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        with self.lock:
+            unique_ids, inverse = np.unique(node_ids, return_inverse=True)
+            unique_slots = np.array(
+                [self.slot(int(node_id)) for node_id in unique_ids])
+            order = np.argsort(inverse, kind='stable')
+            group = inverse[order]
+            first = np.ones(n, dtype=bool)
+            first[1:] = group[1:] != group[:-1]
+            starts = np.flatnonzero(first)
+            # Номер кадра внутри своего узла
+            rank = np.arange(n) - starts[np.cumsum(first) - 1]
+            slots = unique_slots[group]
+            measured = positions[order]
+            times = timestamps[order]
+            by_rank = np.argsort(rank, kind='stable')
+            bounds = np.cumsum(np.bincount(rank))
+            for begin, end in zip(np.concatenate(([0], bounds[:-1])),
+                                  bounds):
+                index = by_rank[begin:end]
+                self.step(slots[index], measured[index], times[index])
+
+    def reset(self, node_id):
+        """Перезапуск фильтра узла (сброс позиции, смена ID)"""
+        slot = self.slots.get(node_id)
+        if slot is not None:
+            with self.lock:
+                self.valid[slot] = False
+
+    def get(self, node_id, max_age=None):
+        """
+        (скорость, ускорение) узла, °/с и °/с², или None
+
+        :param max_age: None, если последний кадр старше max_age секунд
+                        (энкодер с передачей по изменению замолчал)
+        """
+        slot = self.slots.get(node_id)
+        if slot is None or not self.valid[slot]:
+            return None
+        if (max_age is not None
+                and time.time() - self.timestamp[slot] > max_age):
+            return None
+        with self.lock:
+            return (float(self.velocity[slot]),
+                    float(self.acceleration[slot]))
+
+    def as_dict(self, node_ids=None):
+        """{node_id: (скорость, ускорение)} для node_ids или всех узлов"""
+        if node_ids is None:
+            node_ids = list(self.slots)
+        result = {}
+        for node_id in node_ids:
+            estimate = self.get(node_id)
+            if estimate is not None:
+                result[node_id] = estimate
+        return result
@@ -0,0 +1,239 @@
+import argparse
+import time
+
+from latency import LatencyHistogram
+from step_motor import MoveStepMotor
+
+
+class StepperPositionController:
+    """
+    Позиционирование шагового двигателя по абсолютному углу энкодера
+
+    Цикл с фиксированной частотой (дедлайны по time.monotonic без
+    накопления ошибки): угол берется из MultiEncoderMonitor, двигателю
+    отправляется порция шагов по остатку ошибки, следующая порция - только
+    после подтверждения 0xAA и остановки вала. Перелет и пропуск шагов
+    исправляются следующими порциями; фактический угол на шаг уточняется
+    по результату каждой порции.
+    """
+
+    def __init__(self,
+                 monitor,
+                 motor,
+                 encoder_node,
+                 steps_per_rev=1024,
+                 direction_sign=1,
+                 rate=50.0,
+                 tolerance=0.5,
+                 gain=0.8,
+                 max_chunk=256,
+                 still_velocity=2.0,
+                 settle_cycles=3,
+                 ack_timeout=2.0):
+        """
+        :param monitor: MultiEncoderMonitor с запущенным приемом
+        :param motor: MoveStepMotor
+        :param encoder_node: node_id энкодера на валу двигателя
+        :param steps_per_rev: шагов двигателя на оборот вала
+        :param direction_sign: 1 - direction=1 увеличивает угол энкодера,
+                               -1 - уменьшает
+        :param rate: частота цикла регулятора, Гц
+        :param tolerance: допустимая ошибка позиции, градусы
+        :param gain: доля ошибки, отрабатываемая одной порцией (< 1 -
+                     подход без перелета)
+        :param max_chunk: максимум шагов в порции
+        :param still_velocity: скорость, ниже которой вал считается
+                               остановившимся, °/с
+        :param settle_cycles: циклов в допуске для завершения
+        :param ack_timeout: ожидание подтверждения порции, с
+        """
+        self.monitor = monitor
+        self.motor = motor
+        self.encoder_node = encoder_node
+        self.degrees_per_step = 360.0 / steps_per_rev
+        self.direction_sign = direction_sign
+        self.period = 1.0 / rate
+        self.tolerance = tolerance
+        self.gain = gain
+        self.max_chunk = min(max_chunk, motor.RESOLUTION)
+        self.still_velocity = still_velocity
+        self.settle_cycles = settle_cycles
+        self.ack_timeout = ack_timeout
+        # Фактический угол на шаг / расчетный (пропуск шагов, люфт)
+        self.scale = 1.0
+        self.running = False
+        # Опоздание пробуждения цикла относительно дедлайна
+        self.jitter = LatencyHistogram()
+
+    def angle(self):
+        state = self.monitor.encoder_states.get(self.encoder_node)
+        if state is None:
+            raise RuntimeError(f"Нет данных энкодера {self.encoder_node}")
+        return state[2]
+
+    def velocity(self, angle, previous):
+        """Скорость вала: оценка motion.py или разность за цикл"""
+        if self.monitor.motion is not None:
+            estimate = self.monitor.motion.get(self.encoder_node,
+                                               max_age=2 * self.period)
+            if estimate is not None:
+                return estimate[0]
+        if previous is None:
+            return 0.0
+        return (angle - previous) / self.period
+
+    def steps_for(self, error):
+        """(direction, steps) порции для ошибки в градусах"""
+        steps = abs(error) * self.gain / (self.degrees_per_step * self.scale)
+        steps = int(min(max(round(steps), 1), self.max_chunk))
+        direction = 1 if error * self.direction_sign > 0 else 0
+        return direction, steps
+
+    def move_by(self, delta, timeout=10.0):
+        return self.move_to(self.angle() + delta, timeout)
+
+    def move_to(self, target, timeout=10.0):
+        """
+        Перемещение вала в абсолютный угол энкодера
+
+        :param target: целевой абсолютный угол, градусы
+        :param timeout: максимальное время перемещения, с
+        :return: словарь результата (success, angle, error, chunks, steps,
+                 elapsed, overruns, jitter_p99_ms)
+        """
+        self.running = True
+        self.jitter.reset()
+        start = time.monotonic()
+        deadline = start
+        previous = None
+        pending = None  # (future, отправлено, угол до порции, шагов)
+        settled = 0
+        still = 0
+        chunks = 0
+        total_steps = 0
+        overruns = 0
+        success = False
+        angle = self.angle()
+        try:
+            while self.running and time.monotonic() - start < timeout:
+                deadline += self.period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                lateness = time.monotonic() - deadline
+                self.jitter.record(lateness)
+                if lateness > self.period:
+                    # Пропущенные циклы не навёрстываются
+                    skipped = int(lateness // self.period)
+                    overruns += skipped
+                    deadline += skipped * self.period
+
+                angle = self.angle()
+                velocity = self.velocity(angle, previous)
+                previous = angle
+                error = target - angle
+
+                if pending is not None:
+                    future, sent, before, steps = pending
+                    acked = future.done()
+                    if not acked and time.monotonic() - sent < self.ack_timeout:
+                        continue
+                    # Подтверждение может прийти до начала движения: порция
+                    # завершена, когда вал стоит settle_cycles циклов подряд
+                    still = still + 1 if abs(
+                        velocity) <= self.still_velocity else 0
+                    if still < self.settle_cycles:
+                        continue
+                    if acked:
+                        self.motor.release()
+                    else:
+                        self.motor.bus.discard(self.motor.RESPONSE_ID, future)
+                    self.learn(angle - before, steps)
+                    pending = None
+
+                if abs(velocity) > self.still_velocity:
+                    settled = 0
+                    continue
+                if abs(error) <= self.tolerance:
+                    settled += 1
+                    if settled >= self.settle_cycles:
+                        success = True
+                        break
+                    continue
+                settled = 0
+                direction, steps = self.steps_for(error)
+                future = self.motor.command(1, direction, steps)
+                pending = (future, time.monotonic(), angle,
+                           steps if direction == 1 else -steps)
+                still = 0
+                chunks += 1
+                total_steps += steps
+        finally:
+            self.running = False
+            if pending is not None:
+                self.motor.bus.discard(self.motor.RESPONSE_ID, pending[0])
+
+        return {
+            "success": success,
+            "angle": angle,
+            "error": target - angle,
+            "chunks": chunks,
+            "steps": total_steps,
+            "elapsed": time.monotonic() - start,
+            "overruns": overruns,
+            "jitter_p99_ms": self.jitter.percentile(99) * 1e3,
+        }
+
+    def learn(self, moved, signed_steps):
+        """Уточнение угла на шаг по результату порции"""
+        expected = signed_steps * self.direction_sign * self.degrees_per_step
+        if abs(expected) < self.tolerance:
+            return
+        ratio = moved / expected
+        if 0.2 <= ratio <= 2.0:
+            self.scale = 0.5 * self.scale + 0.5 * ratio
+
+    def stop(self):
+        self.running = False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Позиционирование шагового двигателя по энкодеру')
+    parser.add_argument('--channel', default='can0')
+    parser.add_argument('--node',
+                        type=int,
+                        required=True,
+                        help='Node ID энкодера на валу')
+    parser.add_argument('--target',
+                        type=float,
+                        required=True,
+                        help='Целевой абсолютный угол, градусы')
+    parser.add_argument('--relative',
+                        action='store_true',
+                        help='target - смещение от текущего угла')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--rate', type=float, default=50.0)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    args = parser.parse_args()
+
+    from encoders import MultiEncoderMonitor
+    monitor = MultiEncoderMonitor(channel=args.channel, node_ids=[args.node])
+    monitor.enable_motion()
+    monitor.start_ingest()
+    time.sleep(0.2)
+    with MoveStepMotor(channel=args.channel) as motor:
+        controller = StepperPositionController(monitor,
+                                               motor,
+                                               args.node,
+                                               rate=args.rate,
+                                               tolerance=args.tolerance)
+        if args.relative:
+            result = controller.move_by(args.target, args.timeout)
+        else:
+            result = controller.move_to(args.target, args.timeout)
+    monitor.stop_ingest()
+    print(f"{'Готово' if result['success'] else 'Не достигнуто'}: "
+          f"угол {result['angle']:.2f}°, ошибка {result['error']:+.2f}°, "
+          f"порций {result['chunks']}, {result['elapsed']:.2f} с, "
+          f"джиттер p99 {result['jitter_p99_ms']:.2f} мс")
@@ -0,0 +1,258 @@
+import functools
+import json
+import struct
+
+# Заголовок кадра: длина полезной нагрузки (без заголовка) и тип сообщения
+HEADER = struct.Struct('<IB')
+
+# Типы сообщений
+MSG_JSON = 0x01  # UTF-8 JSON (команды, ответы, данные энкодеров в JSON)
+MSG_ENCODER_DATA = 0x02  # Бинарный пакет состояний энкодеров
+MSG_MOTION_DATA = 0x03  # Бинарный пакет скоростей и ускорений энкодеров
+MSG_ENCODER_FIELDS = 0x04  # Бинарный пакет выбранных полей энкодеров
+
+# Пакет энкодеров: количество записей и градусов на шаг энкодера
+SAMPLES_HEADER = struct.Struct('<Hd')
+# Запись: node_id, сырые отсчеты, полные обороты, начальный абсолютный угол,
+# последнее направление, метка времени
+SAMPLE = struct.Struct('<HIidbd')
+
+# Пакет движения: количество записей; запись: node_id, скорость (°/с),
+# ускорение (°/с²)
+MOTION_HEADER = struct.Struct('<H')
+MOTION = struct.Struct('<Hdd')
+
+# Поля состояния энкодера для подписки с выбором полей и их форматы:
+# сырые отсчеты, угол в обороте, абсолютный угол, угол от начального,
+# метка времени, полные обороты, направление
+FIELDS = ('raw', 'normalized', 'absolute', 'delta', 'timestamp', 'turns',
+          'direction')
+FIELD_CODES = {
+    'raw': 'I',
+    'normalized': 'd',
+    'absolute': 'd',
+    'delta': 'd',
+    'timestamp': 'd',
+    'turns': 'i',
+    'direction': 'b'
+}
+
+# Пакет полей: количество записей и битовая маска полей (порядок FIELDS);
+# запись: node_id и значения полей маски
+FIELDS_HEADER = struct.Struct('<HB')
+
+# Ключ узла в потоке клиентам: номер канала сервера (старшие биты) и
+# node_id CANopen (младший байт); у первого канала ключ равен node_id
+NODE_KEY_BITS = 8
+
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+ENCODINGS = ('binary', 'json')
+
+
+class ProtocolError(Exception):
+    """Нарушение формата потока"""
+
+
+def pack_frame(msg_type, payload):
+    """Формирование кадра: заголовок + полезная нагрузка"""
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"Слишком большой кадр: {len(payload)} байт")
+    return HEADER.pack(len(payload), msg_type) + payload
+
+
+def pack_json(message):
+    """JSON-сообщение в кадре MSG_JSON"""
+    return pack_frame(MSG_JSON, json.dumps(message).encode('utf-8'))
+
+
+def node_key(channel_index, node_id):
+    """Ключ узла канала channel_index (номер в списке каналов сервера)"""
+    return channel_index << NODE_KEY_BITS | node_id
+
+
+def split_node_key(key):
+    """Ключ узла -> (номер канала, node_id)"""
+    key = int(key)
+    return key >> NODE_KEY_BITS, key & ((1 << NODE_KEY_BITS) - 1)
+
+
+def pack_records(msg_type, header, records):
+    """Кадр из заголовка пакета и готовых записей узлов"""
+    return pack_frame(msg_type, header + b''.join(records))
+
+
+def pack_json_records(message_type, fragments, **extra):
+    """
+    JSON-кадр {"type": ..., **extra, "data": {node_id: ...}} из готовых
+    JSON-фрагментов узлов
+
+    :param fragments: [(node_id, JSON значения узла)]
+    """
+    head = json.dumps({"type": message_type, **extra})[:-1]
+    data = ', '.join(f'"{node_id}": {fragment}'
+                     for node_id, fragment in fragments)
+    return pack_frame(MSG_JSON,
+                      f'{head}, "data": {{{data}}}}}'.encode('utf-8'))
+
+
+def pack_sample(node_id, state, degrees_per_step):
+    """Запись SAMPLE одного узла пакета MSG_ENCODER_DATA"""
+    current_norm, full_c, _, initial_abs, last_time, last_dir = state
+    raw = int(round(current_norm / degrees_per_step))
+    return SAMPLE.pack(int(node_id), raw, full_c, initial_abs, last_dir,
+                       last_time)
+
+
+def field_mask(fields):
+    return sum(1 << FIELDS.index(name) for name in fields)
+
+
+@functools.lru_cache(maxsize=None)
+def field_struct(mask):
+    """Формат записи пакета полей по маске"""
+    return struct.Struct('<H' + ''.join(FIELD_CODES[name]
+                                        for index, name in enumerate(FIELDS)
+                                        if mask & (1 << index)))
+
+
+def encoder_fields(state, fields, degrees_per_step):
+    """Значения выбранных полей состояния (fields - в порядке FIELDS)"""
+    current_norm, full_c, abs_angle, initial_abs, last_time, last_dir = state
+    values = {
+        'raw': int(round(current_norm / degrees_per_step)),
+        'normalized': current_norm,
+        'absolute': abs_angle,
+        'delta': abs_angle - initial_abs,
+        'timestamp': last_time,
+        'turns': full_c,
+        'direction': last_dir
+    }
+    return tuple(values[name] for name in fields)
+
+
+def unpack_encoder_fields(payload):
+    """Разбор пакета полей: (поля, {node_id: {поле: значение}})"""
+    if len(payload) < FIELDS_HEADER.size:
+        raise ProtocolError("Короткий пакет полей")
+    count, mask = FIELDS_HEADER.unpack_from(payload, 0)
+    record = field_struct(mask)
+    if len(payload) != FIELDS_HEADER.size + count * record.size:
+        raise ProtocolError("Неверная длина пакета полей")
+    fields = [name for index, name in enumerate(FIELDS) if mask & (1 << index)]
+    data = {}
+    for node_id, *values in record.iter_unpack(
+            payload[FIELDS_HEADER.size:]):
+        data[node_id] = dict(zip(fields, values))
+    return fields, data
+
+
+def pack_encoder_data(states, degrees_per_step):
+    """
+    Бинарный пакет состояний энкодеров
+
+    :param states: {node_id: (норм. угол, обороты, абс. угол, нач. абс. угол,
+                    время, направление)} как в MultiEncoderMonitor
+    :param degrees_per_step: градусов на один отсчет энкодера
+    :return: кадр MSG_ENCODER_DATA
+    """
+    payload = bytearray(SAMPLES_HEADER.size + SAMPLE.size * len(states))
+    SAMPLES_HEADER.pack_into(payload, 0, len(states), degrees_per_step)
+    offset = SAMPLES_HEADER.size
+    for node_id, state in states.items():
+        current_norm, full_c, _, initial_abs, last_time, last_dir = state
+        raw = int(round(current_norm / degrees_per_step))
+        SAMPLE.pack_into(payload, offset, int(node_id), raw, full_c,
+                         initial_abs, last_dir, last_time)
+        offset += SAMPLE.size
+    return pack_frame(MSG_ENCODER_DATA, bytes(payload))
+
+
+def unpack_encoder_data(payload):
+    """Разбор бинарного пакета в словарь состояний (формат encoder_states)"""
+    if len(payload) < SAMPLES_HEADER.size:
+        raise ProtocolError("Короткий пакет энкодеров")
+    count, degrees_per_step = SAMPLES_HEADER.unpack_from(payload, 0)
+    if len(payload) != SAMPLES_HEADER.size + count * SAMPLE.size:
+        raise ProtocolError("Неверная длина пакета энкодеров")
+    states = {}
+    for node_id, raw, full_c, initial_abs, last_dir, last_time in \
+            SAMPLE.iter_unpack(payload[SAMPLES_HEADER.size:]):
+        current_norm = (raw * degrees_per_step) % 360
+        states[node_id] = (current_norm, full_c, full_c * 360 + current_norm,
+                           initial_abs, last_time, last_dir)
+    return states
+
+
+def pack_motion_data(motion):
+    """
+    Бинарный пакет скоростей и ускорений
+
+    :param motion: {node_id: (скорость, ускорение)}
+    :return: кадр MSG_MOTION_DATA
+    """
+    payload = bytearray(MOTION_HEADER.size + MOTION.size * len(motion))
+    MOTION_HEADER.pack_into(payload, 0, len(motion))
+    offset = MOTION_HEADER.size
+    for node_id, (velocity, acceleration) in motion.items():
+        MOTION.pack_into(payload, offset, int(node_id), velocity, acceleration)
+        offset += MOTION.size
+    return pack_frame(MSG_MOTION_DATA, bytes(payload))
+
+
+def unpack_motion_data(payload):
+    """Разбор пакета движения в словарь {node_id: (скорость, ускорение)}"""
+    if len(payload) < MOTION_HEADER.size:
+        raise ProtocolError("Короткий пакет движения")
+    count, = MOTION_HEADER.unpack_from(payload, 0)
+    if len(payload) != MOTION_HEADER.size + count * MOTION.size:
+        raise ProtocolError("Неверная длина пакета движения")
+    return {
+        node_id: (velocity, acceleration)
+        for node_id, velocity, acceleration in MOTION.iter_unpack(
+            payload[MOTION_HEADER.size:])
+    }
+
+
+def decode_message(msg_type, payload):
+    """Кадр -> словарь сообщения (как для JSON-протокола)"""
+    if msg_type == MSG_JSON:
+        return json.loads(payload.decode('utf-8'))
+    if msg_type == MSG_ENCODER_DATA:
+        return {"type": "encoder_data", "data": unpack_encoder_data(payload)}
+    if msg_type == MSG_MOTION_DATA:
+        return {"type": "motion_data", "data": unpack_motion_data(payload)}
+    if msg_type == MSG_ENCODER_FIELDS:
+        fields, data = unpack_encoder_fields(payload)
+        return {"type": "encoder_fields", "fields": fields, "data": data}
+    raise ProtocolError(f"Неизвестный тип сообщения: {msg_type}")
+
+
+class FrameDecoder:
+    """Сборка кадров из произвольно нарезанного TCP-потока"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Добавляет принятые байты и возвращает готовые кадры
+
+        :return: список (тип, полезная нагрузка)
+        """
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            length, msg_type = HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_PAYLOAD:
+                raise ProtocolError(f"Слишком большой кадр: {length} байт")
+            end = offset + HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append(
+                (msg_type, bytes(self.buffer[offset + HEADER.size:end])))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return frames
@@ -0,0 +1,289 @@
+import collections
+import json
+import threading
+import time
+
+from protocol import (ENCODINGS, FIELDS, FIELDS_HEADER, MOTION,
+                      MOTION_HEADER, MSG_ENCODER_DATA, MSG_ENCODER_FIELDS,
+                      MSG_MOTION_DATA, SAMPLES_HEADER, encoder_fields,
+                      field_mask, field_struct, node_key, pack_json_records,
+                      pack_records, pack_sample)
+
+# Режимы частоты отправки данных энкодеров клиенту
+RATE_FRAME = 'frame'  # каждое обновление (с объединением, пока клиент занят)
+RATE_MAX_HZ = 'max_hz'  # не чаще max_hz раз в секунду
+RATE_ON_CHANGE = 'on_change'  # только изменившиеся значения
+RATE_MODES = (RATE_FRAME, RATE_MAX_HZ, RATE_ON_CHANGE)
+
+# Подписка клиента на данные энкодеров: формат ('binary'/'json'), скорость
+# и ускорение, поля (None - полное состояние), узлы (None - все) и зона
+# нечувствительности абсолютного угла, градусы
+Subscription = collections.namedtuple(
+    'Subscription', ['encoding', 'motion', 'fields', 'nodes', 'deadband'],
+    defaults=('binary', False, None, None, 0.0))
+
+
+def make_subscription(args):
+    """
+    Подписка из аргументов show_encoder
+
+    :raises ValueError: неизвестный формат или поле, отрицательная зона
+    """
+    encoding = args.get('encoding', 'binary')
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Неизвестный формат: {encoding}")
+    fields = args.get('fields')
+    if fields is not None:
+        unknown = set(fields) - set(FIELDS)
+        if unknown or not fields:
+            raise ValueError(f"Неизвестные поля: {sorted(unknown)}; "
+                             f"допустимые: {', '.join(FIELDS)}")
+        # Порядок FIELDS: одинаковые наборы - одна подписка и один формат
+        fields = tuple(name for name in FIELDS if name in fields)
+    nodes = args.get('nodes')
+    if nodes is not None:
+        nodes = frozenset(int(node_id) for node_id in nodes)
+    deadband = float(args.get('deadband', 0.0))
+    if deadband < 0:
+        raise ValueError("deadband не может быть отрицательной")
+    return Subscription(encoding, bool(args.get('motion', False)), fields,
+                        nodes, deadband)
+
+
+class CoalescingQueue:
+    """
+    Очередь обновлений энкодеров для одного клиента
+
+    Хранит только последнее состояние каждого node_id, поэтому размер
+    ограничен количеством энкодеров, а медленный клиент получает свежие
+    данные вместо накопившейся истории.
+    """
+
+    def __init__(self, rate=RATE_FRAME, max_hz=10.0, notify=None):
+        """
+        :param rate: режим отправки (RATE_MODES)
+        :param max_hz: максимальная частота для режима max_hz
+        :param notify: вызывается, когда в пустой очереди появились данные
+        """
+        # Абсолютный угол последней отправки узла (для deadband)
+        self.last_angle = {}
+        self.deadband = 0.0
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_sent = {}
+        self.last_send_time = 0.0
+        # Обновления, замененные более новыми до отправки
+        self.coalesced = 0
+        self.notify = notify
+        self.rate = RATE_FRAME
+        self.min_interval = 0.0
+        self.configure(rate, max_hz)
+
+    def configure(self, rate, max_hz=10.0, deadband=0.0):
+        """
+        Смена режима без пересоздания очереди
+
+        :param deadband: обновление узла отправляется, только если
+                         абсолютный угол ушел от отправленного больше чем на
+                         deadband градусов (0 - без ограничения)
+        """
+        if rate not in RATE_MODES:
+            raise ValueError(f"Неизвестный режим: {rate}")
+        if rate == RATE_MAX_HZ and not max_hz > 0:
+            raise ValueError("max_hz должен быть больше 0")
+        with self.lock:
+            self.rate = rate
+            self.min_interval = 1.0 / max_hz if rate == RATE_MAX_HZ else 0.0
+            self.last_sent = {}
+            self.deadband = deadband
+            self.last_angle = {}
+
+    def put(self, node_id, state):
+        """Публикация нового состояния узла (вызывается из потока приема)"""
+        with self.lock:
+            if self.deadband and node_id not in self.pending:
+                # Угол в зоне нечувствительности - клиент не будится
+                last = self.last_angle.get(node_id)
+                if last is not None and abs(state[2] - last) <= self.deadband:
+                    return
+            was_empty = not self.pending
+            if node_id in self.pending:
+                self.coalesced += 1
+            self.pending[node_id] = state
+        if was_empty and self.notify is not None:
+            self.notify()
+
+    def put_many(self, states):
+        """Публикация снимка нескольких узлов"""
+        with self.lock:
+            was_empty = not self.pending
+            self.pending.update(states)
+        if was_empty and states and self.notify is not None:
+            self.notify()
+
+    def clear(self):
+        with self.lock:
+            self.pending = {}
+            self.last_sent = {}
+            self.last_angle = {}
+
+    def delay(self, now=None):
+        """
+        Сколько ждать до следующей отправки
+
+        :return: None - нечего отправлять, 0 - можно отправлять сейчас
+        """
+        with self.lock:
+            if not self.pending:
+                return None
+            if now is None:
+                now = time.monotonic()
+            return max(0.0, self.last_send_time + self.min_interval - now)
+
+    def take(self, now=None):
+        """Забирает накопленные обновления для отправки"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if (not self.pending
+                    or now < self.last_send_time + self.min_interval):
+                return {}
+            batch = self.pending
+            self.pending = {}
+            if self.rate == RATE_ON_CHANGE:
+                batch = {
+                    node_id: state
+                    for node_id, state in batch.items()
+                    if self.last_sent.get(node_id) != state
+                }
+                self.last_sent.update(batch)
+            if self.deadband:
+                # Замененное в очереди обновление могло вернуться в зону
+                batch = {
+                    node_id: state
+                    for node_id, state in batch.items()
+                    if node_id not in self.last_angle or
+                    abs(state[2] - self.last_angle[node_id]) > self.deadband
+                }
+                for node_id, state in batch.items():
+                    self.last_angle[node_id] = state[2]
+            if batch:
+                self.last_send_time = now
+            return batch
+
+
+class FrameEncoder:
+    """
+    Кадры данных энкодеров для подписок клиентов
+
+    Запись узла (бинарная или JSON-фрагмент) сериализуется один раз на
+    обновление и формат (encoding, fields): клиенты с одинаковой подпиской
+    получают кадры из одних и тех же записей. Кэш сверяет записи по
+    идентичности кортежа состояния - новое состояние узла - новый кортеж.
+    """
+
+    def __init__(self, degrees_per_step, motion=None, channel_index=0):
+        """
+        :param degrees_per_step: градусов на отсчет энкодера
+        :param motion: motion.MotionEstimator для подписок с motion
+        :param channel_index: номер канала сервера - узлы в кадрах
+                              передаются ключами protocol.node_key
+        """
+        self.degrees_per_step = degrees_per_step
+        self.motion = motion
+        self.channel_index = channel_index
+        # (формат, node_id) -> (состояние, запись)
+        self.records = {}
+
+    def record(self, key, node_id, state, serialize):
+        entry = self.records.get((key, node_id))
+        if entry is not None and entry[0] is state:
+            return entry[1]
+        record = serialize(node_id, state)
+        # Гонка потоков отправки безопасна: в худшем случае запись
+        # сериализуется дважды
+        self.records[key, node_id] = (state, record)
+        return record
+
+    def key(self, node_id):
+        return node_key(self.channel_index, int(node_id))
+
+    def serializer(self, encoding, fields):
+        dps = self.degrees_per_step
+        key = self.key
+        if fields is None:
+            if encoding == 'json':
+                return lambda node_id, state: json.dumps(state)
+            return lambda node_id, state: pack_sample(key(node_id), state,
+                                                      dps)
+        if encoding == 'json':
+            return lambda node_id, state: json.dumps(
+                dict(zip(fields, encoder_fields(state, fields, dps))))
+        record = field_struct(field_mask(fields))
+        return lambda node_id, state: record.pack(
+            key(node_id), *encoder_fields(state, fields, dps))
+
+    def motion_serializer(self, encoding):
+        estimator = self.motion
+
+        def serialize(node_id, state):
+            estimate = estimator.get(node_id)
+            if estimate is None:
+                return None
+            if encoding == 'json':
+                return json.dumps(estimate)
+            return MOTION.pack(self.key(node_id), *estimate)
+
+        return serialize
+
+    def encode(self, data, subscription):
+        """
+        Кадр (и кадр движения при subscription.motion) для пакета состояний
+
+        :param data: {node_id: состояние} узлов канала - уже
+                     отфильтрованный пакет
+        """
+        encoding, fields = subscription.encoding, subscription.fields
+        key = (encoding, fields)
+        serialize = self.serializer(encoding, fields)
+        records = [(self.key(node_id),
+                    self.record(key, node_id, state, serialize))
+                   for node_id, state in data.items()]
+        if encoding == 'json':
+            if fields is None:
+                frame = pack_json_records('encoder_data', records)
+            else:
+                frame = pack_json_records('encoder_fields',
+                                          records,
+                                          fields=list(fields))
+        elif fields is None:
+            frame = pack_records(
+                MSG_ENCODER_DATA,
+                SAMPLES_HEADER.pack(len(records), self.degrees_per_step),
+                [record for _, record in records])
+        else:
+            frame = pack_records(
+                MSG_ENCODER_FIELDS,
+                FIELDS_HEADER.pack(len(records), field_mask(fields)),
+                [record for _, record in records])
+        if not subscription.motion or self.motion is None:
+            return frame
+        # Оценка движения обновляется вместе с состоянием узла
+        key = (encoding, 'motion')
+        serialize = self.motion_serializer(encoding)
+        estimates = [(self.key(node_id),
+                      self.record(key, node_id, state, serialize))
+                     for node_id, state in data.items()]
+        estimates = [(node_id, record) for node_id, record in estimates
+                     if record is not None]
+        if encoding == 'json':
+            return frame + pack_json_records('motion_data', estimates)
+        return frame + pack_records(MSG_MOTION_DATA,
+                                    MOTION_HEADER.pack(len(estimates)),
+                                    [record for _, record in estimates])
+
+    def forget(self, node_id):
+        """Удаление записей узла (смена ID)"""
+        # Копия ключей: записи параллельно добавляют потоки рассылки
+        for key in [key for key in list(self.records) if key[1] == node_id]:
+            self.records.pop(key, None)
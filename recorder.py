@@ -0,0 +1,284 @@
+import argparse
+import collections
+import os
+import struct
+import threading
+import time
+
+import can
+import numpy as np
+
+from frames import CAN_EFF_FLAG, CAN_EFF_MASK, CAN_ERR_FLAG, CAN_RTR_FLAG
+
+# Заголовок файла записи; размер равен размеру записи, чтобы записи
+# оставались выровненными
+FILE_MAGIC = b'CANREC\x00\x01'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('<8sHH12x')
+
+KIND_FRAME = 1  # сырой CAN-кадр
+KIND_SAMPLE = 2  # декодированное состояние энкодера (время - момент приема)
+
+# Все записи одного размера; тип записи - в поле kind
+FRAME_RECORD = np.dtype([
+    ('timestamp', '<f8'),
+    ('kind', 'u1'),
+    ('dlc', 'u1'),
+    ('channel', '<u2'),
+    ('can_id', '<u4'),  # ID с флагами EFF/RTR/ERR как в can_frame
+    ('data', 'u1', (8, )),
+])
+SAMPLE_RECORD = np.dtype([
+    ('timestamp', '<f8'),
+    ('kind', 'u1'),
+    ('direction', 'i1'),
+    ('node_id', '<u2'),
+    ('turns', '<i4'),
+    ('normalized', '<f8'),
+])
+RECORD = np.dtype([
+    ('timestamp', '<f8'),
+    ('kind', 'u1'),
+    ('body', 'V15'),
+])
+RECORD_SIZE = RECORD.itemsize
+assert FRAME_RECORD.itemsize == SAMPLE_RECORD.itemsize == RECORD_SIZE
+assert FILE_HEADER.size == RECORD_SIZE
+
+
+class Recorder:
+    """
+    Запись сырых кадров и состояний энкодеров в бинарный файл
+
+    Поток приема только добавляет кортеж в очередь (deque), преобразование
+    в записи, запись на диск и fsync выполняет отдельный поток. Файл
+    дописывается блоками фиксированных записей; при переполнении очереди
+    новые записи отбрасываются и считаются в dropped, прием не ждет диск.
+    """
+
+    def __init__(self,
+                 path,
+                 chunk_records=4096,
+                 flush_interval=0.05,
+                 fsync_interval=1.0,
+                 max_pending=1000000,
+                 channel_index=0):
+        """
+        :param path: файл записи (дописывается, заголовок - для нового)
+        :param chunk_records: записей в одном блоке записи на диск
+        :param flush_interval: максимальная задержка записи блока, с
+        :param fsync_interval: период fsync, с
+        :param max_pending: максимум записей в очереди
+        :param channel_index: номер канала в записях кадров
+        """
+        self.path = path
+        self.chunk_records = chunk_records
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_pending = max_pending
+        self.channel_index = channel_index
+        self.frames = collections.deque()
+        self.samples = collections.deque()
+        self.dropped = 0
+        self.written = 0
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab')
+        if new_file:
+            self.file.write(
+                FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD_SIZE))
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.writer_loop,
+                                       name='recorder',
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Дописывает очередь, делает fsync и закрывает файл"""
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.file.close()
+
+    def attach(self, shared_bus, monitor=None):
+        """Подключение к общей шине (все кадры) и монитору (состояния)"""
+        shared_bus.add_tap(self.record_frame)
+        if monitor is not None:
+            monitor.add_listener(self.record_sample)
+
+    def detach(self, shared_bus, monitor=None):
+        shared_bus.remove_tap(self.record_frame)
+        if monitor is not None:
+            monitor.remove_listener(self.record_sample)
+
+    def record_frame(self, msg):
+        """Сырой кадр (вызывается потоком приема)"""
+        if len(self.frames) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.frames.append((msg.timestamp, msg.arbitration_id,
+                            msg.is_extended_id, msg.is_remote_frame,
+                            msg.is_error_frame, msg.dlc, bytes(msg.data)))
+        if len(self.frames) >= self.chunk_records:
+            self.wakeup.set()
+
+    def record_sample(self, node_id, state):
+        """Состояние энкодера (подписчик MultiEncoderMonitor)"""
+        if len(self.samples) >= self.max_pending:
+            self.dropped += 1
+            return
+        # Время последнего движения (state[4]) у неподвижного энкодера не
+        # меняется - в записи момент приема состояния
+        self.samples.append((time.time(), node_id, state))
+        if len(self.samples) >= self.chunk_records:
+            self.wakeup.set()
+
+    def writer_loop(self):
+        last_fsync = time.monotonic()
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            running = self.running
+            while self.frames or self.samples:
+                self.write_chunk()
+            now = time.monotonic()
+            if not running or now - last_fsync >= self.fsync_interval:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                last_fsync = now
+            if not running:
+                return
+
+    def write_chunk(self):
+        """Один блок: до chunk_records кадров и состояний по времени"""
+        frames, samples = self.drain()
+        blocks = []
+        if frames:
+            records = np.zeros(len(frames), dtype=FRAME_RECORD)
+            records['kind'] = KIND_FRAME
+            records['channel'] = self.channel_index
+            for i, (timestamp, arbitration_id, extended, remote, error, dlc,
+                    data) in enumerate(frames):
+                can_id = arbitration_id
+                if extended:
+                    can_id |= CAN_EFF_FLAG
+                if remote:
+                    can_id |= CAN_RTR_FLAG
+                if error:
+                    can_id |= CAN_ERR_FLAG
+                records['timestamp'][i] = timestamp
+                records['can_id'][i] = can_id
+                records['dlc'][i] = dlc
+                records['data'][i, :len(data)] = np.frombuffer(data[:8],
+                                                               dtype=np.uint8)
+            blocks.append(records.view(RECORD))
+        if samples:
+            records = np.zeros(len(samples), dtype=SAMPLE_RECORD)
+            records['kind'] = KIND_SAMPLE
+            for i, (timestamp, node_id, state) in enumerate(samples):
+                current_norm, full_c, _, _, _, last_dir = state
+                records[i] = (timestamp, KIND_SAMPLE, last_dir, node_id,
+                              full_c, current_norm)
+            blocks.append(records.view(RECORD))
+        if not blocks:
+            return
+        records = np.concatenate(blocks)
+        # Кадры и состояния вперемешку по времени
+        records = records[np.argsort(records['timestamp'], kind='stable')]
+        self.file.write(records.tobytes())
+        self.written += len(records)
+
+    def drain(self):
+        """
+        До chunk_records записей из обеих очередей слиянием по времени
+
+        Очереди упорядочены по времени каждая, поэтому в блок попадают
+        самые ранние записи обеих, а не chunk_records кадров и затем
+        chunk_records состояний.
+        """
+        frames, samples = [], []
+        for _ in range(self.chunk_records):
+            if self.frames and (not self.samples or
+                                self.frames[0][0] <= self.samples[0][0]):
+                frames.append(self.frames.popleft())
+            elif self.samples:
+                samples.append(self.samples.popleft())
+            else:
+                break
+        return frames, samples
+
+
+def read_records(path):
+    """
+    Записи файла через np.memmap (без загрузки в память)
+
+    Записи идут по времени: кадры и состояния сливаются при записи.
+    Исключение - кадр, еще не прочитанный из сокета к моменту записи
+    блока: он может оказаться раньше последних записей предыдущего блока
+    не больше чем на задержку приема.
+
+    :return: массив RECORD; выборку по kind приводят к FRAME_RECORD или
+             SAMPLE_RECORD через view()
+    """
+    with open(path, 'rb') as f:
+        magic, version, record_size = FILE_HEADER.unpack(
+            f.read(FILE_HEADER.size))
+    if magic != FILE_MAGIC or record_size != RECORD_SIZE:
+        raise ValueError(f"{path}: не файл записи CAN (версия {version})")
+    count = (os.path.getsize(path) - FILE_HEADER.size) // RECORD_SIZE
+    if count == 0:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(path,
+                     dtype=RECORD,
+                     mode='r',
+                     offset=FILE_HEADER.size,
+                     shape=(count, ))
+
+
+def frame_to_message(record):
+    """Запись FRAME_RECORD -> can.Message"""
+    can_id = int(record['can_id'])
+    dlc = int(record['dlc'])
+    return can.Message(timestamp=float(record['timestamp']),
+                       arbitration_id=can_id & CAN_EFF_MASK,
+                       is_extended_id=bool(can_id & CAN_EFF_FLAG),
+                       is_remote_frame=bool(can_id & CAN_RTR_FLAG),
+                       is_error_frame=bool(can_id & CAN_ERR_FLAG),
+                       dlc=dlc,
+                       data=bytes(record['data'][:dlc]),
+                       channel=int(record['channel']))
+
+
+def export(path, output):
+    """
+    Экспорт сырых кадров в формат python-can по расширению (.blf, .asc, ...)
+
+    :return: количество экспортированных кадров
+    """
+    records = read_records(path)
+    frames = records[records['kind'] == KIND_FRAME].view(FRAME_RECORD)
+    with can.Logger(output) as logger:
+        for record in frames:
+            logger.on_message_received(frame_to_message(record))
+    return len(frames)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Записи CAN-трафика')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    export_parser = subparsers.add_parser('export',
+                                          help='Экспорт в BLF/ASC python-can')
+    export_parser.add_argument('input', help='Файл записи')
+    export_parser.add_argument('output', help='Файл .blf или .asc')
+    args = parser.parse_args()
+
+    if args.action == 'export':
+        count = export(args.input, args.output)
+        print(f"Экспортировано кадров: {count} -> {args.output}")
@@ -0,0 +1,165 @@
+import argparse
+import threading
+import time
+
+import can
+import numpy as np
+
+from recorder import FRAME_RECORD, KIND_FRAME, frame_to_message, read_records
+
+
+class Replayer:
+    """
+    Воспроизведение записи recorder.py с заданной скоростью
+
+    Файл открывается через np.memmap: в память попадают только читаемые
+    страницы, поэтому размер записи ограничен диском, а не ОЗУ. Блок из
+    одних кадров выдается срезом memmap без копирования; в смешанном блоке
+    (кадры и состояния энкодеров) кадры копируются - не больше
+    chunk_records записей за раз.
+    """
+
+    def __init__(self, path, speed=1.0, chunk_records=4096):
+        """
+        :param path: файл записи
+        :param speed: множитель скорости (1 - реальное время, 0 - максимум)
+        :param chunk_records: записей в одном блоке
+        """
+        self.path = path
+        self.records = read_records(path)
+        self.speed = speed
+        self.chunk_records = chunk_records
+        self.running = False
+
+    def frames(self):
+        """Блоки кадров (FRAME_RECORD) в темпе записи с учетом speed"""
+        self.running = True
+        start_wall = time.monotonic()
+        start_time = None
+        for offset in range(0, len(self.records), self.chunk_records):
+            if not self.running:
+                return
+            chunk = self.records[offset:offset + self.chunk_records]
+            is_frame = chunk['kind'] == KIND_FRAME
+            if is_frame.all():
+                frames = chunk.view(FRAME_RECORD)
+            else:
+                frames = chunk[is_frame].view(FRAME_RECORD)
+            if not len(frames):
+                continue
+            if self.speed <= 0:
+                yield frames
+                continue
+            if start_time is None:
+                start_time = float(frames['timestamp'][0])
+            # Выдача частями по мере наступления времени кадров
+            timestamps = frames['timestamp']
+            position = 0
+            while position < len(frames) and self.running:
+                elapsed = (time.monotonic() - start_wall) * self.speed
+                due = int(
+                    np.searchsorted(timestamps, start_time + elapsed,
+                                    'right'))
+                if due > position:
+                    yield frames[position:due]
+                    position = due
+                    continue
+                wait = (timestamps[position] - start_time -
+                        elapsed) / self.speed
+                time.sleep(min(max(wait, 0.0), 0.01))
+
+    def stop(self):
+        self.running = False
+
+    def to_monitor(self, monitor, batch=True):
+        """
+        Кадры записи -> состояния энкодеров и подписчики монитора
+
+        :param batch: векторный путь handle_frames; False - по кадру через
+                      calculate_delta (как при живом приеме)
+        :return: (кадров, секунд)
+        """
+        count = 0
+        start = time.perf_counter()
+        for frames in self.frames():
+            count += len(frames)
+            if batch:
+                monitor.handle_frames(frames, frames['timestamp'])
+                continue
+            node_ids, angles, index = monitor.decode_frames(frames)
+            timestamps = frames['timestamp'][index]
+            for node_id, angle, timestamp in zip(node_ids.tolist(),
+                                                 angles.tolist(),
+                                                 timestamps.tolist()):
+                monitor.calculate_delta(node_id, angle, timestamp)
+                if monitor.listeners:
+                    monitor.publish(node_id)
+        return count, time.perf_counter() - start
+
+    def to_bus(self, bus):
+        """
+        Кадры записи -> CAN-шина (например, virtual для нагрузочных тестов)
+
+        :return: (кадров, секунд)
+        """
+        count = 0
+        start = time.perf_counter()
+        for frames in self.frames():
+            for record in frames:
+                bus.send(frame_to_message(record))
+            count += len(frames)
+        return count, time.perf_counter() - start
+
+
+def report(count, elapsed):
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"Воспроизведено кадров: {count} за {elapsed:.2f} с "
+          f"({rate:,.0f} кадр/с)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Воспроизведение записи CAN-трафика')
+    parser.add_argument('input', help='Файл записи recorder.py')
+    parser.add_argument('--speed',
+                        type=float,
+                        default=1.0,
+                        help='Скорость (1 - реальное время, 0 - максимум)')
+    parser.add_argument('--per-frame',
+                        action='store_true',
+                        help='Обработка по кадру через calculate_delta')
+    parser.add_argument('--bus',
+                        metavar='CHANNEL',
+                        help='Отправка кадров в виртуальную шину CHANNEL')
+    parser.add_argument('--serve',
+                        action='store_true',
+                        help='Запуск сервера на виртуальной шине и '
+                        'рассылка воспроизводимых данных клиентам')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--nodes',
+                        type=int,
+                        nargs='+',
+                        help='Node ID энкодеров (по умолчанию из конфига)')
+    args = parser.parse_args()
+
+    replayer = Replayer(args.input, args.speed)
+    if args.bus:
+        with can.Bus(interface='virtual', channel=args.bus) as bus:
+            report(*replayer.to_bus(bus))
+    elif args.serve:
+        from server import RPIServer
+        server = RPIServer(port=args.port,
+                           channel='replay',
+                           interface='virtual')
+        threading.Thread(target=server.start, daemon=True).start()
+        report(*replayer.to_monitor(server.encoder_monitor,
+                                    batch=not args.per_frame))
+    else:
+        from encoders import MultiEncoderMonitor
+        monitor = MultiEncoderMonitor(channel='replay',
+                                      node_ids=args.nodes,
+                                      interface='virtual')
+        report(*replayer.to_monitor(monitor, batch=not args.per_frame))
+        for node_id, state in sorted(monitor.get_current_data().items()):
+            print(f"Node {node_id}: {state[0]:9.2f}° обороты {state[1]} "
+                  f"абс. {state[2]:.2f}°")
@@ -0,0 +1,394 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import queue
+import socket
+import threading
+import time
+
+from latency import LatencyHistogram
+from protocol import FrameDecoder, decode_message, pack_json
+
+# Типы потоковых сообщений сервера (не ответы на команды)
+STREAM_TYPES = ('encoder_data', 'encoder_fields', 'motion_data')
+
+
+class RequestError(Exception):
+    """Сервер выполнил команду с ошибкой"""
+
+    def __init__(self, response):
+        super().__init__(response.get('message', 'Ошибка выполнения'))
+        self.response = response
+
+
+class Correlator:
+    """
+    Сопоставление ответов запросам по request_id
+
+    Каждой команде присваивается свой request_id (см. server.submit):
+    сервер сразу отвечает "accepted", результат приходит позже - тогда
+    future запроса завершается. Общая часть синхронного и asyncio-клиента.
+    """
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        # request_id -> (future, время отправки по time.monotonic)
+        self.pending = {}
+        self.accepted = 0
+
+    def register(self, future):
+        request_id = next(self.ids)
+        self.pending[request_id] = (future, time.monotonic())
+        return request_id
+
+    def resolve(self, message):
+        """
+        Ответ с request_id
+
+        :return: (future, ответ, задержка, с) или None для "accepted" и
+                 неизвестных ID
+        """
+        if message.get('status') == 'accepted':
+            self.accepted += 1
+            return None
+        entry = self.pending.pop(message.get('request_id'), None)
+        if entry is None:
+            return None
+        future, sent = entry
+        return future, message, time.monotonic() - sent
+
+    def fail_all(self):
+        """Незавершенные future (соединение закрыто)"""
+        pending, self.pending = self.pending, {}
+        return [future for future, _ in pending.values()]
+
+
+class RPIClient:
+    """
+    Синхронный клиент RPIServer для скриптов
+
+    Команды конвейеризуются: submit() отправляет и сразу возвращает future,
+    ответы приходят в любом порядке и сопоставляются по request_id. Поток
+    приема разделяет ответы и поток энкодеров (updates()).
+    """
+
+    def __init__(self, host='127.0.0.1', port=5000, stream_depth=1024):
+        """
+        :param stream_depth: сообщений энкодеров в очереди; при переполнении
+                             отбрасываются самые старые
+        """
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.correlator = Correlator()
+        self.lock = threading.Lock()
+        self.stream = queue.Queue(stream_depth)
+        self.closed = False
+        self.thread = threading.Thread(target=self.receive_loop,
+                                       name='rpiclient',
+                                       daemon=True)
+        self.thread.start()
+
+    def submit(self, cmd_type, args=None):
+        """Отправка команды без ожидания: concurrent.futures.Future ответа"""
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.closed:
+                raise ConnectionError("Соединение закрыто")
+            request_id = self.correlator.register(future)
+            self.socket.sendall(
+                pack_json({
+                    "type": cmd_type,
+                    "args": args or {},
+                    "request_id": request_id
+                }))
+        return future
+
+    def request(self, cmd_type, args=None, timeout=10.0):
+        """
+        Команда с ожиданием результата
+
+        :raises RequestError: статус ответа не success
+        """
+        response = self.submit(cmd_type, args).result(timeout)
+        if response.get('status') != 'success':
+            raise RequestError(response)
+        return response
+
+    def subscribe(self, encoding='binary', rate='frame', max_hz=10.0,
+                  motion=False, **filters):
+        """
+        Подписка на поток энкодеров
+
+        :param filters: nodes, fields, deadband (см. show_encoder)
+        """
+        return self.request('show_encoder', {
+            "encoding": encoding,
+            "rate": rate,
+            "max_hz": max_hz,
+            "motion": motion,
+            **filters
+        })
+
+    def updates(self, timeout=None):
+        """
+        Поток сообщений энкодеров: encoder_data, encoder_fields и
+        motion_data
+
+        Итерация заканчивается при закрытии соединения или по timeout без
+        сообщений.
+        """
+        while True:
+            try:
+                message = self.stream.get(timeout=timeout)
+            except queue.Empty:
+                return
+            if message is None:
+                return
+            yield message
+
+    def offer(self, message):
+        try:
+            self.stream.put_nowait(message)
+        except queue.Full:
+            # Читатель не успевает: старое состояние менее ценно нового
+            try:
+                self.stream.get_nowait()
+            except queue.Empty:
+                pass
+            self.stream.put_nowait(message)
+
+    def receive_loop(self):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = self.socket.recv(65536)
+                if not data:
+                    break
+                for msg_type, payload in decoder.feed(data):
+                    message = decode_message(msg_type, payload)
+                    if message.get('type') in STREAM_TYPES:
+                        self.offer(message)
+                        continue
+                    with self.lock:
+                        result = self.correlator.resolve(message)
+                    if result is not None:
+                        result[0].set_result(result[1])
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.closed = True
+                futures = self.correlator.fail_all()
+            for future in futures:
+                future.set_exception(ConnectionError("Соединение закрыто"))
+            self.offer(None)
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self.thread.join(1.0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AsyncRPIClient:
+    """
+    asyncio-клиент RPIServer
+
+    Тот же протокол, что у RPIClient: submit() - asyncio.Future ответа,
+    request() - ожидание результата, encoders() - асинхронный итератор
+    потока энкодеров.
+    """
+
+    def __init__(self, stream_depth=1024):
+        self.reader = None
+        self.writer = None
+        self.correlator = Correlator()
+        self.stream = collections.deque(maxlen=stream_depth)
+        self.stream_event = asyncio.Event()
+        self.closed = False
+        self.task = None
+        # Задержки запросов (отправка -> результат) для нагрузочного теста
+        self.latency = LatencyHistogram()
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=5000, stream_depth=1024):
+        client = cls(stream_depth)
+        client.reader, client.writer = await asyncio.open_connection(
+            host, port)
+        client.task = asyncio.create_task(client.receive_task())
+        return client
+
+    def submit(self, cmd_type, args=None):
+        """Отправка команды без ожидания: asyncio.Future ответа"""
+        if self.closed:
+            raise ConnectionError("Соединение закрыто")
+        future = asyncio.get_running_loop().create_future()
+        request_id = self.correlator.register(future)
+        self.writer.write(
+            pack_json({
+                "type": cmd_type,
+                "args": args or {},
+                "request_id": request_id
+            }))
+        return future
+
+    async def request(self, cmd_type, args=None, timeout=10.0):
+        """:raises RequestError: статус ответа не success"""
+        future = self.submit(cmd_type, args)
+        await self.writer.drain()
+        response = await asyncio.wait_for(future, timeout)
+        if response.get('status') != 'success':
+            raise RequestError(response)
+        return response
+
+    async def subscribe(self, encoding='binary', rate='frame', max_hz=10.0,
+                        motion=False, **filters):
+        return await self.request('show_encoder', {
+            "encoding": encoding,
+            "rate": rate,
+            "max_hz": max_hz,
+            "motion": motion,
+            **filters
+        })
+
+    async def encoders(self):
+        """
+        Асинхронный итератор потока энкодеров
+
+        async for message in client.encoders(): ... - до закрытия
+        соединения. Очередь ограничена stream_depth, старые сообщения
+        вытесняются.
+        """
+        while True:
+            while self.stream:
+                yield self.stream.popleft()
+            if self.closed:
+                return
+            self.stream_event.clear()
+            await self.stream_event.wait()
+
+    async def receive_task(self):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                for msg_type, payload in decoder.feed(data):
+                    message = decode_message(msg_type, payload)
+                    if message.get('type') in STREAM_TYPES:
+                        self.stream.append(message)
+                        self.stream_event.set()
+                        continue
+                    result = self.correlator.resolve(message)
+                    if result is None:
+                        continue
+                    future, response, elapsed = result
+                    self.latency.record(elapsed)
+                    if not future.done():
+                        future.set_result(response)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.closed = True
+            for future in self.correlator.fail_all():
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("Соединение закрыто"))
+            self.stream_event.set()
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        if self.task is not None:
+            await self.task
+
+
+async def load_test(host, port, connections, requests, pipeline, cmd_type,
+                    args):
+    """
+    Нагрузочный тест: connections соединений, в каждом до pipeline
+    команд в работе одновременно
+
+    :return: (команд/с, LatencyHistogram всех соединений, ошибок)
+    """
+    clients = [
+        await AsyncRPIClient.connect(host, port)
+        for _ in range(connections)
+    ]
+    errors = 0
+
+    async def worker(client):
+        nonlocal errors
+        in_flight = set()
+        for _ in range(requests):
+            in_flight.add(client.submit(cmd_type, args))
+            if len(in_flight) >= pipeline:
+                await client.writer.drain()
+                done, in_flight = await asyncio.wait(
+                    in_flight, return_when=asyncio.FIRST_COMPLETED)
+                errors += sum(
+                    future.exception() is not None
+                    or future.result().get('status') != 'success'
+                    for future in done)
+        await client.writer.drain()
+        if in_flight:
+            done, _ = await asyncio.wait(in_flight)
+            errors += sum(
+                future.exception() is not None
+                or future.result().get('status') != 'success'
+                for future in done)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(client) for client in clients))
+    elapsed = time.perf_counter() - start
+    histogram = LatencyHistogram()
+    for client in clients:
+        histogram.counts += client.latency.counts
+        histogram.total += client.latency.total
+        histogram.maximum = max(histogram.maximum, client.latency.maximum)
+        await client.close()
+    return connections * requests / elapsed, histogram, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Нагрузочный тест RPIServer: команды/с и задержки')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--connections', type=int, default=10)
+    parser.add_argument('--requests',
+                        type=int,
+                        default=1000,
+                        help='Команд на соединение')
+    parser.add_argument('--pipeline',
+                        type=int,
+                        default=16,
+                        help='Команд в работе на соединение')
+    parser.add_argument('--command',
+                        default='stats',
+                        help='Тип команды (по умолчанию stats)')
+    args = parser.parse_args()
+
+    rate, histogram, errors = asyncio.run(
+        load_test(args.host, args.port, args.connections, args.requests,
+                  args.pipeline, args.command, {}))
+    print(f"{args.connections} соединений x {args.requests} команд "
+          f"'{args.command}', конвейер {args.pipeline}")
+    print(f"Команд/с: {rate:.0f}, ошибок: {errors}")
+    print(f"Задержка p50 {histogram.percentile(50) * 1e3:.2f} мс, "
+          f"p99 {histogram.percentile(99) * 1e3:.2f} мс, "
+          f"max {histogram.maximum / 1e3:.2f} мс")
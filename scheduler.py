@@ -0,0 +1,306 @@
+import threading
+import time
+
+import can
+
+# Режимы последовательности сообщений задачи
+MODE_CYCLE = 'cycle'  # по кругу
+MODE_ONCE = 'once'  # один проход и остановка
+MODE_HOLD = 'hold'  # один проход, затем повтор последнего (профиль, удержание)
+MODES = (MODE_CYCLE, MODE_ONCE, MODE_HOLD)
+
+# Стандартные сообщения CANopen
+SYNC_ID = 0x080
+HEARTBEAT_BASE = 0x700
+NMT_OPERATIONAL = 0x05
+
+
+def sync_message():
+    """SYNC (COB-ID 0x80, без данных)"""
+    return can.Message(arbitration_id=SYNC_ID, data=[], is_extended_id=False)
+
+
+def heartbeat_message(node_id, state=NMT_OPERATIONAL):
+    """Heartbeat узла node_id с состоянием NMT"""
+    return can.Message(arbitration_id=HEARTBEAT_BASE + node_id,
+                       data=[state],
+                       is_extended_id=False)
+
+
+class TimedSender:
+    """
+    Периодическая отправка потоком с компенсацией дрейфа
+
+    Элемент последовательности - can.Message или список сообщений одного
+    периода (строка таблицы команд нескольких осей, trajectory.py); в
+    списке может быть и вызов без аргументов - команда с подтверждением,
+    которая отправляет сама и не ждет ответа (trajectory.StepperHandshake).
+    Сроки отправки считаются от начала задачи по time.monotonic (следующий
+    срок = предыдущий + период), поэтому задержки отдельных отправок не
+    накапливаются; при опоздании больше периода пропущенные отправки не
+    навёрстываются пачкой. Период и сообщения меняются на лету.
+    """
+
+    def __init__(self,
+                 send,
+                 messages,
+                 period,
+                 duration=None,
+                 mode=MODE_CYCLE,
+                 name='periodic'):
+        """
+        :param send: функция отправки (SharedBus.send)
+        :param messages: список can.Message (или списков can.Message)
+        :param period: период, с
+        :param duration: длительность задачи, с (None - без ограничения)
+        :param mode: режим последовательности (MODES)
+        """
+        self.send = send
+        self.messages = list(messages)
+        self.period = period
+        self.duration = duration
+        self.mode = mode
+        self.stopped = threading.Event()
+        self.overruns = 0
+        self.sent = 0
+        self.thread = threading.Thread(target=self.run,
+                                       name=f'periodic-{name}',
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if (self.thread.is_alive()
+                and self.thread is not threading.current_thread()):
+            self.thread.join(1.0)
+
+    def modify_data(self, messages):
+        """Новые сообщения с текущей позиции, без перезапуска"""
+        if isinstance(messages, can.Message):
+            messages = [messages]
+        self.messages = list(messages)
+
+    def set_period(self, period):
+        """Новый период со следующей отправки"""
+        self.period = period
+
+    def run(self):
+        start = time.monotonic()
+        due = start
+        index = 0
+        while not self.stopped.is_set():
+            messages = self.messages
+            if index >= len(messages):
+                if self.mode == MODE_ONCE:
+                    return
+                index = 0 if self.mode == MODE_CYCLE else len(messages) - 1
+            item = messages[index]
+            try:
+                for message in (item if isinstance(item, list) else
+                                (item, )):
+                    if isinstance(message, can.Message):
+                        self.send(message)
+                        self.sent += 1
+                    else:
+                        message()
+            except can.CanError as e:
+                print(f"Ошибка периодической отправки: {e}")
+            index += 1
+
+            due += self.period
+            now = time.monotonic()
+            if (self.duration is not None
+                    and due - start >= self.duration):
+                return
+            if now - due > self.period:
+                missed = int((now - due) // self.period)
+                self.overruns += missed
+                due += missed * self.period
+            self.stopped.wait(max(due - now, 0.0))
+
+
+class TransmitScheduler:
+    """
+    Периодические задачи отправки на общей шине канала
+
+    Для циклических задач используется send_periodic python-can: на
+    socketcan это менеджер рассылки ядра (BCM) - сроки выдерживает ядро,
+    а не поток Python. Профили (once/hold) и шины без менеджера рассылки
+    ядра - через TimedSender.
+    """
+
+    def __init__(self, shared_bus):
+        """
+        :param shared_bus: canbus.SharedBus
+        """
+        self.shared_bus = shared_bus
+        self.lock = threading.Lock()
+        # name -> словарь задачи (handle, messages, period, ...)
+        self.tasks = {}
+
+    def add(self,
+            name,
+            messages,
+            period,
+            duration=None,
+            mode=MODE_CYCLE,
+            kernel=True):
+        """
+        Новая задача
+
+        :param name: имя задачи (уникальное)
+        :param messages: can.Message или список (последовательность);
+                         элемент-список отправляется целиком за период
+        :param period: период между элементами, с
+        :param duration: длительность, с (None - до отмены)
+        :param mode: режим последовательности (MODES)
+        :param kernel: разрешить send_periodic python-can (BCM ядра)
+        :return: 'kernel' (BCM ядра) или 'thread' (TimedSender)
+        """
+        if isinstance(messages, can.Message):
+            messages = [messages]
+        messages = list(messages)
+        if not messages:
+            raise ValueError("Пустой список сообщений")
+        if not period > 0:
+            raise ValueError("Период должен быть больше 0")
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим: {mode}")
+        with self.lock:
+            task = self.tasks.get(name)
+            # Завершенную задачу (профиль once, истекшая duration) можно
+            # запустить заново
+            if task is not None and not self.finished(task):
+                raise ValueError(f"Задача {name} уже существует")
+            handle, backend = self.start_task(name, messages, period,
+                                              duration, mode, kernel)
+            self.tasks[name] = {
+                'handle': handle,
+                'backend': backend,
+                'messages': messages,
+                'period': period,
+                'duration': duration,
+                'mode': mode,
+                'kernel': kernel,
+                'started': time.monotonic(),
+            }
+        return backend
+
+    @staticmethod
+    def finished(task):
+        """
+        Задача завершилась сама: поток TimedSender закончил работу, задача
+        ядра (BCM) с duration - истекла
+        """
+        handle = task['handle']
+        if isinstance(handle, TimedSender):
+            return not handle.thread.is_alive()
+        return (task['duration'] is not None and
+                time.monotonic() - task['started'] >= task['duration'])
+
+    def kernel_periodic(self):
+        """Шина отправляет периодические задачи сама (BCM socketcan)"""
+        # Реализация BusABC по умолчанию - поток python-can, который
+        # отправляет мимо SharedBus (без счетчиков и блокировки)
+        return (type(self.shared_bus.bus)._send_periodic_internal
+                is not can.BusABC._send_periodic_internal)
+
+    def start_task(self, name, messages, period, duration, mode, kernel):
+        if (kernel and mode == MODE_CYCLE and self.kernel_periodic() and
+                all(isinstance(item, can.Message) for item in messages)):
+            try:
+                return self.shared_bus.bus.send_periodic(
+                    messages, period, duration, store_task=False), 'kernel'
+            except (NotImplementedError, can.CanError) as e:
+                print(f"send_periodic недоступен ({e}), поток Python")
+        handle = TimedSender(self.shared_bus.send, messages, period,
+                             duration, mode, name)
+        handle.start()
+        return handle, 'thread'
+
+    def modify(self, name, messages=None, period=None):
+        """
+        Изменение задачи без перезапуска
+
+        Данные меняются на месте (у BCM - в ядре). Новый период применяется
+        на лету в TimedSender; python-can не меняет период задачи BCM, такая
+        задача пересоздается с теми же сообщениями.
+        """
+        if isinstance(messages, can.Message):
+            messages = [messages]
+        with self.lock:
+            task = self.tasks.get(name)
+            if task is None:
+                raise KeyError(f"Нет задачи {name}")
+            handle = task['handle']
+            if period is not None and not period > 0:
+                raise ValueError("Период должен быть больше 0")
+            restart = False
+            if messages is not None:
+                messages = list(messages)
+                same_shape = (len(messages) == len(task['messages']) and all(
+                    isinstance(new, can.Message) and isinstance(
+                        old, can.Message)
+                    and new.arbitration_id == old.arbitration_id
+                    for new, old in zip(messages, task['messages'])))
+                if isinstance(handle, TimedSender) or same_shape:
+                    handle.modify_data(messages)
+                else:
+                    # BCM не меняет количество сообщений и ID на месте
+                    restart = True
+                task['messages'] = messages
+            if period is not None and period != task['period']:
+                task['period'] = period
+                if isinstance(handle, TimedSender):
+                    handle.set_period(period)
+                else:
+                    restart = True
+            if restart:
+                handle.stop()
+                task['handle'], task['backend'] = self.start_task(
+                    name, task['messages'], task['period'], task['duration'],
+                    task['mode'], task['kernel'])
+                # duration перезапущенной задачи отсчитывается заново
+                task['started'] = time.monotonic()
+            return task['backend']
+
+    def cancel(self, name):
+        with self.lock:
+            task = self.tasks.pop(name, None)
+        if task is None:
+            return False
+        task['handle'].stop()
+        return True
+
+    def cancel_all(self):
+        with self.lock:
+            tasks, self.tasks = list(self.tasks.values()), {}
+        for task in tasks:
+            task['handle'].stop()
+
+    def list(self):
+        """Описание задач для ответа сервера"""
+        now = time.monotonic()
+        with self.lock:
+            result = []
+            for name, task in self.tasks.items():
+                handle = task['handle']
+                info = {
+                    'name': name,
+                    'backend': task['backend'],
+                    'period': task['period'],
+                    'mode': task['mode'],
+                    'messages': len(task['messages']),
+                    'elapsed': now - task['started'],
+                }
+                if task['duration'] is not None:
+                    info['remaining'] = max(
+                        task['duration'] - info['elapsed'], 0.0)
+                info['done'] = self.finished(task)
+                if isinstance(handle, TimedSender):
+                    info['sent'] = handle.sent
+                    info['overruns'] = handle.overruns
+                result.append(info)
+            return result
@@ -0,0 +1,157 @@
+import collections
+import struct
+import time
+
+import can
+
+from metrics import registry
+
+# Команды expedited SDO
+SDO_UPLOAD_REQUEST = 0x40
+SDO_DOWNLOAD_RESPONSE = 0x60
+SDO_ABORT = 0x80
+# Команда expedited download по размеру данных
+SDO_DOWNLOAD_COMMANDS = {1: 0x2F, 2: 0x2B, 3: 0x27, 4: 0x23}
+
+SDO_REQUEST_BASE = 0x600
+SDO_RESPONSE_BASE = 0x580
+
+SDO_HEADER = struct.Struct('<BHB')
+
+SDO_REQUESTS = registry.counter('sdo_requests_total', 'SDO-запросы')
+SDO_TIMEOUTS = registry.counter('sdo_timeouts_total',
+                                'SDO-запросы без ответа')
+SDO_ABORTS = registry.counter('sdo_aborts_total', 'SDO-запросы с отменой')
+
+SdoResult = collections.namedtuple(
+    'SdoResult', ['node_id', 'index', 'subindex', 'success', 'value',
+                  'abort_code'])
+SdoResult.__doc__ = """Результат SDO для узла: value - прочитанное значение,
+abort_code - код отмены SDO (0x80) или None (None и при таймауте)"""
+
+
+def download_request(node_id, index, subindex, value, size=4):
+    """Кадр expedited download (запись объекта до 4 байт)"""
+    if size not in SDO_DOWNLOAD_COMMANDS:
+        raise ValueError("Размер expedited SDO: 1-4 байта")
+    data = SDO_HEADER.pack(SDO_DOWNLOAD_COMMANDS[size], index, subindex)
+    data += (value & 0xFFFFFFFF).to_bytes(4, 'little')
+    return can.Message(arbitration_id=SDO_REQUEST_BASE + node_id,
+                       data=data,
+                       is_extended_id=False)
+
+
+def upload_request(node_id, index, subindex):
+    """Кадр expedited upload (чтение объекта)"""
+    data = SDO_HEADER.pack(SDO_UPLOAD_REQUEST, index, subindex) + bytes(4)
+    return can.Message(arbitration_id=SDO_REQUEST_BASE + node_id,
+                       data=data,
+                       is_extended_id=False)
+
+
+def parse_response(node_id, index, subindex, msg):
+    """Ответ SDO -> SdoResult"""
+    if msg is None:
+        return SdoResult(node_id, index, subindex, False, None, None)
+    command = msg.data[0]
+    if command == SDO_ABORT:
+        abort_code = int.from_bytes(msg.data[4:8], 'little')
+        return SdoResult(node_id, index, subindex, False, None, abort_code)
+    if command == SDO_DOWNLOAD_RESPONSE:
+        return SdoResult(node_id, index, subindex, True, None, None)
+    if command & 0xE0 == 0x40 and command & 0x02:
+        # Expedited upload: n - число неиспользуемых байт (если задан размер)
+        size = 4 - ((command >> 2) & 0x03) if command & 0x01 else 4
+        value = int.from_bytes(msg.data[4:4 + size], 'little')
+        return SdoResult(node_id, index, subindex, True, value, None)
+    return SdoResult(node_id, index, subindex, False, None, None)
+
+
+def batch_transfer(bus, requests, timeout=0.5):
+    """
+    Параллельные SDO-запросы к нескольким узлам
+
+    Запросы к разным узлам отправляются подряд, ответы 0x580+id ожидаются
+    одновременно. Узел обслуживает одну SDO-транзакцию за раз, поэтому
+    запросы к одному узлу идут раундами: N узлов по одному объекту - один
+    круг запрос/ответ, а не N.
+
+    :param bus: canbus.SharedBus
+    :param requests: список (node_id, index, subindex, can.Message)
+    :param timeout: таймаут ответа на раунд, с
+    :return: список SdoResult в порядке requests
+    """
+    results = [None] * len(requests)
+    # Раунд k - k-й запрос каждого узла
+    rounds = []
+    seen = collections.Counter()
+    for position, request in enumerate(requests):
+        node_id = request[0]
+        round_index = seen[node_id]
+        seen[node_id] += 1
+        if round_index == len(rounds):
+            rounds.append([])
+        rounds[round_index].append(position)
+
+    for positions in rounds:
+        pending = []
+        for position in positions:
+            node_id, index, subindex, msg = requests[position]
+            reply_id = SDO_RESPONSE_BASE + node_id
+            header = bytes(msg.data[1:4])
+            future = bus.expect(reply_id,
+                                lambda reply, header=header: bytes(reply.data[
+                                    1:4]) == header)
+            pending.append((position, reply_id, future))
+            try:
+                bus.send(msg)
+            except can.CanError as e:
+                print(f"Ошибка отправки SDO для node {node_id}: {e}")
+
+        deadline = time.monotonic() + timeout
+        for position, reply_id, future in pending:
+            node_id, index, subindex, _ = requests[position]
+            try:
+                response = future.result(max(deadline - time.monotonic(), 0))
+            except Exception:
+                response = None
+            finally:
+                bus.discard(reply_id, future)
+            result = parse_response(node_id, index, subindex, response)
+            SDO_REQUESTS.inc()
+            if response is None:
+                SDO_TIMEOUTS.inc()
+            elif result.abort_code is not None:
+                SDO_ABORTS.inc()
+            results[position] = result
+    return results
+
+
+def batch_download(bus, writes, timeout=0.5):
+    """
+    Запись объектов на многих узлах
+
+    :param writes: список (node_id, index, subindex, value[, size])
+    :return: список SdoResult
+    """
+    requests = []
+    for write in writes:
+        node_id, index, subindex, value = write[:4]
+        size = write[4] if len(write) > 4 else 4
+        requests.append((node_id, index, subindex,
+                         download_request(node_id, index, subindex, value,
+                                          size)))
+    return batch_transfer(bus, requests, timeout)
+
+
+def batch_upload(bus, reads, timeout=0.5):
+    """
+    Чтение объектов с многих узлов
+
+    :param reads: список (node_id, index, subindex)
+    :return: список SdoResult
+    """
+    requests = [(node_id, index, subindex,
+                 upload_request(node_id, index, subindex))
+                for node_id, index, subindex in reads]
+    return batch_transfer(bus, requests, timeout)
@@ -1,79 +1,458 @@
 # server.py
+import argparse
+import collections
 import socket
 import json
 import threading
 import time
-from encoders import MultiEncoderMonitor
+from concurrent.futures import ThreadPoolExecutor
+import can
+from canbus import KERNEL_DROP_COUNTERS
+from channels import ChannelSet, ChannelWorker
+from latency import PipelineStats
+from metrics import registry, start_metrics_server
+from history import DECIMATE_METHODS, DECIMATE_MINMAX
+from protocol import MSG_JSON, FrameDecoder, pack_json, split_node_key
+from recorder import Recorder
+from scheduler import MODE_CYCLE, heartbeat_message, sync_message
+from pubsub import (RATE_FRAME, RATE_MODES, CoalescingQueue, Subscription,
+                    make_subscription)
 from step_motor import MoveStepMotor
+from position_control import StepperPositionController
+import trajectory
+from batch import ORDER_PARALLEL, CommandBatch
+from dc_motor import motor_message as dc_motor_message
 from dc_motor import send_motor_command as dc_send_command
+import sdo
 from enc_change_id import change_node_id as ecid_change_node_id
 
 
+def first_node_key(cmd_type, args):
+    """Ключ первого узла команды настройки энкодеров (None - не задан)"""
+    if cmd_type == 'change_id':
+        return args.get('current_id')
+    if cmd_type == 'reset_position':
+        if 'node_ids' in args:
+            return args['node_ids'][0]
+        return args.get('node_id')
+    items = args.get('items')
+    return items[0]['node_id'] if items else None
+
+
+def command_lane(command, channels):
+    """
+    Очередь команды с request_id: команды одной очереди выполняются по
+    порядку, разных - параллельно
+
+    Шаговые двигатели отвечают с общим ID 0x101 - их команды в одной
+    очереди; настройка энкодеров (смена ID, сброс, SDO) - в другой.
+    Очереди свои у каждого канала; канал определяется так же, как при
+    выполнении: по ключу узла (ChannelSet.locate) или "channel" в
+    аргументах. Команда с узлами нескольких каналов - в очереди канала
+    первого узла.
+
+    :param channels: ChannelSet сервера
+    """
+    cmd_type = command.get('type')
+    args = command.get('args', {})
+    try:
+        if cmd_type in ('step_motor', 'batch'):
+            return ('stepper', channels.select(args).channel)
+        if cmd_type == 'step_position':
+            worker, _ = channels.locate(args['node_id'], args)
+            return ('stepper', worker.channel)
+        if cmd_type in ('change_id', 'reset_position', 'sdo_write',
+                        'sdo_read'):
+            key = first_node_key(cmd_type, args)
+            worker = (channels.select(args)
+                      if key is None else channels.locate(key, args)[0])
+            return ('encoders', worker.channel)
+    except (KeyError, IndexError, TypeError, ValueError):
+        # Неверный адрес: ошибку вернет сама команда
+        return None
+    return None
+
+
+def filter_nodes(states, nodes):
+    """Состояния только узлов подписки (nodes=None - все)"""
+    if nodes is None:
+        return states
+    return {
+        node_id: state
+        for node_id, state in states.items() if node_id in nodes
+    }
+
+
+class ClientSession:
+    """Подключенный клиент: свой поток отправки и ограниченные очереди"""
+
+    # Максимум неотправленных ответов на команды до отключения клиента
+    MAX_REPLIES = 256
+
+    def __init__(self, client_socket, encode, stats=None):
+        """
+        :param client_socket: сокет клиента
+        :param encode: функция (data, subscription) -> кадры данных
+                       энкодеров
+        :param stats: latency.PipelineStats для этапов сериализации и отправки
+        """
+        self.socket = client_socket
+        self.encode = encode
+        self.stats = stats
+        try:
+            self.name = '%s:%d' % client_socket.getpeername()[:2]
+        except OSError:
+            self.name = '?'
+        self.subscription = Subscription()
+        self.subscribed = False
+        self.closed = False
+        self.replies = []
+        self.cond = threading.Condition()
+        self.updates = CoalescingQueue(notify=self.wakeup)
+        self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+
+    def wakeup(self):
+        with self.cond:
+            self.cond.notify()
+
+    def offer(self, node_id, state):
+        """Новое состояние энкодера; никогда не блокирует поток приема"""
+        if self.subscribed:
+            nodes = self.subscription.nodes
+            if nodes is None or node_id in nodes:
+                self.updates.put(node_id, state)
+
+    def subscribe(self, subscription, rate, max_hz, snapshot):
+        """
+        :param subscription: pubsub.Subscription (формат, поля, узлы,
+                             deadband)
+        """
+        self.updates.configure(rate, max_hz, subscription.deadband)
+        self.subscription = subscription
+        self.subscribed = True
+        # Новый подписчик сразу получает текущее состояние своих узлов
+        self.updates.put_many(filter_nodes(snapshot, subscription.nodes))
+
+    def unsubscribe(self):
+        self.subscribed = False
+        self.updates.clear()
+
+    def reply(self, response):
+        with self.cond:
+            if len(self.replies) >= self.MAX_REPLIES:
+                print("Клиент не читает ответы, отключение")
+                if self.stats is not None:
+                    self.stats.count('slow_clients')
+                self.closed = True
+            else:
+                self.replies.append(pack_json(response))
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def writer_loop(self):
+        """Поток отправки: ответы и объединенные обновления энкодеров"""
+        try:
+            while True:
+                with self.cond:
+                    while True:
+                        if self.closed:
+                            return
+                        delay = self.updates.delay()
+                        if self.replies or delay == 0:
+                            break
+                        self.cond.wait(delay)
+                    frames, self.replies = self.replies, []
+                batch = self.updates.take()
+                if batch:
+                    started = time.monotonic()
+                    frames.append(self.encode(batch, self.subscription))
+                    if self.stats is not None:
+                        self.stats.serialized(batch, started)
+                if frames:
+                    started = time.monotonic()
+                    self.socket.sendall(b''.join(frames))
+                    if batch and self.stats is not None:
+                        self.stats.sent(batch, started)
+        except OSError as e:
+            print(f"Ошибка отправки клиенту: {e}")
+        finally:
+            self.closed = True
+            try:
+                # Разблокирует recv в handle_client
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
 class RPIServer:
 
-    def __init__(self, host='0.0.0.0', port=5000):
+    def __init__(self,
+                 host='0.0.0.0',
+                 port=5000,
+                 record_path=None,
+                 channel='can0',
+                 interface='socketcan',
+                 history_depth=10000,
+                 metrics_port=None):
+        """
+        :param record_path: файл записи CAN-трафика и состояний энкодеров
+                            (основного канала)
+        :param channel: CAN-интерфейс энкодеров и двигателей или список
+                        интерфейсов (первый - основной); у каждого канала
+                        свой поток приема
+        :param interface: тип интерфейса python-can ('virtual' - без железа)
+        :param history_depth: точек истории на энкодер (0 - без истории)
+        :param metrics_port: порт HTTP-метрик Prometheus (None - выключены)
+        """
         self.host = host
         self.port = port
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind((self.host, self.port))
-        self.encoder_monitor = MultiEncoderMonitor(channel='can0',
-                                                   node_ids=[3, 4])
-        self.clients = []
-        self.monitoring = False
+        self.record_path = record_path
+        self.recorder = None
+        self.server = None
+        # Задержки по этапам для команды stats (общие для всех каналов)
+        self.stats = PipelineStats()
+        names = [channel] if isinstance(channel, str) else list(channel)
+        self.channels = ChannelSet(
+            ChannelWorker(index,
+                          name,
+                          interface,
+                          node_ids=[3, 4] if index == 0 else None,
+                          history_depth=history_depth,
+                          stats=self.stats)
+            for index, name in enumerate(names))
+        # Основной канал: запись трафика
+        self.encoder_monitor = self.channels[0].monitor
+        # Кортеж заменяется целиком под self.lock, читается без блокировки
+        self.sessions = ()
         self.lock = threading.Lock()
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        # Команды с request_id: пул потоков и очереди по command_lane
+        self.executor = ThreadPoolExecutor(max_workers=8,
+                                           thread_name_prefix='command')
+        self.lanes = {}
+        self.lanes_lock = threading.Lock()
 
     def start(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind((self.host, self.port))
         self.server.listen(5)
         print(f"Сервер запущен на {self.host}:{self.port}")
-        threading.Thread(target=self.monitoring_loop, daemon=True).start()
+        self.start_recorder()
+        self.start_metrics()
+        self.start_channels()
 
         while True:
             client_socket, addr = self.server.accept()
             print(f"Подключение от {addr}")
-            with self.lock:
-                self.clients.append(client_socket)
+            session = ClientSession(client_socket, self.encode_encoder_data,
+                                    self.stats)
+            self.add_session(session)
+            session.thread.start()
             threading.Thread(target=self.handle_client,
-                             args=(client_socket, )).start()
+                             args=(session, ),
+                             daemon=True).start()
 
-    def monitoring_loop(self):
-        """Поток для мониторинга и рассылки данных"""
-        while True:
-            if self.monitoring and self.clients:
-                data = self.encoder_monitor.get_current_data()
-                message = {"type": "encoder_data", "data": data}
-                with self.lock:
-                    for client in self.clients.copy():
-                        try:
-                            client.send(json.dumps(message).encode('utf-8'))
-                        except:
-                            self.clients.remove(client)
-            time.sleep(0.1)
-
-    def handle_client(self, client_socket):
+    def start_channels(self):
+        """Прием всех каналов; обновления рассылаются по мере приема"""
+        for worker in self.channels:
+            worker.add_listener(self.publish)
+            worker.start()
+
+    def stop_channels(self):
+        for worker in self.channels:
+            worker.stop()
+
+    def start_recorder(self):
+        """Запись трафика, если задан record_path"""
+        if self.record_path is None:
+            return
+        self.recorder = Recorder(self.record_path)
+        self.recorder.start()
+        self.recorder.attach(self.encoder_monitor.bus, self.encoder_monitor)
+        print(f"Запись CAN-трафика в {self.record_path}")
+
+    def start_metrics(self):
+        """HTTP-метрики, если задан metrics_port"""
+        if self.metrics_port is None:
+            return
+        registry.gauge('rpi_clients', 'Подключенные клиенты',
+                       lambda: len(self.sessions))
+        registry.gauge(
+            'rpi_client_queue_depth',
+            'Неотправленные обновления и ответы клиента', lambda: {
+                session.name:
+                len(session.updates.pending) + len(session.replies)
+                for session in self.sessions
+            }, 'client')
+        registry.gauge(
+            'rpi_client_coalesced_total',
+            'Обновления, замененные более новыми до отправки',
+            lambda: self.stats.counters.get('coalesced', 0) + sum(
+                session.updates.coalesced for session in self.sessions),
+            kind='counter')
+        registry.gauge(
+            'rpi_pipeline_latency_seconds',
+            'Задержки этапов CAN -> клиент (serialize + send - рассылка)',
+            self.latency_quantiles, ('stage', 'quantile'))
+        registry.gauge('rpi_recorder_dropped_total',
+                       'Записи, отброшенные при переполнении очереди',
+                       lambda: self.recorder.dropped if self.recorder else 0,
+                       kind='counter')
+        self.metrics_server = start_metrics_server(self.host,
+                                                   self.metrics_port)
+
+    def latency_quantiles(self):
+        quantiles = {}
+        for stage, values in self.stats.snapshot().items():
+            quantiles[stage, '0.5'] = round(values['p50_ms'] / 1e3, 6)
+            quantiles[stage, '0.99'] = round(values['p99_ms'] / 1e3, 6)
+            quantiles[stage, '1'] = round(values['max_ms'] / 1e3, 6)
+        return quantiles
+
+    def add_session(self, session):
+        with self.lock:
+            self.sessions = self.sessions + (session, )
+
+    def remove_session(self, session):
+        with self.lock:
+            self.sessions = tuple(s for s in self.sessions
+                                  if s is not session)
+        self.stats.count('coalesced', session.updates.coalesced)
+
+    def publish(self, node_id, state):
+        """
+        Обновление энкодера из потока приема канала -> очереди клиентов
+
+        :param node_id: ключ узла (protocol.node_key)
+        """
+        for session in self.sessions:
+            session.offer(node_id, state)
+
+    def encode_encoder_data(self, data, subscription):
+        """
+        Кадры с данными энкодеров по подписке клиента
+
+        :param data: {ключ узла: состояние}; узлы разных каналов - в
+                     отдельных кадрах (у каналов свой градусов на шаг)
+        :param subscription: pubsub.Subscription; при motion - с кадром
+                             скорости и ускорения узлов
+        """
+        if len(self.channels) == 1:
+            return self.channels[0].frames.encode(data, subscription)
+        groups = {}
+        for key, state in data.items():
+            index, node_id = split_node_key(key)
+            groups.setdefault(index, {})[node_id] = state
+        return b''.join(self.channels[index].frames.encode(
+            states, subscription) for index, states in groups.items())
+
+    def handle_client(self, session):
+        decoder = FrameDecoder()
         try:
-            while True:
-                data = client_socket.recv(1024).decode('utf-8')
+            while not session.closed:
+                data = session.socket.recv(4096)
                 if not data:
                     break
-                response = self.process_command(json.loads(data))
-                client_socket.send(json.dumps(response).encode('utf-8'))
+                for msg_type, payload in decoder.feed(data):
+                    if msg_type != MSG_JSON:
+                        continue
+                    command = json.loads(payload.decode('utf-8'))
+                    if 'request_id' in command:
+                        self.submit(command, session, session.reply)
+                    else:
+                        session.reply(self.process_command(command, session))
         except Exception as e:
             print(f"Client error: {e}")
         finally:
-            with self.lock:
-                if client_socket in self.clients:
-                    self.clients.remove(client_socket)
-            client_socket.close()
+            self.remove_session(session)
+            session.close()
+            session.thread.join(1.0)
+            session.socket.close()
+
+    def submit(self, command, session, deliver):
+        """
+        Команда с request_id: ответ "accepted" сразу, результат - позже
 
-    def process_command(self, command: dict) -> dict:
+        Поток чтения клиента не ждет двигатели и SDO: у клиента может быть
+        много команд в работе. Результат - ответ process_command с тем же
+        request_id.
+
+        :param deliver: отправка ответа клиенту (потокобезопасная)
+        """
+        request_id = command['request_id']
+        deliver({
+            "status": "accepted",
+            "request_id": request_id,
+            "message": "Команда принята"
+        })
+        job = (command, session, deliver)
+        lane = command_lane(command, self.channels)
+        if lane is not None:
+            with self.lanes_lock:
+                queue = self.lanes.get(lane)
+                if queue is not None:
+                    queue.append(job)
+                    return
+                self.lanes[lane] = collections.deque()
+        self.executor.submit(self.run_lane, lane, job)
+
+    def run_lane(self, lane, job):
+        """Выполнение команды и следующих из ее очереди"""
+        while True:
+            command, session, deliver = job
+            response = self.process_command(command, session)
+            response['request_id'] = command['request_id']
+            try:
+                if not session.closed:
+                    deliver(response)
+            except Exception as e:
+                print(f"Ошибка отправки результата команды: {e}")
+            if lane is None:
+                return
+            with self.lanes_lock:
+                queue = self.lanes[lane]
+                if not queue:
+                    del self.lanes[lane]
+                    return
+                job = queue.popleft()
+
+    def process_command(self, command: dict, session=None) -> dict:
         try:
             cmd_type = command.get('type')
             args = command.get('args', {})
 
             if cmd_type == 'show_encoder':
-                self.monitoring = True
+                # Подписка: encoding, rate/max_hz, motion и фильтры - nodes
+                # (список узлов), fields (поля protocol.FIELDS), deadband (°)
+                rate = args.get('rate', RATE_FRAME)
+                max_hz = args.get('max_hz', 10.0)
+                try:
+                    subscription = make_subscription(args)
+                except ValueError as e:
+                    return {"status": "error", "message": str(e)}
+                if rate not in RATE_MODES:
+                    return {
+                        "status": "error",
+                        "message": f"Неизвестный режим: {rate}"
+                    }
+                if subscription.motion:
+                    for worker in self.channels:
+                        worker.enable_motion()
+                if session is not None:
+                    session.subscribe(subscription, rate, max_hz,
+                                      self.channels.current_data())
                 return {"status": "success", "message": "Мониторинг запущен"}
 
+            elif cmd_type == 'stop_monitoring':
+                if session is not None:
+                    session.unsubscribe()
+                return {"status": "success", "message": "Мониторинг остановлен"}
+
             elif cmd_type == 'change_id':
                 current_id = args.get('current_id')
                 new_id = args.get('new_id')
@@ -82,37 +461,110 @@ class RPIServer:
                         "status": "error",
                         "message": "Недопустимый новый ID"
                     }
-                self.encoder_monitor.change_id_process(current_id, new_id)
-                ecid_change_node_id(current_id, new_id)
+                worker, node_id = self.channels.locate(current_id, args)
+                worker.monitor.change_id_process(node_id, new_id)
+                worker.frames.forget(node_id)
+                ecid_change_node_id(node_id, new_id, worker.channel)
                 return {
                     "status": "success",
                     "message": f"ID изменен с {current_id} на {new_id}"
                 }
 
             elif cmd_type == 'reset_position':
+                if 'node_ids' in args:
+                    # Сброс группы энкодеров за один круг SDO на канал
+                    results = {}
+                    for worker, node_ids in self.channels.group(
+                            args['node_ids'], args).items():
+                        for node_id, success in worker.monitor.reset_positions(
+                                node_ids).items():
+                            results[worker.key(node_id)] = success
+                    return {
+                        "status":
+                        "success" if all(results.values()) else "error",
+                        "message": "Сброс позиций выполнен",
+                        "results": results
+                    }
                 node_id = args.get('node_id')
-                success = self.encoder_monitor.reset_encoder_position(node_id)
+                worker, local_id = self.channels.locate(node_id, args)
+                success = worker.monitor.reset_encoder_position(local_id)
                 return {
                     "status": "success" if success else "error",
                     "message": f"Позиция энкодера {node_id} обнулена"
                 }
 
+            elif cmd_type in ('sdo_write', 'sdo_read'):
+                return self.run_sdo(cmd_type, args)
+
+            elif cmd_type == 'get_history':
+                return self.get_history(args)
+
+            elif cmd_type == 'stats':
+                return self.get_stats(args.get('reset', False))
+
             elif cmd_type == 'step_motor':
                 power = args.get('power')
                 direction = args.get('direction')
                 steps = args.get('steps')
-                with MoveStepMotor(channel='can0', node_id=0x101) as motor:
+                with MoveStepMotor(channel=self.channels.select(args).channel,
+                                   node_id=0x101) as motor:
                     result = motor.send_motor_command(power, direction, steps)
                 return {
                     "status": "success" if result else "error",
                     "message": "Команда шагового двигателя выполнена"
                 }
 
+            elif cmd_type == 'step_position':
+                # Позиционирование по энкодеру: target - абсолютный угол
+                # (или смещение при "relative": true); двигатель - на канале
+                # энкодера
+                worker, node_id = self.channels.locate(args['node_id'], args)
+                # Остановку вала контроллер определяет по оценке скорости
+                worker.enable_motion()
+                with MoveStepMotor(channel=worker.channel,
+                                   node_id=args.get('motor_node',
+                                                    0x101)) as motor:
+                    controller = StepperPositionController(
+                        worker.monitor,
+                        motor,
+                        node_id,
+                        direction_sign=args.get('direction_sign', 1),
+                        tolerance=args.get('tolerance', 0.5))
+                    if args.get('relative', False):
+                        result = controller.move_by(args['target'],
+                                                    args.get('timeout', 10.0))
+                    else:
+                        result = controller.move_to(args['target'],
+                                                    args.get('timeout', 10.0))
+                return {
+                    "status": "success" if result['success'] else "error",
+                    "message": f"Позиция {result['angle']:.2f}° "
+                    f"(ошибка {result['error']:+.2f}°)",
+                    "result": result
+                }
+
+            elif cmd_type == 'batch':
+                return self.run_batch(args, session)
+
+            elif cmd_type == 'trajectory':
+                return self.run_trajectory(args)
+
+            elif cmd_type == 'periodic':
+                return self.periodic(args)
+
+            elif cmd_type == 'channels':
+                return {
+                    "status": "success",
+                    "message": f"Каналов: {len(self.channels)}",
+                    "channels": [worker.describe() for worker in self.channels]
+                }
+
             elif cmd_type == 'dc_motor':
                 motor_id = args.get('motor_id')
                 power_state = args.get('power_state')
                 direction = args.get('direction')
-                dc_send_command('can0', motor_id, power_state, direction)
+                dc_send_command(self.channels.select(args).channel, motor_id,
+                                power_state, direction)
                 return {
                     "status": "success",
                     "message": "Команда DC двигателя отправлена"
@@ -127,7 +579,321 @@ class RPIServer:
                 "message": f"Ошибка выполнения: {str(e)}"
             }
 
+    def get_history(self, args):
+        """
+        История абсолютного угла за интервал
+
+        args: node_id или node_ids (ключи узлов; по умолчанию все узлы
+        канала "channel" или всех каналов), start/end (метки времени) или
+        seconds (последние N секунд), points (прореживание до числа точек),
+        method ('minmax' или 'stride')
+        """
+        if self.encoder_monitor.history is None:
+            return {"status": "error", "message": "История отключена"}
+        method = args.get('method', DECIMATE_MINMAX)
+        if method not in DECIMATE_METHODS:
+            return {
+                "status": "error",
+                "message": f"Неизвестный способ прореживания: {method}"
+            }
+        if 'node_ids' in args:
+            groups = self.channels.group(args['node_ids'], args)
+        elif 'node_id' in args:
+            groups = self.channels.group([args['node_id']], args)
+        elif 'channel' in args:
+            worker = self.channels.select(args)
+            groups = {worker: worker.monitor.node_ids}
+        else:
+            groups = {
+                worker: worker.monitor.node_ids
+                for worker in self.channels
+            }
+        start = args.get('start')
+        end = args.get('end')
+        if args.get('seconds') is not None:
+            start = time.time() - args['seconds']
+        data = {}
+        for worker, node_ids in groups.items():
+            for node_id in node_ids:
+                timestamps, angles = worker.monitor.history.window(
+                    node_id, start, end, args.get('points'), method)
+                data[worker.key(node_id)] = {
+                    "timestamps": timestamps.tolist(),
+                    "angles": angles.tolist()
+                }
+        return {"status": "success", "type": "history", "data": data}
+
+    def run_sdo(self, cmd_type, args):
+        """
+        Параллельный SDO к нескольким узлам
+
+        args: items - [{node_id, index, subindex[, value, size]}] (node_id -
+        ключ узла), timeout. Запросы каждого канала - за один круг по его
+        шине; результаты - в порядке items.
+        """
+        items = args.get('items', [])
+        groups = {}
+        for position, item in enumerate(items):
+            worker, node_id = self.channels.locate(item['node_id'], args)
+            groups.setdefault(worker, []).append((position, node_id, item))
+        results = [None] * len(items)
+        for worker, group in groups.items():
+            if cmd_type == 'sdo_write':
+                done = sdo.batch_download(
+                    worker.monitor.bus,
+                    [(node_id, item['index'], item.get('subindex', 0),
+                      item['value'], item.get('size', 4))
+                     for _, node_id, item in group],
+                    timeout=args.get('timeout', 0.5))
+            else:
+                done = sdo.batch_upload(
+                    worker.monitor.bus,
+                    [(node_id, item['index'], item.get('subindex', 0))
+                     for _, node_id, item in group],
+                    timeout=args.get('timeout', 0.5))
+            for (position, _, _), result in zip(group, done):
+                results[position] = result._replace(
+                    node_id=worker.key(result.node_id))
+        return {
+            "status":
+            "success" if all(r.success for r in results) else "error",
+            "message": f"SDO выполнен для {len(results)} объектов",
+            "results": [r._asdict() for r in results]
+        }
+
+    def periodic_messages(self, args):
+        """
+        Сообщения периодической задачи из аргументов команды
+
+        preset: 'sync', 'heartbeat' (node_id[, state]), 'dc_motor'
+        (motor_id, power_state, direction) или messages:
+        [{arbitration_id, data}] (последовательность, например профиль)
+        """
+        preset = args.get('preset')
+        if preset == 'sync':
+            return [sync_message()]
+        if preset == 'heartbeat':
+            return [heartbeat_message(args['node_id'], args.get('state', 5))]
+        if preset == 'dc_motor':
+            return [
+                dc_motor_message(args['motor_id'], args['power_state'],
+                                 args['direction'])
+            ]
+        if preset is not None:
+            raise ValueError(f"Неизвестный шаблон: {preset}")
+        items = args.get('messages')
+        if items is None:
+            items = [{
+                'arbitration_id': args['arbitration_id'],
+                'data': args.get('data', [])
+            }]
+        return [
+            can.Message(arbitration_id=item['arbitration_id'],
+                        data=item.get('data', []),
+                        is_extended_id=item['arbitration_id'] > 0x7FF)
+            for item in items
+        ]
+
+    def periodic(self, args):
+        """
+        Периодические задачи отправки
+
+        args: action ('add', 'modify', 'cancel', 'list'), name, period (с),
+        duration (с), mode ('cycle', 'once', 'hold'), channel и сообщения
+        (см. periodic_messages); modify меняет данные и/или период без
+        остановки задачи
+        """
+        scheduler = self.channels.select(args).scheduler
+        action = args.get('action', 'list')
+        name = args.get('name')
+        if action == 'add':
+            backend = scheduler.add(name, self.periodic_messages(args),
+                                    args['period'],
+                                    args.get('duration'),
+                                    args.get('mode', MODE_CYCLE))
+            message = f"Задача {name} запущена ({backend})"
+        elif action == 'modify':
+            has_messages = ('preset' in args or 'messages' in args
+                            or 'arbitration_id' in args)
+            backend = scheduler.modify(
+                name,
+                self.periodic_messages(args) if has_messages else None,
+                args.get('period'))
+            message = f"Задача {name} изменена ({backend})"
+        elif action == 'cancel':
+            if not scheduler.cancel(name):
+                return {"status": "error", "message": f"Нет задачи {name}"}
+            message = f"Задача {name} остановлена"
+        elif action == 'list':
+            message = "Периодические задачи"
+        else:
+            return {
+                "status": "error",
+                "message": f"Неизвестное действие: {action}"
+            }
+        return {
+            "status": "success",
+            "message": message,
+            "tasks": scheduler.list()
+        }
+
+    def run_batch(self, args, session=None):
+        """
+        Пакет команд за один запрос
+
+        args: commands - [{type, args}], order ('parallel' - разные узлы
+        одновременно, 'sequential' - строго по списку), validate (проверить
+        все до отправки), stop_on_error, timeout (ожидание подтверждений
+        шаговых, с), channel. Ответ - вектор результатов в порядке команд.
+        """
+        commands = args.get('commands', [])
+        channel = self.channels.select(args).channel
+
+        def process(command):
+            # Прочие команды пакета - на канале пакета, если не указан свой
+            command = dict(command,
+                           args={
+                               'channel': channel,
+                               **command.get('args', {})
+                           })
+            return self.process_command(command, session)
+
+        batch = CommandBatch(channel, process, args.get('timeout', 1.0))
+        results = batch.run(commands, args.get('order', ORDER_PARALLEL),
+                            args.get('validate', False),
+                            args.get('stop_on_error', False))
+        done = sum(item.get('status') == 'success' for item in results)
+        return {
+            "status": "success" if done == len(results) else "error",
+            "message": f"Пакет: выполнено {done} из {len(results)}",
+            "results": results
+        }
+
+    def run_trajectory(self, args):
+        """
+        Движение осей по профилю одной задачей планировщика
+
+        args: axes - [{"stepper": node_id, "distance": градусы[,
+        "steps_per_rev", "direction_sign"]} или {"dc_motor": motor_id,
+        "distance": ...[, "full_speed"]}], profile ('trapezoid', 's_curve'),
+        max_velocity, max_acceleration, max_jerk (у оси - свои при
+        необходимости), period (с), sync ('start', 'tick', 'none'), name,
+        channel. Ответ - сразу после запуска, ход - в periodic list.
+        """
+        worker = self.channels.select(args)
+        period = args.get('period', 0.01)
+        tables = []
+        duration = 0.0
+        for axis in args['axes']:
+            limits = {**args, **axis}
+            profile = trajectory.make_profile(limits.get('profile',
+                                                         'trapezoid'),
+                                              axis['distance'],
+                                              limits['max_velocity'],
+                                              limits['max_acceleration'],
+                                              limits.get('max_jerk'))
+            duration = max(duration, profile.duration)
+            if 'stepper' in axis:
+                motor = MoveStepMotor(channel=worker.channel,
+                                      node_id=axis['stepper'])
+                tables.append(
+                    trajectory.stepper_table(
+                        motor, profile, period,
+                        axis.get('steps_per_rev', 1024),
+                        axis.get('direction_sign', 1)))
+            else:
+                tables.append(
+                    trajectory.dc_table(axis['dc_motor'], profile, period,
+                                        axis.get('full_speed')))
+        name = args.get('name', 'trajectory')
+        seconds = trajectory.stream(worker.scheduler, name, tables, period,
+                                    args.get('sync', trajectory.SYNC_START))
+        return {
+            "status": "success",
+            "message": f"Траектория {name} запущена: {duration:.3f} с",
+            "duration": duration,
+            "stream_seconds": seconds
+        }
+
+    def get_stats(self, reset=False):
+        """
+        Задержки по этапам (p50/p99/max, мс) и счетчики кадров и потерь
+
+        :param reset: обнулить гистограммы и счетчики после чтения
+        """
+        sessions = self.sessions
+        counters = dict(self.stats.counters)
+        counters['coalesced'] = counters.get('coalesced', 0) + sum(
+            session.updates.coalesced for session in sessions)
+        channels = {}
+        for worker in self.channels:
+            monitor = worker.monitor
+            channels[worker.channel] = {
+                'frames_received': monitor.frames_received,
+                'short_frames': monitor.short_frames,
+                'bus_frames_received': monitor.bus.frames_received,
+                'bus_frames_sent': monitor.bus.frames_sent,
+                **monitor.bus.kernel_drops(),
+            }
+        counters['clients'] = len(sessions)
+        # Итоги по всем каналам; по каналам - в "channels"
+        for name in ('frames_received', 'short_frames',
+                     'bus_frames_received', 'bus_frames_sent',
+                     *KERNEL_DROP_COUNTERS):
+            counters[name] = sum(item[name] for item in channels.values())
+        if self.recorder is not None:
+            counters['recorder_written'] = self.recorder.written
+            counters['recorder_dropped'] = self.recorder.dropped
+        response = {
+            "status": "success",
+            "type": "stats",
+            "stages": self.stats.snapshot(),
+            "counters": counters,
+            "channels": channels
+        }
+        if reset:
+            self.stats.reset()
+            for session in sessions:
+                session.updates.coalesced = 0
+        return response
+
 
 if __name__ == "__main__":
-    server = RPIServer()
-    server.start()
+    parser = argparse.ArgumentParser(description='Сервер управления моторами')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--asyncio',
+                        action='store_true',
+                        help='Однопоточный asyncio-сервер вместо потоков')
+    parser.add_argument('--record',
+                        metavar='PATH',
+                        help='Запись CAN-трафика в бинарный файл')
+    parser.add_argument('--metrics-port',
+                        type=int,
+                        help='Порт HTTP-метрик Prometheus (GET /metrics)')
+    parser.add_argument('--channel',
+                        action='append',
+                        help='CAN-интерфейс (можно несколько: --channel can0 '
+                        '--channel can1; первый - основной)')
+    parser.add_argument('--history-depth',
+                        type=int,
+                        default=10000,
+                        help='Точек истории на энкодер (0 - без истории)')
+    args = parser.parse_args()
+
+    if args.asyncio:
+        from aioserver import AsyncRPIServer
+        AsyncRPIServer(args.host,
+                       args.port,
+                       record_path=args.record,
+                       channel=args.channel or 'can0',
+                       history_depth=args.history_depth,
+                       metrics_port=args.metrics_port).run()
+    else:
+        server = RPIServer(args.host,
+                           args.port,
+                           record_path=args.record,
+                           channel=args.channel or 'can0',
+                           history_depth=args.history_depth,
+                           metrics_port=args.metrics_port)
+        server.start()
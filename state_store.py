@@ -0,0 +1,305 @@
+import threading
+import time
+
+import numpy as np
+
+# Порог определения направления, градусы (как в calculate_delta)
+DIRECTION_THRESHOLD = 5.0
+
+
+class EncoderStateStore:
+    """
+    Состояния энкодеров в предвыделенных массивах NumPy
+
+    Каждому node_id выделяется слот; поля хранятся колонками: нормализованный
+    угол, полные обороты, абсолютный угол, начальный абсолютный угол (база
+    дельты), время последнего движения и последнее направление. Доступ по
+    ключу (store[node_id]) возвращает кортеж в прежнем формате
+    encoder_states.
+    """
+
+    def __init__(self, capacity=128):
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.count = 0
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        """Выделение (или расширение) массивов под capacity слотов"""
+        old = getattr(self, 'node_ids', None)
+        columns = {
+            'node_ids': np.int32,
+            'valid': np.bool_,
+            'normalized': np.float64,
+            'turns': np.int64,
+            'absolute': np.float64,
+            'initial': np.float64,
+            'timestamp': np.float64,
+            'direction': np.int8,
+        }
+        for name, dtype in columns.items():
+            array = np.zeros(capacity, dtype)
+            if old is not None:
+                array[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, array)
+
+    def slot(self, node_id):
+        """Слот узла (новый узел получает следующий свободный слот)"""
+        slot = self.slots.get(node_id)
+        if slot is None:
+            if self.count == len(self.node_ids):
+                self.allocate(len(self.node_ids) * 2)
+            slot = self.count
+            self.count += 1
+            self.node_ids[slot] = node_id
+            self.slots[node_id] = slot
+        return slot
+
+    def __contains__(self, node_id):
+        slot = self.slots.get(node_id)
+        return slot is not None and bool(self.valid[slot])
+
+    def __len__(self):
+        return int(np.count_nonzero(self.valid[:self.count]))
+
+    def __getitem__(self, node_id):
+        state = self.get(node_id)
+        if state is None:
+            raise KeyError(node_id)
+        return state
+
+    def __setitem__(self, node_id, state):
+        self.set(node_id, state)
+
+    def __delitem__(self, node_id):
+        if node_id not in self:
+            raise KeyError(node_id)
+        self.remove(node_id)
+
+    def keys(self):
+        # Под блокировкой: поток приема может добавить новый узел в slots
+        with self.lock:
+            return [node_id for node_id, slot in self.slots.items()
+                    if self.valid[slot]]
+
+    def get(self, node_id):
+        """Состояние узла кортежем (как encoder_states) или None"""
+        slot = self.slots.get(node_id)
+        if slot is None or not self.valid[slot]:
+            return None
+        with self.lock:
+            return self.row(slot)
+
+    def row(self, slot):
+        return (float(self.normalized[slot]), int(self.turns[slot]),
+                float(self.absolute[slot]), float(self.initial[slot]),
+                float(self.timestamp[slot]), int(self.direction[slot]))
+
+    def set(self, node_id, state):
+        """Запись состояния целиком (сброс позиции, таймаут дельты)"""
+        with self.lock:
+            slot = self.slot(node_id)
+            (self.normalized[slot], self.turns[slot], self.absolute[slot],
+             self.initial[slot], self.timestamp[slot],
+             self.direction[slot]) = state
+            self.valid[slot] = True
+
+    def remove(self, node_id):
+        slot = self.slots.get(node_id)
+        if slot is not None:
+            with self.lock:
+                self.valid[slot] = False
+
+    def as_dict(self):
+        """Копия всех состояний {node_id: кортеж}"""
+        with self.lock:
+            return {
+                int(self.node_ids[slot]): self.row(slot)
+                for slot in np.flatnonzero(self.valid[:self.count])
+            }
+
+    def snapshot(self):
+        """
+        Представления (views) массивов без копирования
+
+        Значения меняются на месте потоком приема; для согласованного
+        снимка вызывающий делает copy() нужных колонок.
+        """
+        n = self.count
+        return {
+            'node_ids': self.node_ids[:n],
+            'valid': self.valid[:n],
+            'normalized': self.normalized[:n],
+            'turns': self.turns[:n],
+            'absolute': self.absolute[:n],
+            'initial': self.initial[:n],
+            'timestamp': self.timestamp[:n],
+            'direction': self.direction[:n],
+        }
+
+    def update(self, node_id, current_normalized, timestamp=None):
+        """
+        Новый угол одного узла: обороты, абсолютный угол, база дельты
+
+        :return: дельта угла (0.0 для первого кадра и смены направления)
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            slot = self.slot(node_id)
+            if not self.valid[slot]:
+                self.init_slot(slot, current_normalized, timestamp)
+                return 0.0
+
+            prev_norm = float(self.normalized[slot])
+            full_circles = int(self.turns[slot])
+            last_dir = int(self.direction[slot])
+            delta = current_normalized - prev_norm
+
+            # Коррекция циклического перехода и обороты при переходе через
+            # 0/360 (независимо от порога направления: медленное вращение
+            # тоже переходит через 0)
+            if delta > 180:
+                delta -= 360
+                full_circles -= 1
+            elif delta < -180:
+                delta += 360
+                full_circles += 1
+
+            direction = 0
+            if delta != 0 and abs(delta) > DIRECTION_THRESHOLD:
+                direction = 1 if delta > 0 else -1
+
+            direction_changed = (direction != 0 and direction != last_dir)
+
+            absolute_angle = full_circles * 360 + current_normalized
+            reset_needed = delta != 0 and direction_changed
+
+            self.normalized[slot] = current_normalized
+            self.turns[slot] = full_circles
+            self.absolute[slot] = absolute_angle
+            if reset_needed:
+                self.initial[slot] = absolute_angle
+                self.direction[slot] = direction
+            if delta != 0:
+                self.timestamp[slot] = timestamp
+            return delta if not reset_needed else 0.0
+
+    def init_slot(self, slot, current_normalized, timestamp):
+        self.normalized[slot] = current_normalized
+        self.turns[slot] = 0
+        self.absolute[slot] = current_normalized
+        self.initial[slot] = current_normalized
+        self.timestamp[slot] = timestamp
+        self.direction[slot] = 0
+        self.valid[slot] = True
+
+    def update_batch(self, node_ids, normalized, timestamps,
+                     return_absolute=False):
+        """
+        Векторное обновление по пачке декодированных кадров
+
+        Результат совпадает с последовательными вызовами update(). Кадры
+        сортируются по узлу; предыдущий угол кадра - угол предыдущего кадра
+        того же узла, поэтому дельты и переходы через 0/360 считаются
+        сдвигом массива, обороты - накопленной суммой по группе, а
+        направление, база дельты и время движения - протягиванием последнего
+        значимого кадра вперед.
+
+        :param node_ids: массив node_id
+        :param normalized: массив нормализованных углов
+        :param timestamps: массив меток времени
+        :param return_absolute: вернуть также абсолютные углы по кадрам
+        :return: массив дельт (как у update()); с return_absolute -
+                 (дельты, абсолютные углы)
+        """
+        node_ids = np.asarray(node_ids)
+        normalized = np.asarray(normalized, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        n = len(node_ids)
+        if not n:
+            return (np.zeros(0), np.zeros(0)) if return_absolute else np.zeros(0)
+
+        with self.lock:
+            # Слоты для всех узлов пачки (новые узлы выделяются один раз)
+            unique_ids, inverse = np.unique(node_ids, return_inverse=True)
+            unique_slots = np.array(
+                [self.slot(int(node_id)) for node_id in unique_ids])
+
+            order = np.argsort(inverse, kind='stable')
+            group = inverse[order]
+            slots = unique_slots[group]
+            current = normalized[order]
+            times = timestamps[order]
+            positions = np.arange(n)
+            first = np.ones(n, dtype=bool)
+            first[1:] = group[1:] != group[:-1]
+            starts = np.flatnonzero(first)
+            group_start = starts[np.cumsum(first) - 1]
+            last = np.ones(n, dtype=bool)
+            last[:-1] = first[1:]
+
+            # Первый кадр нового узла - начальное состояние
+            was_valid = self.valid[slots]
+            new = first & ~was_valid
+
+            prev = np.empty(n)
+            prev[1:] = current[:-1]
+            prev[first] = self.normalized[slots[first]]
+            delta = current - prev
+            step = ((delta < -180).astype(np.int64) - (delta > 180))
+            step[new] = 0
+            delta = np.where(delta > 180, delta - 360, delta)
+            delta = np.where(delta < -180, delta + 360, delta)
+            delta[new] = 0.0
+
+            direction = np.where(
+                np.abs(delta) > DIRECTION_THRESHOLD, np.sign(delta),
+                0).astype(np.int8)
+            turns_base = np.where(was_valid, self.turns[slots], 0)
+            cumulative = np.cumsum(step)
+            turns = (turns_base + cumulative - cumulative[group_start] +
+                     step[group_start])
+            absolute = turns * 360 + current
+
+            # Направление до кадра: последнее ненулевое в группе или из
+            # состояния узла
+            base_dir = np.where(was_valid, self.direction[slots], 0)
+            marked = np.maximum.accumulate(
+                np.where(direction != 0, positions, -1))
+            dir_after = np.where(marked >= group_start,
+                                 direction[np.maximum(marked, 0)], base_dir)
+            dir_before = np.empty(n, dtype=np.int8)
+            dir_before[1:] = dir_after[:-1]
+            dir_before[first] = base_dir[first]
+            reset = (direction != 0) & (direction != dir_before)
+
+            # База дельты и время движения - от последнего значимого кадра
+            anchor = reset | new
+            marked = np.maximum.accumulate(np.where(anchor, positions, -1))
+            initial = np.where(marked >= group_start,
+                               absolute[np.maximum(marked, 0)],
+                               self.initial[slots])
+            moved = (delta != 0) | new
+            marked = np.maximum.accumulate(np.where(moved, positions, -1))
+            last_time = np.where(marked >= group_start,
+                                 times[np.maximum(marked, 0)],
+                                 self.timestamp[slots])
+
+            # Итоговое состояние узла - по последнему кадру группы
+            final = slots[last]
+            self.normalized[final] = current[last]
+            self.turns[final] = turns[last]
+            self.absolute[final] = absolute[last]
+            self.initial[final] = initial[last]
+            self.timestamp[final] = last_time[last]
+            self.direction[final] = dir_after[last]
+            self.valid[final] = True
+
+            deltas = np.empty(n)
+            deltas[order] = np.where(reset | new, 0.0, delta)
+            if return_absolute:
+                absolute_out = np.empty(n)
+                absolute_out[order] = absolute
+                return deltas, absolute_out
+            return deltas
@@ -1,25 +1,42 @@
 import can
 import struct
 import argparse
-import time
+from canbus import get_bus
+from metrics import registry
+
+STEP_COMMANDS = registry.counter('step_motor_commands_total',
+                                 'Команды шагового двигателя')
+STEP_ACK_TIMEOUTS = registry.counter(
+    'step_motor_ack_timeouts_total',
+    'Команды шагового двигателя без подтверждения 0xAA')
+STEP_SEND_ERRORS = registry.counter('step_motor_send_errors_total',
+                                    'Ошибки отправки команд шагового')
 
 
 class MoveStepMotor:
 
-    def __init__(self, channel: str = 'can0', node_id=0x101):
+    # ID ответа двигателя (подтверждение 0xAA)
+    RESPONSE_ID = 0x101
+
+    def __init__(self,
+                 channel: str = 'can0',
+                 node_id=0x101,
+                 interface: str = 'socketcan'):
         """
         Класс для отправки команд управления двигателем через CAN-интерфейс
 
+        Использует общую шину канала (canbus.SharedBus): создание объекта
+        не открывает новый сокет.
+
         :param channel: CAN-интерфейс (например 'can0')
         :param node_id: ID узла в CAN-сети (по умолчанию 0x101)
+        :param interface: тип интерфейса python-can, если шина еще не открыта
         """
         self.node_id = node_id
         self.RESOLUTION = 1024
 
         try:
-            self.bus = can.interface.Bus(interface='socketcan',
-                                         channel=channel,
-                                         bitrate=1000000)
+            self.bus = get_bus(channel, interface)
         except Exception as e:
             raise ConnectionError(
                 f"CAN interface initialization failed: {str(e)}")
@@ -34,63 +51,86 @@ class MoveStepMotor:
         :param steps: количество шагов (0-1024)
         :return: True если отправка и ответ успешны, False в случае ошибки
         """
-        # Проверка входных параметров
-        if power not in (0, 1):
-            raise ValueError("Power must be 0 or 1")
-        if direction not in (0, 1):
-            raise ValueError("Direction must be 0 or 1")
-        if not 0 <= steps <= self.RESOLUTION:
-            raise ValueError(f"Steps must be in 0-{self.RESOLUTION} range")
-
-        # Подготовка данных
-        data = struct.pack('>B B I', power, direction, steps)
+        data = self.pack_command(power, direction, steps)
 
+        # Ожидание ответа с ID 0x101 и первым байтом 0xAA
+        response_id = self.RESPONSE_ID
         try:
             msg = can.Message(arbitration_id=self.node_id,
                               data=data,
                               is_extended_id=False)
-            self.bus.send(msg)
+            STEP_COMMANDS.inc()
+            # Ожидание только этого ответа: остальные кадры (PDO энкодеров)
+            # обрабатываются потоком приема общей шины как обычно
+            response_msg = self.bus.request(msg,
+                                            response_id,
+                                            match=self.is_ack,
+                                            timeout=1.0)
             print(
                 f"Sent CAN message: ID={hex(self.node_id)}, Data={data.hex()}")
 
-            # Ожидание ответа с ID 0x101 и первым байтом 0xAA
-            response_id = 0x101
-            timeout = 1.0  # Таймаут ожидания в секундах
-            start_time = time.time()
-            response_received = False
-
-            while time.time() - start_time < timeout:
-                remaining_timeout = timeout - (time.time() - start_time)
-                response_msg = self.bus.recv(remaining_timeout)
-
-                if response_msg and response_msg.arbitration_id == response_id:
-                    if len(response_msg.data
-                           ) >= 1 and response_msg.data[0] == 0xAA:
-                        print(
-                            f"Received response: ID={hex(response_id)}, Data={response_msg.data.hex()}"
-                        )
-                        msg = can.Message(
-                            arbitration_id=self.node_id,
-                            data=[0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
-                            is_extended_id=False)
-                        self.bus.send(msg)
-                        response_received = True
-                        break
-
-            if not response_received:
+            if response_msg is None:
+                STEP_ACK_TIMEOUTS.inc()
                 print("Timeout waiting for response")
                 return False
 
+            print(
+                f"Received response: ID={hex(response_id)}, Data={response_msg.data.hex()}"
+            )
+            self.release()
             return True
 
         except can.CanError as e:
+            STEP_SEND_ERRORS.inc()
             print(f"CAN send error: {e}")
             return False
 
+    def pack_command(self, power, direction, steps):
+        """Проверка параметров и данные кадра команды"""
+        if power not in (0, 1):
+            raise ValueError("Power must be 0 or 1")
+        if direction not in (0, 1):
+            raise ValueError("Direction must be 0 or 1")
+        if not 0 <= steps <= self.RESOLUTION:
+            raise ValueError(f"Steps must be in 0-{self.RESOLUTION} range")
+        return struct.pack('>B B I', power, direction, steps)
+
+    def command(self, power, direction, steps):
+        """
+        Неблокирующая отправка команды (для регуляторов)
+
+        :return: concurrent.futures.Future подтверждения 0xAA; после него
+                 вызывающий отправляет release(). При ненужном ожидании -
+                 bus.discard(RESPONSE_ID, future)
+        """
+        msg = can.Message(arbitration_id=self.node_id,
+                          data=self.pack_command(power, direction, steps),
+                          is_extended_id=False)
+        future = self.bus.expect(self.RESPONSE_ID, self.is_ack)
+        try:
+            self.bus.send(msg)
+        except can.CanError:
+            STEP_SEND_ERRORS.inc()
+            self.bus.discard(self.RESPONSE_ID, future)
+            raise
+        STEP_COMMANDS.inc()
+        return future
+
+    def release(self):
+        """Нулевая команда после подтверждения"""
+        msg = can.Message(arbitration_id=self.node_id,
+                          data=[0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
+                          is_extended_id=False)
+        self.bus.send(msg)
+
+    @staticmethod
+    def is_ack(msg):
+        """Подтверждение двигателя: первый байт 0xAA"""
+        return len(msg.data) >= 1 and msg.data[0] == 0xAA
+
     def close(self):
-        """Корректно закрывает CAN-интерфейс"""
-        if hasattr(self, 'bus') and self.bus:
-            self.bus.shutdown()
+        """Освобождает двигатель; общая шина остается открытой"""
+        self.bus = None
 
     def __enter__(self):
         return self
@@ -0,0 +1,195 @@
+import collections
+import time
+import tkinter as tk
+
+import numpy as np
+
+# Частота перерисовки графиков, кадров/с
+CHART_HZ = 60
+
+
+class StripBuffer:
+    """
+    Столбцы графика: min/max значений за интервал одного пикселя
+
+    Кольцо из width столбцов по window секунд: отсчет попадает в столбец
+    своего момента времени (O(1)), устаревшие столбцы очищаются при сдвиге.
+    Отрисовка читает width столбцов - стоимость зависит от ширины экрана, а
+    не от числа отсчетов.
+    """
+
+    def __init__(self, width, window=10.0):
+        """
+        :param width: число столбцов (ширина графика в пикселях)
+        :param window: интервал времени на графике, с
+        """
+        self.width = width
+        self.window = window
+        self.column_time = window / width
+        self.mins = np.full(width, np.nan)
+        self.maxs = np.full(width, np.nan)
+        # Номер последнего столбца от начала отсчета времени
+        self.last = None
+
+    def advance(self, column):
+        """Сдвиг кольца до столбца column с очисткой пропущенных"""
+        if self.last is None or column - self.last >= self.width:
+            self.mins[:] = np.nan
+            self.maxs[:] = np.nan
+        elif column > self.last:
+            cleared = np.arange(self.last + 1, column + 1) % self.width
+            self.mins[cleared] = np.nan
+            self.maxs[cleared] = np.nan
+        if self.last is None or column > self.last:
+            self.last = column
+
+    def add(self, timestamps, values):
+        """Пачка отсчетов (массивы одной длины, время по возрастанию)"""
+        if not len(timestamps):
+            return
+        columns = (np.asarray(timestamps) // self.column_time).astype(
+            np.int64)
+        self.advance(int(columns[-1]))
+        keep = columns > self.last - self.width
+        index = columns[keep] % self.width
+        values = np.asarray(values, dtype=np.float64)[keep]
+        np.fmin.at(self.mins, index, values)
+        np.fmax.at(self.maxs, index, values)
+
+    def columns(self, now):
+        """(x, min, max) непустых столбцов, x - от 0 (старый) до width - 1"""
+        self.advance(int(now // self.column_time))
+        order = np.arange(self.last + 1,
+                          self.last + 1 + self.width) % self.width
+        mins = self.mins[order]
+        maxs = self.maxs[order]
+        filled = ~np.isnan(mins)
+        return np.flatnonzero(filled), mins[filled], maxs[filled]
+
+
+class StripChart:
+    """
+    График энкодера на tk.Canvas: угол и скорость со своими масштабами
+
+    Каждая кривая - одна линия Canvas: на столбец две точки (min и max),
+    при перерисовке меняются только ее координаты.
+    """
+
+    TRACES = (('angle', '#1f77b4', '°'), ('velocity', '#d62728', '°/с'))
+
+    def __init__(self, parent, title, width=600, height=80, window=10.0):
+        self.width = width
+        self.height = height
+        self.canvas = tk.Canvas(parent,
+                                width=width,
+                                height=height,
+                                background='white',
+                                highlightthickness=0)
+        self.canvas.create_text(4, 2, text=title, anchor='nw')
+        self.buffers = {}
+        self.lines = {}
+        self.labels = {}
+        for row, (name, color, unit) in enumerate(self.TRACES):
+            self.buffers[name] = StripBuffer(width, window)
+            self.lines[name] = self.canvas.create_line(0, 0, 0, 0,
+                                                       fill=color)
+            self.labels[name] = self.canvas.create_text(width - 4,
+                                                        2 + 12 * row,
+                                                        anchor='ne',
+                                                        fill=color)
+        self.units = {name: unit for name, _, unit in self.TRACES}
+
+    def add(self, name, timestamps, values):
+        self.buffers[name].add(timestamps, values)
+
+    def redraw(self, now):
+        for name, buffer in self.buffers.items():
+            x, mins, maxs = buffer.columns(now)
+            line = self.lines[name]
+            if len(x) < 2:
+                self.canvas.coords(line, 0, 0, 0, 0)
+                continue
+            low = float(mins.min())
+            high = float(maxs.max())
+            span = max(high - low, 1e-6)
+            scale = (self.height - 4) / span
+            points = np.empty((len(x), 4))
+            points[:, 0] = x
+            points[:, 1] = self.height - 2 - (mins - low) * scale
+            points[:, 2] = x
+            points[:, 3] = self.height - 2 - (maxs - low) * scale
+            self.canvas.coords(line, points.ravel().tolist())
+            self.canvas.itemconfigure(
+                self.labels[name],
+                text=f"{maxs[-1]:.1f}{self.units[name]} "
+                f"[{low:.1f}..{high:.1f}]")
+
+
+class ChartPanel:
+    """
+    Графики всех энкодеров
+
+    Поток приема только добавляет отсчеты в кольцевые очереди узлов
+    (deque с maxlen: append и popleft потокобезопасны); таймер Tk забирает
+    их в StripBuffer и перерисовывает графики.
+    """
+
+    def __init__(self, parent, depth=4096, **chart_options):
+        """
+        :param depth: отсчетов на узел между кадрами отрисовки (старые
+                      вытесняются)
+        :param chart_options: параметры StripChart (width, height, window)
+        """
+        self.frame = tk.Frame(parent)
+        self.depth = depth
+        self.chart_options = chart_options
+        self.charts = {}
+        # (node_id, кривая) -> deque[(время, значение)]
+        self.samples = {}
+
+    def feed(self, name, data, received=None):
+        """
+        Отсчеты из потока приема
+
+        :param name: 'angle' (encoder_data) или 'velocity' (motion_data)
+        :param data: {node_id: состояние} или {node_id: (скорость, ускорение)}
+        """
+        received = time.monotonic() if received is None else received
+        for node_id, values in data.items():
+            key = (node_id, name)
+            queue = self.samples.get(key)
+            if queue is None:
+                queue = self.samples.setdefault(
+                    key, collections.deque(maxlen=self.depth))
+            # Угол - абсолютный (индекс 2 состояния), скорость - первая
+            queue.append((received, values[2] if name == 'angle' else
+                          values[0]))
+
+    def chart(self, node_id):
+        chart = self.charts.get(node_id)
+        if chart is None:
+            chart = StripChart(self.frame, f"Node {node_id}",
+                               **self.chart_options)
+            chart.canvas.pack(fill=tk.X, pady=1)
+            self.charts[node_id] = chart
+        return chart
+
+    def remove(self, node_id):
+        # Ключи бинарного протокола - int, JSON - str
+        for key in [key for key in self.samples if str(key[0]) == str(node_id)]:
+            self.samples.pop(key, None)
+        for key in [key for key in self.charts if str(key) == str(node_id)]:
+            self.charts.pop(key).canvas.destroy()
+
+    def render(self, now=None):
+        """Кадр отрисовки (из потока Tk)"""
+        now = time.monotonic() if now is None else now
+        for (node_id, name), queue in list(self.samples.items()):
+            count = len(queue)
+            if not count:
+                continue
+            batch = [queue.popleft() for _ in range(count)]
+            timestamps, values = zip(*batch)
+            self.chart(node_id).add(name, timestamps, values)
+        for chart in self.charts.values():
+            chart.redraw(now)
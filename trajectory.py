@@ -0,0 +1,347 @@
+import argparse
+import functools
+import math
+import time
+
+import can
+import numpy as np
+
+from dc_motor import motor_message
+from scheduler import MODE_ONCE, sync_message
+from step_motor import STEP_ACK_TIMEOUTS
+
+# Когда отправлять SYNC при потоковой передаче таблицы
+SYNC_NONE = 'none'
+SYNC_START = 'start'  # один SYNC перед первой строкой - общий старт осей
+SYNC_TICK = 'tick'  # SYNC в начале каждой строки (синхронные TPDO энкодеров)
+SYNC_MODES = (SYNC_NONE, SYNC_START, SYNC_TICK)
+
+
+class TrapezoidProfile:
+    """
+    Трапецеидальный профиль скорости: разгон, движение, торможение
+
+    Если до max_velocity не разогнаться, профиль треугольный. Позиция,
+    скорость и первообразная позиции считаются аналитически для массива
+    моментов времени.
+    """
+
+    def __init__(self, distance, max_velocity, max_acceleration):
+        """
+        :param distance: перемещение со знаком (градусы, шаги и т.п.)
+        :param max_velocity: максимальная скорость, единиц/с
+        :param max_acceleration: максимальное ускорение, единиц/с²
+        """
+        if not (max_velocity > 0 and max_acceleration > 0):
+            raise ValueError("Скорость и ускорение должны быть больше 0")
+        self.distance = distance
+        self.sign = 1.0 if distance >= 0 else -1.0
+        length = abs(distance)
+        self.acceleration = max_acceleration
+        if length * max_acceleration < max_velocity**2:
+            # Треугольный профиль
+            self.ramp = math.sqrt(length / max_acceleration)
+            self.peak = max_acceleration * self.ramp
+            self.cruise = 0.0
+        else:
+            self.ramp = max_velocity / max_acceleration
+            self.peak = max_velocity
+            self.cruise = length / max_velocity - self.ramp
+        # Конец трапеции (у S-образного профиля duration длиннее)
+        self.end = 2 * self.ramp + self.cruise
+        self.duration = self.end
+
+    def unsigned_position(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        a, ta, length = self.acceleration, self.ramp, abs(self.distance)
+        t2 = ta + self.cruise
+        end = self.end
+        return np.select([t <= 0, t < ta, t < t2, t < end], [
+            0.0, 0.5 * a * t * t, 0.5 * a * ta * ta + self.peak * (t - ta),
+            length - 0.5 * a * (end - t)**2
+        ], length)
+
+    def unsigned_integral(self, t):
+        """Первообразная позиции (для S-образного профиля)"""
+        t = np.asarray(t, dtype=np.float64)
+        a, ta, tc, vp = self.acceleration, self.ramp, self.cruise, self.peak
+        length = abs(self.distance)
+        t2 = ta + tc
+        end = self.end
+        p1 = a * ta**3 / 6
+        p2 = p1 + 0.5 * a * ta * ta * tc + 0.5 * vp * tc * tc
+        p3 = p2 + length * ta - a * ta**3 / 6
+        return np.select([t <= 0, t < ta, t < t2, t < end], [
+            0.0, a * t**3 / 6,
+            p1 + 0.5 * a * ta * ta * (t - ta) + 0.5 * vp * (t - ta)**2,
+            p2 + length * (t - t2) - a / 6 * ((end - t2)**3 - (end - t)**3)
+        ], p3 + length * (t - end))
+
+    def position(self, t):
+        return self.sign * self.unsigned_position(t)
+
+    def velocity(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        a, ta = self.acceleration, self.ramp
+        end = self.end
+        speed = np.select([t <= 0, t < ta, t < ta + self.cruise, t < end],
+                          [0.0, a * t, self.peak, a * (end - t)], 0.0)
+        return self.sign * speed
+
+
+class SCurveProfile(TrapezoidProfile):
+    """
+    S-образный профиль: ускорение нарастает с ограниченным рывком
+
+    Скорость трапецеидального профиля усредняется скользящим окном
+    jerk_time = max_acceleration / max_jerk: ускорение становится
+    трапецеидальным, рывок не больше max_jerk, перемещение то же, профиль
+    длиннее на jerk_time.
+    """
+
+    def __init__(self, distance, max_velocity, max_acceleration, max_jerk):
+        """
+        :param max_jerk: максимальный рывок, единиц/с³
+        """
+        if not max_jerk > 0:
+            raise ValueError("Рывок должен быть больше 0")
+        super().__init__(distance, max_velocity, max_acceleration)
+        self.jerk_time = max_acceleration / max_jerk
+        self.duration += self.jerk_time
+
+    def position(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        tj = self.jerk_time
+        return self.sign * (self.unsigned_integral(t) -
+                            self.unsigned_integral(t - tj)) / tj
+
+    def velocity(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        tj = self.jerk_time
+        return self.sign * (self.unsigned_position(t) -
+                            self.unsigned_position(t - tj)) / tj
+
+
+def make_profile(kind, distance, max_velocity, max_acceleration,
+                 max_jerk=None):
+    """
+    Профиль по имени
+
+    :param kind: 'trapezoid' или 's_curve' (нужен max_jerk)
+    """
+    if kind == 'trapezoid':
+        return TrapezoidProfile(distance, max_velocity, max_acceleration)
+    if kind == 's_curve':
+        if max_jerk is None:
+            raise ValueError("Для s_curve нужен max_jerk")
+        return SCurveProfile(distance, max_velocity, max_acceleration,
+                             max_jerk)
+    raise ValueError(f"Неизвестный профиль: {kind}")
+
+
+def ticks(profile, period):
+    """Моменты строк таблицы: period, 2 * period, ... до конца профиля"""
+    count = max(int(math.ceil(profile.duration / period - 1e-9)), 1)
+    return np.arange(1, count + 1) * period
+
+
+class StepperHandshake:
+    """
+    Команды шагового двигателя из строк таблицы с подтверждением 0xAA
+
+    Как в MoveStepMotor.send_motor_command и batch: следующая команда
+    уходит только после подтверждения предыдущей и нулевого кадра
+    release(). Поток отправки не ждет: пока подтверждения нет, шаги строк
+    копятся и уходят одной командой после него - позиция профиля не
+    теряется, движение отстает. Без подтверждения за ack_timeout ожидание
+    снимается (step_motor_ack_timeouts_total).
+    """
+
+    def __init__(self, motor, ack_timeout=1.0):
+        """
+        :param motor: step_motor.MoveStepMotor
+        :param ack_timeout: ожидание подтверждения, с
+        """
+        self.motor = motor
+        self.ack_timeout = ack_timeout
+        # (future подтверждения, время отправки) или None
+        self.pending = None
+        # Еще не отправленные шаги со знаком (+ - direction=1)
+        self.backlog = 0
+
+    def step(self, steps):
+        """Строка таблицы: steps шагов со знаком (0 - проверка ответа)"""
+        self.backlog += steps
+        if self.pending is not None:
+            future, sent = self.pending
+            if future.done():
+                self.motor.release()
+            elif time.monotonic() - sent >= self.ack_timeout:
+                self.motor.bus.discard(self.motor.RESPONSE_ID, future)
+                STEP_ACK_TIMEOUTS.inc()
+            else:
+                return
+            self.pending = None
+        if self.backlog == 0:
+            return
+        count = min(abs(self.backlog), self.motor.RESOLUTION)
+        direction = 1 if self.backlog > 0 else 0
+        self.pending = (self.motor.command(1, direction,
+                                           count), time.monotonic())
+        self.backlog -= count if direction == 1 else -count
+
+    def finish(self):
+        """Последняя строка: снятие ожидания и предупреждение о потерях"""
+        if self.pending is not None:
+            future, _ = self.pending
+            if future.done():
+                self.motor.release()
+            else:
+                self.motor.bus.discard(self.motor.RESPONSE_ID, future)
+                STEP_ACK_TIMEOUTS.inc()
+            self.pending = None
+        if self.backlog:
+            print(f"Шаговый {self.motor.node_id:X}: не отправлено "
+                  f"{self.backlog} шагов")
+            self.backlog = 0
+
+
+def stepper_table(motor,
+                  profile,
+                  period,
+                  steps_per_rev=1024,
+                  direction_sign=1,
+                  ack_timeout=1.0):
+    """
+    Таблица команд шагового двигателя: шаги за каждый период
+
+    Целевая позиция строки округляется до шага, в команду идет разность с
+    предыдущей строкой - ошибка округления не накапливается. Команды идут
+    через StepperHandshake (подтверждение 0xAA и release() перед
+    следующей); после профиля - строки на ack_timeout для последнего
+    подтверждения.
+
+    :param motor: step_motor.MoveStepMotor (ID узла и проверка команды)
+    :param profile: профиль в градусах вала
+    :param steps_per_rev: шагов на оборот
+    :param direction_sign: как в position_control: 1 - direction=1
+                           увеличивает угол
+    :param ack_timeout: ожидание подтверждения команды, с
+    :return: список строк (вызовы StepperHandshake)
+    """
+    targets = np.rint(
+        profile.position(ticks(profile, period)) * steps_per_rev / 360.0)
+    deltas = np.diff(targets, prepend=0.0).astype(np.int64)
+    if len(deltas) and np.abs(deltas).max() > motor.RESOLUTION:
+        raise ValueError(f"Больше {motor.RESOLUTION} шагов за период: "
+                         f"уменьшите period или max_velocity")
+    handshake = StepperHandshake(motor, ack_timeout)
+    rows = [[functools.partial(handshake.step, delta * direction_sign)]
+            for delta in deltas.tolist()]
+    tail = int(math.ceil(ack_timeout / period))
+    rows.extend([functools.partial(handshake.step, 0)] for _ in range(tail))
+    rows.append([handshake.finish])
+    return rows
+
+
+def dc_table(motor_id, profile, period, full_speed=None):
+    """
+    Таблица команд DC-двигателя (только вкл/выкл и направление)
+
+    Скорость профиля передается скважностью: доля включенных периодов
+    равна velocity / full_speed, включения распределены сигма-дельта
+    модуляцией. Последняя строка выключает двигатель.
+
+    :param motor_id: ID мотора (2XX/3XX, как в dc_motor)
+    :param profile: профиль в единицах двигателя
+    :param full_speed: скорость при постоянном включении (по умолчанию -
+                       пиковая скорость профиля)
+    :return: список строк (списков can.Message)
+    """
+    velocity = profile.velocity(ticks(profile, period) - 0.5 * period)
+    full_speed = full_speed or float(np.abs(velocity).max()) or 1.0
+    duty = np.minimum(np.abs(velocity) / full_speed, 1.0)
+    direction = 1 if profile.distance >= 0 else 0
+    rows = []
+    accumulator = 0.0
+    for value in duty.tolist():
+        accumulator += value
+        power = 1 if accumulator >= 0.5 else 0
+        accumulator -= power
+        rows.append([motor_message(motor_id, power, direction)])
+    rows.append([motor_message(motor_id, 0, 0)])
+    return rows
+
+
+def merge_tables(tables, sync=SYNC_START):
+    """
+    Строки нескольких осей в одну таблицу для одного потока отправки
+
+    :param tables: таблицы осей (stepper_table, dc_table)
+    :param sync: режим SYNC (SYNC_MODES)
+    """
+    if sync not in SYNC_MODES:
+        raise ValueError(f"Неизвестный режим SYNC: {sync}")
+    length = max((len(table) for table in tables), default=0)
+    rows = []
+    for index in range(length):
+        row = [sync_message()] if sync == SYNC_TICK else []
+        for table in tables:
+            if index < len(table):
+                row.extend(table[index])
+        rows.append(row)
+    if sync == SYNC_START:
+        # Общий фронт SYNC, затем первые команды всех осей
+        rows.insert(0, [sync_message()])
+    return rows
+
+
+def stream(scheduler, name, tables, period, sync=SYNC_START):
+    """
+    Запуск таблиц осей одной задачей планировщика
+
+    Все оси идут по одной временной сетке: строка = команды всех осей
+    периода. Поток отправки только берет строку и отправляет.
+
+    :param scheduler: scheduler.TransmitScheduler
+    :return: длительность передачи, с
+    """
+    rows = merge_tables(tables, sync)
+    scheduler.add(name, rows, period, mode=MODE_ONCE)
+    return len(rows) * period
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Движение шагового двигателя по профилю')
+    parser.add_argument('--channel', default='can0')
+    parser.add_argument('--distance',
+                        type=float,
+                        required=True,
+                        help='Перемещение, градусы')
+    parser.add_argument('--profile',
+                        choices=('trapezoid', 's_curve'),
+                        default='trapezoid')
+    parser.add_argument('--velocity', type=float, default=180.0)
+    parser.add_argument('--acceleration', type=float, default=720.0)
+    parser.add_argument('--jerk', type=float, default=7200.0)
+    parser.add_argument('--period', type=float, default=0.01)
+    args = parser.parse_args()
+
+    import time
+    from canbus import get_bus
+    from scheduler import TransmitScheduler
+    from step_motor import MoveStepMotor
+    profile = make_profile(args.profile, args.distance, args.velocity,
+                           args.acceleration, args.jerk)
+    with MoveStepMotor(channel=args.channel) as motor:
+        table = stepper_table(motor, profile, args.period)
+        scheduler = TransmitScheduler(get_bus(args.channel))
+        seconds = stream(scheduler, 'trajectory', [table], args.period)
+        print(f"Профиль {args.profile}: {profile.duration:.3f} с, "
+              f"{len(table)} строк")
+        time.sleep(seconds + 0.1)
+        task = scheduler.list()
+        scheduler.cancel_all()
+        if task:
+            print(f"Пропущено периодов: {task[0].get('overruns', 0)}")